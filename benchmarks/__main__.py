@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+from pathlib import Path
+from typing import Callable, Dict, List
+from unittest.mock import patch
+
+from eo_datascience import clean_nb, merge_envs, render_sfinx_toc
+from eo_datascience.profiling import peak_rss
+
+from benchmarks.synthetic import generate_book
+
+STAGES = clean_nb.DEFAULT_STAGES + ["offload"]
+# Benchmarks doing their work in worker processes
+PROCESS_CASES = {"clean_nb.cli"}
+
+
+@contextmanager
+def working_directory(path: Path):
+    cwd = Path.cwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def run_cli(main: Callable, *args: str) -> None:
+    # Keep stdout clean for the JSON report
+    with patch.object(sys, "argv", [main.__module__, *args]), redirect_stdout(
+        sys.stderr
+    ):
+        main()
+
+
+def forked_peak_rss(func: Callable) -> int:
+    # Peak RSS of a forked run and the worker processes it starts, which
+    # tracemalloc cannot see; the fork keeps earlier benchmarks' workers out
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        code = 1
+        try:
+            func()
+            os.write(write, str(peak_rss()).encode())
+            code = 0
+        finally:
+            os._exit(code)
+    os.close(write)
+    with os.fdopen(read) as f:
+        value = f.read()
+    os.waitpid(pid, 0)
+    if not value:
+        raise RuntimeError("the forked memory measurement failed")
+    return int(value)
+
+
+def measure(
+    func: Callable, setup: Callable, repeat: int, processes: bool = False
+) -> Dict:
+    timings = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    # Separate run, tracemalloc distorts the timings
+    setup()
+    if processes:
+        memory, peak = "rss", forked_peak_rss(func)
+    else:
+        memory = "tracemalloc"
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return dict(
+        min=min(timings),
+        median=statistics.median(timings),
+        timings=timings,
+        peak_memory_bytes=peak,
+        memory=memory,
+    )
+
+
+def benchmarks(book: Path, scratch: Path, jobs: int) -> Dict[str, Callable]:
+    notebooks = book / "notebooks"
+    out = scratch / "out"
+    cases = {}
+    for stage in STAGES:
+        cases[f"clean_nb.stage.{stage}"] = lambda stage=stage: (
+            clean_nb.convert_notebooks(notebooks, out, stages=[stage], jobs=1)
+        )
+    cases["clean_nb.pipeline"] = lambda: clean_nb.convert_notebooks(
+        notebooks, out, jobs=1
+    )
+    cases["clean_nb.cli"] = lambda: run_cli(
+        clean_nb.main, str(notebooks), str(out), "--no-cache", "--jobs", str(jobs)
+    )
+
+    def merge_envs_cli():
+        with working_directory(book):
+            run_cli(merge_envs.main, "--out", str(scratch / "environment.yml"))
+
+    def render_sfinx_toc_cli():
+        with working_directory(book):
+            run_cli(render_sfinx_toc.main, str(scratch))
+
+    cases["merge_envs.cli"] = merge_envs_cli
+    cases["render_sfinx_toc.cli"] = render_sfinx_toc_cli
+    return cases
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> Dict:
+    params = dict(
+        notebooks=args.notebooks,
+        cells=args.cells,
+        citations=args.citations,
+        callouts=args.callouts,
+        output_size=args.output_size,
+        parts=args.parts,
+        depth=args.depth,
+        seed=args.seed,
+    )
+    results: List[Dict] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        book = generate_book(Path(tmp) / "book", **params)
+        scratch = Path(tmp) / "scratch"
+
+        def setup():
+            shutil.rmtree(scratch, ignore_errors=True)
+            scratch.mkdir()
+
+        for name, func in benchmarks(book, scratch, args.jobs).items():
+            if args.filter and args.filter not in name:
+                continue
+            try:
+                result = dict(
+                    name=name,
+                    **measure(func, setup, args.repeat, name in PROCESS_CASES),
+                )
+            except (Exception, SystemExit) as e:
+                result = dict(name=name, error=f"{type(e).__name__}: {e}")
+            results.append(result)
+            print(_format_result(result), file=sys.stderr)
+
+    return dict(
+        commit=git_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        params=params,
+        results=results,
+    )
+
+
+def _format_result(result: Dict) -> str:
+    if "error" in result:
+        return f"{result['name']:<32} {result['error']}"
+    return (
+        f"{result['name']:<32} {result['min'] * 1e3:10.1f} ms"
+        f" {result['peak_memory_bytes'] / 2**20:10.1f} MiB"
+        f" ({result.get('memory', 'tracemalloc')})"
+    )
+
+
+def compare(args: argparse.Namespace) -> int:
+    with open(args.baseline) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    with open(args.contender) as f:
+        contender = {r["name"]: r for r in json.load(f)["results"]}
+
+    regressions = 0
+    print(f"{'benchmark':<32} {'baseline':>12} {'contender':>12} {'ratio':>8}")
+    for name, new in contender.items():
+        old = baseline.get(name)
+        if old is None or "error" in old or "error" in new:
+            continue
+        ratio = new["min"] / old["min"]
+        flag = " !" if ratio > args.threshold else ""
+        regressions += bool(flag)
+        print(
+            f"{name:<32} {old['min'] * 1e3:10.1f}ms {new['min'] * 1e3:10.1f}ms"
+            f" {ratio:8.2f}{flag}"
+        )
+    return 1 if regressions else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Benchmark the conversion CLIs"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Run benchmarks on a synthetic book")
+    run_parser.add_argument("--notebooks", type=int, default=20)
+    run_parser.add_argument("--cells", type=int, default=40)
+    run_parser.add_argument("--citations", type=int, default=10)
+    run_parser.add_argument("--callouts", type=int, default=3)
+    run_parser.add_argument("--output-size", type=int, default=0)
+    run_parser.add_argument("--parts", type=int, default=2)
+    run_parser.add_argument("--depth", type=int, default=1)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    run_parser.add_argument("--filter", type=str, help="Only run matching benchmarks")
+    run_parser.add_argument("--out", type=str, help="Write JSON results to file")
+
+    compare_parser = sub.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("contender", type=str)
+    compare_parser.add_argument(
+        "--threshold", type=float, default=1.1, help="Slowdown ratio to flag"
+    )
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        sys.exit(compare(args))
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
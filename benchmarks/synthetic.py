@@ -0,0 +1,211 @@
+import base64
+import random
+from pathlib import Path
+from typing import Dict, List
+
+import nbformat
+import yaml
+
+PACKAGES = [
+    "dask",
+    "datashader",
+    "folium",
+    "holoviews",
+    "hvplot",
+    "intake",
+    "matplotlib",
+    "numpy",
+    "odc-stac",
+    "pandas",
+    "pystac-client",
+    "rioxarray",
+    "scikit-learn",
+    "scipy",
+    "xarray",
+    "zarr",
+]
+
+
+def markdown_source(rng: random.Random, citations: int, callouts: int) -> str:
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "radar", "backscatter"]
+    lines = []
+    for i in range(citations):
+        text = " ".join(rng.choices(words, k=8))
+        form = i % 3
+        if form == 0:
+            lines.append(f"{text} [@key{i}; @key{i + 1}].")
+        elif form == 1:
+            lines.append(f"As shown by @key{i}, {text}.")
+        else:
+            lines.append(f"{text} (@fig-plot{i})")
+    for i in range(callouts):
+        kind = ["note", "tip", "warning", "important", "caution"][i % 5]
+        lines += [
+            f'::: {{.callout-{kind} title="Callout {i}"}}',
+            f"A callout body: {' '.join(rng.choices(words, k=12))}",
+            ":::",
+        ]
+    lines.append("```python\nx = '@not_a_citation'\n```")
+    return "\n".join(lines)
+
+
+def large_outputs(rng: random.Random, size: int) -> List[Dict]:
+    if not size:
+        return []
+    png = base64.b64encode(rng.randbytes(size)).decode("ascii")
+    html = "<div class='bk-root'>" + "x" * size + "</div>"
+    return [
+        nbformat.v4.new_output("display_data", {"image/png": png, "text/plain": "F"}),
+        nbformat.v4.new_output("display_data", {"text/html": html}),
+    ]
+
+
+def make_notebook(
+    rng: random.Random,
+    title: str,
+    cells: int,
+    citations: int,
+    callouts: int,
+    output_size: int,
+) -> nbformat.NotebookNode:
+    nb = nbformat.v4.new_notebook(
+        metadata={
+            "kernelspec": {
+                "name": "eo-datascience",
+                "language": "python",
+                "display_name": "eo-datascience",
+            }
+        }
+    )
+    frontmatter = f"---\ntitle: {title}\nsubtitle: Synthetic chapter\n---\n\nIntro"
+    nb.cells.append(nbformat.v4.new_markdown_cell(frontmatter))
+    for i in range(cells - 1):
+        if i % 2:
+            nb.cells.append(
+                nbformat.v4.new_code_cell(
+                    f"ds = odc_stac.load(items, chunks={{'x': {i}}})",
+                    execution_count=i,
+                    outputs=large_outputs(rng, output_size),
+                )
+            )
+        else:
+            source = markdown_source(rng, citations, callouts)
+            nb.cells.append(nbformat.v4.new_markdown_cell(source))
+    return nb
+
+
+def make_environment(rng: random.Random, name: str) -> Dict:
+    dependencies = sorted(rng.sample(PACKAGES, k=rng.randint(4, len(PACKAGES))))
+    pinned = [
+        f"{dep}={rng.randint(1, 3)}.{rng.randint(0, 20)}" if rng.random() < 0.3 else dep
+        for dep in dependencies
+    ]
+    return {
+        "name": name,
+        "channels": ["conda-forge"],
+        "dependencies": [f"python=3.{rng.choice([11, 12])}"] + pinned,
+    }
+
+
+def _write_yaml(path: Path, data: Dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        yaml.dump(data, f, sort_keys=False)
+
+
+def _write_notebook(path: Path, nb: nbformat.NotebookNode) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    nbformat.write(nb, path)
+
+
+def _chapter_tree(
+    rng: random.Random,
+    root: Path,
+    prefix: str,
+    notebooks: int,
+    depth: int,
+    params: Dict,
+) -> List:
+    # Each level is a part with its own chapter file and `notebooks` children
+    entries = []
+    for i in range(notebooks):
+        stem = f"{prefix}/chapter_{i:03d}"
+        (root / "chapters" / f"{stem}.qmd").parent.mkdir(parents=True, exist_ok=True)
+        (root / "chapters" / f"{stem}.qmd").write_text(f"# {stem}\n")
+        nb = make_notebook(rng, stem, **params)
+        _write_notebook(root / "notebooks" / f"{stem}.ipynb", nb)
+        _write_yaml(
+            root / "notebooks" / f"{stem}.yml", make_environment(rng, Path(stem).name)
+        )
+        entry = f"chapters/{stem}.qmd"
+        if depth > 1:
+            children = _chapter_tree(
+                rng, root, f"{stem}_sub", max(1, notebooks // 2), depth - 1, params
+            )
+            entry = {"part": entry, "chapters": children}
+        entries.append(entry)
+    return entries
+
+
+def generate_book(
+    root: str | Path,
+    notebooks: int = 20,
+    cells: int = 40,
+    citations: int = 10,
+    callouts: int = 3,
+    output_size: int = 0,
+    parts: int = 2,
+    depth: int = 1,
+    seed: int = 0,
+) -> Path:
+    rng = random.Random(seed)
+    root = Path(root)
+    params = dict(
+        cells=cells, citations=citations, callouts=callouts, output_size=output_size
+    )
+    per_part = max(1, notebooks // (parts + 1))
+
+    (root / "chapters").mkdir(parents=True, exist_ok=True)
+    (root / "index.qmd").write_text("# Index\n")
+    main = []
+    appendices = []
+    for i, kind in enumerate(["courses"] + [f"appendix{j}" for j in range(parts)]):
+        part = f"{kind}/part_{i}"
+        (root / "chapters" / f"{part}.qmd").parent.mkdir(parents=True, exist_ok=True)
+        (root / "chapters" / f"{part}.qmd").write_text(f"# {part}\n")
+        _write_notebook(
+            root / "notebooks" / f"{part}.ipynb", make_notebook(rng, part, **params)
+        )
+        section = {
+            "part": f"chapters/{part}.qmd",
+            "chapters": _chapter_tree(rng, root, part, per_part, depth, params),
+        }
+        (main if i == 0 else appendices).append(section)
+
+    references = make_notebook(rng, "References", 1, 0, 0, 0)
+    references.cells = []
+    references.cells.append(nbformat.v4.new_markdown_cell("# References\n\n"))
+    _write_notebook(root / "notebooks" / "references.ipynb", references)
+    (root / "chapters" / "references.qmd").write_text("# References\n")
+    appendices.append("chapters/references.qmd")
+
+    _write_yaml(
+        root / "_quarto.yml",
+        {
+            "project": {"type": "book"},
+            "book": {
+                "title": "Synthetic Earth Observation Datascience",
+                "chapters": ["index.qmd"] + main,
+                "appendices": appendices,
+            },
+        },
+    )
+    _write_yaml(
+        root / "environment.yml",
+        {
+            "name": "eo-datascience",
+            "channels": ["conda-forge"],
+            "dependencies": ["python=3.12", "pip", "jupyter-book"],
+        },
+    )
+    return root
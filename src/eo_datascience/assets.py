@@ -0,0 +1,309 @@
+import argparse
+import errno
+import os
+import re
+import shutil
+import sys
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from eo_datascience.manifest import file_digest, load_manifest, save_manifest
+from eo_datascience.nbio import read_notebook, write_notebook
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+ASSET_MANIFEST = ".assets.json"
+WEB_DIR = "_web"
+# Formats worth re-encoding; an animated WebP is a fraction of a GIF's size
+WEB_SUFFIXES = {".gif": ".webp", ".png": ".webp"}
+WEB_MAX_WIDTH = 1280
+FICLONE = 0x40049409
+
+# ![alt](path "title"), where the alt text may itself contain [links](...)
+_MARKDOWN_IMAGE = re.compile(
+    r"!\[(?:[^\[\]]|\[[^\]]*\])*\]\(\s*<?(?P<path>[^)\s>]+)>?(?:\s+\"[^\"]*\")?\s*\)"
+)
+_HTML_IMAGE = re.compile(r"<img\b[^>]*?\bsrc=[\"'](?P<path>[^\"']+)[\"']", re.I)
+
+
+def image_references(text: str) -> Set[str]:
+    return {
+        match.group("path")
+        for pattern in (_MARKDOWN_IMAGE, _HTML_IMAGE)
+        for match in pattern.finditer(text)
+    }
+
+
+def is_local(link: str) -> bool:
+    return not (
+        re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*:", link) or link.startswith(("/", "#"))
+    )
+
+
+def referenced_assets(nb: Dict, nb_path: str | Path) -> Set[str]:
+    # Asset paths relative to the book root; `nb_path` is relative to it too
+    nb_dir = PurePosixPath(Path(nb_path).parent.as_posix())
+    assets = set()
+    for cell in nb["cells"]:
+        if cell["cell_type"] != "markdown":
+            continue
+        for link in image_references(cell["source"]):
+            link = link.split("#")[0].split("?")[0]
+            if not link or not is_local(link):
+                continue
+            path = os.path.normpath(nb_dir / link)
+            if not path.startswith(".."):
+                assets.add(PurePosixPath(path).as_posix())
+    return assets
+
+
+def link_file(src: Path, dst: Path) -> str:
+    # Hardlink, else reflink (copy-on-write clone), else copy
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+        method = "hardlink"
+    except OSError:
+        method = "copy"
+        with open(src, "rb") as s, open(tmp, "wb") as d:
+            try:
+                if fcntl is None:
+                    raise OSError(errno.ENOTSUP, "reflinks need fcntl")
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                method = "reflink"
+            except OSError:
+                shutil.copyfileobj(s, d)
+        shutil.copystat(src, tmp)
+    tmp.replace(dst)
+    return method
+
+
+def _unchanged(src: Path, dst: Path, entry: Optional[Dict]) -> bool:
+    if not dst.exists():
+        return False
+    if os.path.samefile(src, dst):
+        return True
+    stat, published = src.stat(), dst.stat()
+    return (
+        entry is not None
+        and (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns)
+        and (published.st_size, published.st_mtime_ns)
+        == (stat.st_size, stat.st_mtime_ns)
+    )
+
+
+def web_variant(
+    src: Path, dst: Path, max_bytes: int, max_width: int = WEB_MAX_WIDTH
+) -> bool:
+    # Re-encode, halving the width until the cap is met; keep only if smaller
+    if Image is None:
+        raise ImportError(
+            "Web variants of assets require Pillow; "
+            "install it with `pip install eo_datascience[web]`"
+        )
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    with Image.open(src) as image:
+        animated = getattr(image, "n_frames", 1) > 1
+        width = min(image.width, max_width)
+        while True:
+            frames = []
+            for i in range(getattr(image, "n_frames", 1)):
+                image.seek(i)
+                frame = image.convert("RGBA")
+                if width < image.width:
+                    height = max(1, round(image.height * width / image.width))
+                    frame = frame.resize((width, height))
+                frames.append(frame)
+            frames[0].save(
+                dst,
+                "WEBP",
+                save_all=animated,
+                append_images=frames[1:],
+                duration=image.info.get("duration", 100),
+                loop=image.info.get("loop", 0),
+                quality=75,
+            )
+            if dst.stat().st_size <= max_bytes or width <= 160:
+                break
+            width //= 2
+    if dst.stat().st_size >= src.stat().st_size:
+        dst.unlink()
+        return False
+    return True
+
+
+def _replace_paths(text: str, replace: Callable[[str], str]) -> str:
+    # Only the matched path spans change, never other occurrences of the text
+    spans = sorted(
+        match.span("path")
+        for pattern in (_MARKDOWN_IMAGE, _HTML_IMAGE)
+        for match in pattern.finditer(text)
+    )
+    for start, end in reversed(spans):
+        text = text[:start] + replace(text[start:end]) + text[end:]
+    return text
+
+
+def _rewrite_references(nb_path: Path, rel_path: str, targets: Dict[str, str]) -> bool:
+    # `targets` maps root-relative image paths to the ones to link instead
+    nb = read_notebook(nb_path)
+    nb_dir = PurePosixPath(rel_path).parent
+
+    def replace(link: str) -> str:
+        target = PurePosixPath(os.path.normpath(nb_dir / link)).as_posix()
+        if target not in targets:
+            return link
+        return PurePosixPath(os.path.relpath(targets[target], nb_dir)).as_posix()
+
+    changed = False
+    for cell in nb["cells"]:
+        if cell["cell_type"] != "markdown":
+            continue
+        source = _replace_paths(cell["source"], replace)
+        if source != cell["source"]:
+            cell["source"] = source
+            changed = True
+    # Unchanged notebooks keep their mtime
+    if changed:
+        write_notebook(nb, nb_path)
+    return changed
+
+
+def _asset_entry(src: Path) -> Dict:
+    stat = src.stat()
+    return dict(sha256=file_digest(src), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def included_assets(source: Path, include: Iterable[str]) -> Set[str]:
+    # Files or directories published whether or not a notebook links them,
+    # e.g. the logos the book config points to
+    assets = set()
+    for path in include:
+        path = source / path
+        files = sorted(path.rglob("*")) if path.is_dir() else [path]
+        assets |= {f.relative_to(source).as_posix() for f in files if f.is_file()}
+    return assets
+
+
+def publish_assets(
+    source: str | Path,
+    out: str | Path,
+    web_max_bytes: Optional[int] = None,
+    include: Iterable[str] = (),
+) -> Dict:
+    # Publish the images referenced by the notebooks in `out` from `source`,
+    # which mirrors its layout (chapters/images -> notebooks/images)
+    source, out = Path(source), Path(out)
+    empty: Dict = {"assets": {}, "variants": {}, "rejected": []}
+    previous = empty | load_manifest(out / ASSET_MANIFEST)
+    manifest: Dict = {"assets": {}, "variants": {}, "rejected": []}
+    # Notebooks already pointing at a web variant still reference the original
+    originals = {variant: asset for asset, variant in previous["variants"].items()}
+    links: Dict[str, Set[str]] = {}
+    for nb_path in sorted(out.rglob("*.ipynb")):
+        rel_path = nb_path.relative_to(out).as_posix()
+        links[rel_path] = referenced_assets(read_notebook(nb_path), rel_path)
+
+    referenced = {originals.get(link, link) for refs in links.values() for link in refs}
+    missing = set()
+    for asset in sorted(referenced | included_assets(source, include)):
+        src, dst = source / asset, out / asset
+        if not src.is_file():
+            if not dst.is_file():
+                missing.add(asset)
+            continue
+        entry = previous["assets"].get(asset)
+        if not _unchanged(src, dst, entry):
+            link_file(src, dst)
+            entry = None
+        manifest["assets"][asset] = entry or _asset_entry(src)
+
+    for asset, entry in manifest["assets"].items():
+        suffix = PurePosixPath(asset).suffix.lower()
+        if web_max_bytes is None or suffix not in WEB_SUFFIXES:
+            continue
+        # Only notebook links can be pointed at a variant
+        if asset not in referenced:
+            continue
+        if entry["size"] <= web_max_bytes:
+            continue
+        # Named after the content, so each version is encoded only once
+        variant = f"{WEB_DIR}/{entry['sha256']}{WEB_SUFFIXES[suffix]}"
+        if (out / variant).exists():
+            kept = True
+        elif entry["sha256"] in previous["rejected"]:
+            kept = False
+        else:
+            kept = web_variant(source / asset, out / variant, web_max_bytes)
+        if kept:
+            manifest["variants"][asset] = variant
+        else:
+            manifest["rejected"].append(entry["sha256"])
+
+    # Point notebooks at the current variants, or back at dropped ones' originals
+    targets = dict(manifest["variants"])
+    for asset, variant in previous["variants"].items():
+        if manifest["variants"].get(asset) != variant:
+            targets[variant] = manifest["variants"].get(asset, asset)
+    for rel_path, refs in links.items():
+        if refs & set(targets):
+            _rewrite_references(out / rel_path, rel_path, targets)
+
+    # Assets published before but no longer referenced are removed
+    for asset in set(previous["assets"]) - set(manifest["assets"]):
+        (out / asset).unlink(missing_ok=True)
+    for variant in set(previous["variants"].values()) - set(
+        manifest["variants"].values()
+    ):
+        (out / variant).unlink(missing_ok=True)
+    save_manifest(out / ASSET_MANIFEST, manifest)
+    manifest["missing"] = sorted(missing)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Publish the images referenced by converted notebooks"
+    )
+    parser.add_argument("source", type=str, help="Source directory, e.g. chapters")
+    parser.add_argument("out", type=str, help="Converted notebook directory")
+    parser.add_argument(
+        "--web-max-bytes",
+        type=int,
+        help="Re-encode GIF/PNG assets larger than this as WebP for the web",
+    )
+    parser.add_argument(
+        "--include",
+        nargs="+",
+        default=[],
+        metavar="PATH",
+        help="Files or directories of SOURCE to publish even if no notebook links "
+        "them, e.g. images/logos images/icons for the book config",
+    )
+    args = parser.parse_args()
+    try:
+        manifest = publish_assets(
+            args.source,
+            args.out,
+            web_max_bytes=args.web_max_bytes,
+            include=args.include,
+        )
+    except ImportError as e:
+        sys.exit(str(e))
+    for asset in manifest["missing"]:
+        print(f"Missing asset: {asset}")
+    print(f"{len(manifest['assets'])} assets published.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import argparse
+import json
+import subprocess
+import sys
+from dataclasses import asdict, dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, List, Optional, Set
+
+import yaml
+from eo_datascience.merge_envs import environment_covers, is_environment_file
+from eo_datascience.render_sfinx_toc import (
+    DOCUMENT_SUFFIXES,
+    SOURCE_DIR,
+    TARGET_DIR,
+    build_file_index,
+)
+
+MASTER_ENVIRONMENT = "environment.yml"
+BIBLIOGRAPHY = f"{SOURCE_DIR}/references.bib"
+REFERENCES = f"{TARGET_DIR}/references.ipynb"
+# Changes here affect how every notebook is converted
+TOOLING = ("src/", "setup.cfg", "setup.py", "pyproject.toml")
+
+
+@dataclass
+class BuildGraph:
+    root: Path
+    quarto: str
+    # chapters/x.qmd -> notebooks/x.ipynb
+    sources: Dict[str, str] = field(default_factory=dict)
+    notebooks: Set[str] = field(default_factory=set)
+    environment_files: Set[str] = field(default_factory=set)
+    # notebook -> environment YAML it runs in
+    environments: Dict[str, str] = field(default_factory=dict)
+    toc: List[str] = field(default_factory=list)
+    # The `book` section of the Quarto config, which the TOC is rendered from
+    book: Dict = field(default_factory=dict)
+
+
+@dataclass
+class BuildPlan:
+    notebooks: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    environments: List[str] = field(default_factory=list)
+    # Notebooks whose environment changed, so their outputs may differ
+    execute: List[str] = field(default_factory=list)
+    toc: bool = False
+
+    def __bool__(self):
+        return bool(
+            self.notebooks
+            or self.removed
+            or self.environments
+            or self.execute
+            or self.toc
+        )
+
+
+def converted_path(source: str) -> str:
+    rel_path = PurePosixPath(source).relative_to(SOURCE_DIR)
+    return (PurePosixPath(TARGET_DIR) / rel_path).with_suffix(".ipynb").as_posix()
+
+
+def book_section(quarto_toc: Dict) -> Dict:
+    return (quarto_toc or {}).get("book") or {}
+
+
+def toc_entries(quarto_toc: Dict) -> List[str]:
+    book = book_section(quarto_toc)
+    entries: List[str] = []
+
+    def walk(entry):
+        if isinstance(entry, str):
+            entries.append(entry)
+            return
+        for key in ("part", "file", "href"):
+            value = entry.get(key)
+            if value is not None and PurePosixPath(value).suffix in DOCUMENT_SUFFIXES:
+                entries.append(value)
+        for child in entry.get("chapters") or entry.get("sections") or []:
+            walk(child)
+
+    for entry in (book.get("chapters") or []) + (book.get("appendices") or []):
+        walk(entry)
+    return entries
+
+
+def build_graph(root=".", quarto="_quarto.yml") -> BuildGraph:
+    root = Path(root)
+    index = build_file_index(root)
+    graph = BuildGraph(root=root, quarto=quarto)
+
+    for path in sorted(index):
+        suffix = PurePosixPath(path).suffix
+        if path.startswith(f"{SOURCE_DIR}/") and suffix in (".qmd", ".ipynb"):
+            graph.sources[path] = converted_path(path)
+        elif path.startswith(f"{TARGET_DIR}/") and suffix == ".ipynb":
+            graph.notebooks.add(path)
+    graph.notebooks.update(graph.sources.values())
+
+    graph.environment_files = {
+        path
+        for path in index
+        if path.startswith(f"{TARGET_DIR}/")
+        and path.endswith(".yml")
+        and is_environment_file(root / path)
+    }
+    for notebook in sorted(graph.notebooks):
+        for env_file in sorted(graph.environment_files):
+            if environment_covers(env_file, notebook):
+                graph.environments[notebook] = env_file
+                break
+
+    try:
+        with (root / quarto).open() as f:
+            quarto_toc = yaml.safe_load(f)
+        graph.toc = toc_entries(quarto_toc)
+        graph.book = book_section(quarto_toc)
+    except OSError:
+        pass
+    return graph
+
+
+def plan(
+    graph: BuildGraph, changed: Iterable[str], previous_book: Optional[Dict] = None
+) -> BuildPlan:
+    # Without the previous `book` section any config change counts as a new TOC
+    notebooks: Set[str] = set()
+    removed: Set[str] = set()
+    environments: Set[str] = set()
+    execute: Set[str] = set()
+    toc = False
+    listed = set(graph.toc)
+
+    def exists(path):
+        return (graph.root / path).exists()
+
+    for path in changed:
+        path = PurePosixPath(path).as_posix()
+        suffix = PurePosixPath(path).suffix
+        if path == graph.quarto:
+            toc = toc or previous_book is None or previous_book != graph.book
+        elif path.startswith(TOOLING):
+            notebooks |= {nb for nb in graph.notebooks if exists(nb)}
+            toc = True
+        elif path == MASTER_ENVIRONMENT:
+            environments.add(MASTER_ENVIRONMENT)
+        elif path == BIBLIOGRAPHY:
+            notebooks.add(REFERENCES)
+        elif path.startswith(f"{SOURCE_DIR}/") and suffix in (".qmd", ".ipynb"):
+            notebook = converted_path(path)
+            (notebooks if exists(path) else removed).add(notebook)
+            # Adding or deleting a listed chapter changes the book structure
+            if path in listed and not exists(path):
+                toc = True
+        elif path.startswith(f"{TARGET_DIR}/") and suffix == ".ipynb":
+            (notebooks if exists(path) else removed).add(path)
+        elif path.startswith(f"{TARGET_DIR}/") and suffix == ".yml":
+            if path in graph.environment_files or not exists(path):
+                # Every notebook environment also feeds the merged master one
+                environments |= {path, MASTER_ENVIRONMENT}
+                # Its notebooks run in a changed environment, or another one
+                # once it is deleted
+                if exists(path):
+                    covered = {
+                        nb for nb, env in graph.environments.items() if env == path
+                    }
+                else:
+                    covered = {
+                        nb for nb in graph.notebooks if environment_covers(path, nb)
+                    }
+                execute |= {nb for nb in covered if exists(nb)}
+
+    return BuildPlan(
+        notebooks=sorted(notebooks - removed),
+        removed=sorted(removed),
+        environments=sorted(environments),
+        execute=sorted(execute - removed),
+        toc=toc,
+    )
+
+
+def changed_files(rev: str, root=".") -> List[str]:
+    result = subprocess.run(
+        ["git", "diff", "--name-only", "--no-renames", rev, "--"],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.split()
+
+
+def book_at(rev: str, root=".", quarto="_quarto.yml") -> Optional[Dict]:
+    # The `book` section as of `rev`; None if git cannot tell, e.g. when the
+    # config did not exist then
+    result = subprocess.run(
+        ["git", "show", f"{rev}:./{quarto}"],
+        cwd=root,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        return None
+    return book_section(yaml.safe_load(result.stdout))
+
+
+def format_plan(plan: BuildPlan) -> str:
+    lines = [f"reconvert {notebook}" for notebook in plan.notebooks]
+    lines += [f"remove {notebook}" for notebook in plan.removed]
+    lines += [f"rebuild {environment}" for environment in plan.environments]
+    lines += [f"execute {notebook}" for notebook in plan.execute]
+    if plan.toc:
+        lines.append("regenerate _toc.yml")
+    return "\n".join(lines) if lines else "nothing to do"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Plan the minimal rebuild for a set of changed files"
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="Changed paths relative to the book root; '-' reads them from stdin",
+    )
+    parser.add_argument(
+        "--git",
+        type=str,
+        metavar="REV",
+        help="Use the files changed since REV (git diff --name-only REV)",
+    )
+    parser.add_argument("--root", type=str, default=".", help="Book root directory")
+    parser.add_argument(
+        "--quarto",
+        type=str,
+        default="_quarto.yml",
+        help="Quarto book config, relative to the root (default: %(default)s)",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the plan as JSON")
+    args = parser.parse_args()
+
+    changed = [path for path in args.paths if path != "-"]
+    if "-" in args.paths:
+        changed += sys.stdin.read().split()
+    previous_book = None
+    if args.git:
+        changed += changed_files(args.git, args.root)
+        previous_book = book_at(args.git, args.root, args.quarto)
+
+    graph = build_graph(args.root, args.quarto)
+    build_plan = plan(graph, changed, previous_book)
+    if args.json:
+        print(json.dumps(asdict(build_plan), indent=1))
+    else:
+        print(format_plan(build_plan))
+
+
+if __name__ == "__main__":
+    main()
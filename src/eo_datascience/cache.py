@@ -0,0 +1,386 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+try:
+    import fsspec
+    from fsspec.spec import AbstractBufferedFile, AbstractFileSystem
+except ImportError:  # pragma: no cover
+    fsspec = None
+
+CACHE_DIR = Path(
+    os.environ.get("EO_DATASCIENCE_CACHE", Path.home() / ".cache" / "eo_datascience")
+)
+# Large enough for a few COG tiles, small enough that header reads stay cheap
+BLOCK_SIZE = 2**20
+MAX_BYTES = 10 * 2**30
+# Seconds before the size and ETag of a cached resource are checked again
+REVALIDATE = 24 * 3600
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+_ACTIVE: Optional["BlockCache"] = None
+
+
+class CacheMiss(OSError):
+    pass
+
+
+class BlockCache:
+    # HTTP resources are stored as fixed-size blocks keyed on the URL and the
+    # resource's ETag (or size), fetched with range requests and evicted least
+    # recently used first. The index is SQLite, so notebooks executing
+    # concurrently share one cache.
+
+    def __init__(
+        self,
+        path: str | Path = CACHE_DIR,
+        max_bytes: int = MAX_BYTES,
+        block_size: int = BLOCK_SIZE,
+        offline: bool = False,
+        revalidate: float = REVALIDATE,
+        timeout: float = 60,
+    ):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.offline = offline
+        self.revalidate = revalidate
+        self.timeout = timeout
+        self.requests = 0
+        (self.path / "blocks").mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._db() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS resources (
+                    url TEXT PRIMARY KEY, key TEXT, size INTEGER, checked REAL
+                );
+                CREATE TABLE IF NOT EXISTS blocks (
+                    key TEXT, block INTEGER, size INTEGER, used REAL,
+                    PRIMARY KEY (key, block)
+                );
+                CREATE INDEX IF NOT EXISTS blocks_used ON blocks (used);
+                """)
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per thread, the local server reads from many
+        if getattr(self._local, "db", None) is None:
+            self._local.db = sqlite3.connect(self.path / "index.sqlite", timeout=60)
+        return self._local.db
+
+    def _block_path(self, key: str, block: int) -> Path:
+        return self.path / "blocks" / key[:2] / f"{key}.{block}"
+
+    def _request(self, url: str, start: int, end: int):
+        # `end` is exclusive, unlike the Range header
+        if self.offline:
+            raise CacheMiss(f"{url} is not cached (offline)")
+        request = urllib.request.Request(
+            url, headers={"Range": f"bytes={start}-{end - 1}"}
+        )
+        self.requests += 1
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _probe(self, url: str) -> Tuple[str, int]:
+        # The first block doubles as the probe for size and ETag
+        with self._request(url, 0, self.block_size) as response:
+            data = response.read()
+            etag = response.headers.get("ETag")
+            match = _CONTENT_RANGE.match(response.headers.get("Content-Range") or "")
+        if response.status == 206 and match and match.group(3) != "*":
+            size = int(match.group(3))
+        else:
+            # The server ignored the range and sent everything
+            size = len(data)
+        key = hashlib.sha256(f"{url}\0{etag or size}".encode("utf-8")).hexdigest()
+        self._store(key, 0, data[: min(size, self.block_size)])
+        if response.status == 200:
+            for block in range(1, -(-size // self.block_size)):
+                start = block * self.block_size
+                self._store(key, block, data[start : start + self.block_size])  # noqa
+        return key, size
+
+    def resource(self, url: str) -> Tuple[str, int]:
+        db = self._db()
+        row = db.execute(
+            "SELECT key, size, checked FROM resources WHERE url = ?", (url,)
+        ).fetchone()
+        if row is not None and (self.offline or time.time() - row[2] < self.revalidate):
+            return row[0], row[1]
+        try:
+            key, size = self._probe(url)
+        except OSError:
+            if row is None:
+                raise
+            # Unreachable: keep serving what is cached
+            return row[0], row[1]
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?)",
+                (url, key, size, time.time()),
+            )
+        return key, size
+
+    def size(self, url: str) -> int:
+        return self.resource(url)[1]
+
+    def _store(self, key: str, block: int, data: bytes) -> None:
+        path = self._block_path(key, block)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+        db = self._db()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?)",
+                (key, block, len(data), time.time()),
+            )
+
+    def _load(self, key: str, block: int) -> Optional[bytes]:
+        try:
+            return self._block_path(key, block).read_bytes()
+        except OSError:
+            return None
+
+    def _fetch(self, url: str, key: str, size: int, run: List[int]) -> Dict:
+        start = run[0] * self.block_size
+        end = min(size, (run[-1] + 1) * self.block_size)
+        with self._request(url, start, end) as response:
+            data = response.read()
+        if response.status == 200:
+            data = data[start:end]
+        if len(data) != end - start:
+            raise OSError(f"Short read from {url}: {len(data)} of {end - start} bytes")
+        fetched = {}
+        for block in run:
+            offset = (block - run[0]) * self.block_size
+            fetched[block] = data[offset : offset + self.block_size]  # noqa
+            self._store(key, block, fetched[block])
+        return fetched
+
+    def read(self, url: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        key, size = self.resource(url)
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return b""
+        wanted = range(start // self.block_size, (end - 1) // self.block_size + 1)
+        blocks = {block: self._load(key, block) for block in wanted}
+        missing = [block for block, data in blocks.items() if data is None]
+        # Consecutive missing blocks are fetched with a single range request
+        runs: List[List[int]] = []
+        for block in missing:
+            if runs and runs[-1][-1] == block - 1:
+                runs[-1].append(block)
+            else:
+                runs.append([block])
+        for run in runs:
+            blocks.update(self._fetch(url, key, size, run))
+
+        db = self._db()
+        with db:
+            db.executemany(
+                "UPDATE blocks SET used = ? WHERE key = ? AND block = ?",
+                [(time.time(), key, block) for block in wanted],
+            )
+        if missing:
+            self.evict()
+        data = b"".join(blocks[block] for block in wanted)
+        offset = wanted[0] * self.block_size
+        return data[start - offset : end - offset]  # noqa
+
+    def total_bytes(self) -> int:
+        return self._db().execute("SELECT SUM(size) FROM blocks").fetchone()[0] or 0
+
+    def evict(self, max_bytes: Optional[int] = None) -> int:
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        excess = self.total_bytes() - max_bytes
+        if excess <= 0:
+            return 0
+        db = self._db()
+        evicted = []
+        for key, block, size in db.execute(
+            "SELECT key, block, size FROM blocks ORDER BY used"
+        ):
+            evicted.append((key, block))
+            excess -= size
+            if excess <= 0:
+                break
+        with db:
+            db.executemany("DELETE FROM blocks WHERE key = ? AND block = ?", evicted)
+        for key, block in evicted:
+            self._block_path(key, block).unlink(missing_ok=True)
+        return len(evicted)
+
+    def clear(self) -> None:
+        self.evict(0)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Serves `/<quoted upstream URL>` from the cache, honouring Range requests,
+    # for readers with their own HTTP stack such as GDAL
+    cache: BlockCache
+
+    def _upstream(self) -> Optional[Tuple[str, int]]:
+        url = unquote(self.path.lstrip("/"))
+        try:
+            return url, self.cache.size(url)
+        except urllib.error.HTTPError as e:
+            self.send_error(e.code)
+        except OSError:
+            self.send_error(502 if not self.cache.offline else 504)
+        return None
+
+    def do_HEAD(self):
+        upstream = self._upstream()
+        if upstream is not None:
+            self.send_response(200)
+            self.send_header("Content-Length", str(upstream[1]))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+
+    def do_GET(self):
+        upstream = self._upstream()
+        if upstream is None:
+            return
+        url, size = upstream
+        match = re.match(r"bytes=(\d*)-(\d*)", self.headers.get("Range") or "")
+        if match and match.group(1):
+            start = int(match.group(1))
+            end = int(match.group(2)) + 1 if match.group(2) else size
+        elif match and match.group(2):
+            start, end = max(0, size - int(match.group(2))), size
+        else:
+            start, end = 0, size
+        end = min(end, size)
+        try:
+            data = self.cache.read(url, start, end)
+        except OSError:
+            self.send_error(502 if not self.cache.offline else 504)
+            return
+        if match:
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CacheServer:
+    def __init__(self, cache: BlockCache):
+        handler = type("Handler", (_Handler,), {"cache": cache})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def patch_url(self, url: str) -> str:
+        if not url.startswith(("http://", "https://")) or url.startswith(self.url):
+            return url
+        return f"{self.url}/{quote(url, safe='')}"
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if fsspec is not None:
+
+    class CachedHTTPFile(AbstractBufferedFile):
+        def _fetch_range(self, start, end):
+            return self.fs.cache.read(self.path, start, end)
+
+    class CachedHTTPFileSystem(AbstractFileSystem):
+        # Read-only http(s) filesystem for fsspec (and so intake, xarray and
+        # zarr) backed by a BlockCache
+        protocol = ("http", "https")
+        cachable = False
+
+        def __init__(self, cache: Optional[BlockCache] = None, **kwargs):
+            super().__init__(**kwargs)
+            self.cache = cache or _ACTIVE or BlockCache()
+
+        @classmethod
+        def _strip_protocol(cls, path):
+            return path
+
+        def info(self, path, **kwargs):
+            return {"name": path, "size": self.cache.size(path), "type": "file"}
+
+        def ls(self, path, detail=True, **kwargs):
+            info = self.info(path)
+            return [info] if detail else [path]
+
+        def _open(self, path, mode="rb", block_size=None, **kwargs):
+            if mode != "rb":
+                raise NotImplementedError("Cached HTTP files are read-only")
+            return CachedHTTPFile(
+                self,
+                path,
+                mode,
+                block_size=block_size or self.cache.block_size,
+                cache_type="readahead",
+                size=self.cache.size(path),
+            )
+
+        def cat_file(self, path, start=None, end=None, **kwargs):
+            return self.cache.read(path, start or 0, end)
+
+
+_SERVER: Optional[CacheServer] = None
+
+
+def enable(
+    path: Optional[str | Path] = None,
+    max_bytes: int = MAX_BYTES,
+    offline: Optional[bool] = None,
+    block_size: int = BLOCK_SIZE,
+) -> BlockCache:
+    # Route fsspec http(s) reads through the cache and return it; GDAL-based
+    # readers take `patch_url`, e.g. odc.stac.load(..., patch_url=patch_url)
+    global _ACTIVE
+    if offline is None:
+        offline = os.environ.get("EO_DATASCIENCE_OFFLINE", "") not in ("", "0")
+    _ACTIVE = BlockCache(path or CACHE_DIR, max_bytes, block_size, offline)
+    if fsspec is not None:
+        for protocol in CachedHTTPFileSystem.protocol:
+            fsspec.register_implementation(protocol, CachedHTTPFileSystem, clobber=True)
+    return _ACTIVE
+
+
+def patch_url(url: str) -> str:
+    global _SERVER
+    if _ACTIVE is None:
+        return url
+    if _SERVER is None or _SERVER.server.RequestHandlerClass.cache is not _ACTIVE:
+        if _SERVER is not None:
+            _SERVER.close()
+        _SERVER = CacheServer(_ACTIVE)
+    return _SERVER.patch_url(url)
+
+
+def disable() -> None:
+    global _ACTIVE, _SERVER
+    if _SERVER is not None:
+        _SERVER.close()
+    _ACTIVE = _SERVER = None
+    if fsspec is not None:
+        for protocol in CachedHTTPFileSystem.protocol:
+            fsspec.register_implementation(
+                protocol, "fsspec.implementations.http.HTTPFileSystem", clobber=True
+            )
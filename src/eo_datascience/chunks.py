@@ -0,0 +1,173 @@
+import math
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional, Tuple
+
+# GDAL's default COG block size
+TILE = 512
+# Copies of a chunk alive per task: input, intermediates and the result
+OVERHEAD = 4
+# Share of the available memory the computation may use
+MEMORY_FRACTION = 0.6
+# Chunks beyond this mostly add scheduling latency, see the dask best practices
+MAX_CHUNK_BYTES = 256 * 2**20
+TIME_DIMS = ("time", "t")
+DTYPE_SIZES = {
+    "int8": 1,
+    "uint8": 1,
+    "int16": 2,
+    "uint16": 2,
+    "float16": 2,
+    "int32": 4,
+    "uint32": 4,
+    "float32": 4,
+    "int64": 8,
+    "uint64": 8,
+    "float64": 8,
+    "complex64": 8,
+    "complex128": 16,
+}
+
+
+@dataclass
+class ChunkPlan:
+    chunks: Dict[str, int]
+    shape: Dict[str, int]
+    itemsize: int
+    bands: int
+    cores: int
+    memory: int
+    n_chunks: int = field(init=False)
+    chunk_bytes: int = field(init=False)
+
+    def __post_init__(self):
+        self.n_chunks = math.prod(
+            -(-self.shape[dim] // size) for dim, size in self.chunks.items()
+        )
+        self.chunk_bytes = math.prod(self.chunks.values()) * self.itemsize
+
+    @property
+    def tasks(self) -> int:
+        # One load task per chunk and band, as odc.stac and xarray create them
+        return self.n_chunks * self.bands
+
+    @property
+    def peak_bytes(self) -> int:
+        workers = min(self.cores, self.tasks)
+        return workers * self.chunk_bytes * self.bands * OVERHEAD
+
+    def summary(self) -> str:
+        chunks = ", ".join(f"{dim}={size}" for dim, size in self.chunks.items())
+        return (
+            f"chunks: {chunks}\n"
+            f"chunk size: {self.chunk_bytes / 2**20:.1f} MiB x {self.bands} band(s)\n"
+            f"number of chunks: {self.n_chunks}, load tasks: {self.tasks}\n"
+            f"estimated peak memory: {self.peak_bytes / 2**30:.2f} GiB of "
+            f"{self.memory / 2**30:.2f} GiB available on {self.cores} core(s)"
+        )
+
+
+def available_memory() -> int:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        return os.cpu_count() or 1
+
+
+def itemsize(dtype) -> int:
+    if hasattr(dtype, "itemsize"):
+        return dtype.itemsize
+    return DTYPE_SIZES[str(dtype)]
+
+
+def _align(size: int, tile: int, extent: int) -> int:
+    # Whole native tiles, or the full extent when it is smaller than a tile
+    return min(extent, max(tile, size // tile * tile))
+
+
+def plan_chunks(
+    shape: Dict[str, int],
+    dtype="float32",
+    bands: int = 1,
+    memory: Optional[int] = None,
+    cores: Optional[int] = None,
+    tile: int | Dict[str, int] = TILE,
+    max_chunk_bytes: int = MAX_CHUNK_BYTES,
+) -> ChunkPlan:
+    # Square spatial chunks of whole COG tiles, as large as the memory per
+    # worker allows, then grown along time; shrunk again while there are
+    # fewer chunks than cores
+    memory = available_memory() if memory is None else memory
+    cores = available_cores() if cores is None else cores
+    size = itemsize(dtype)
+    time_dim = next((dim for dim in shape if dim in TIME_DIMS), None)
+    spatial = [dim for dim in shape if dim != time_dim]
+    tiles = {
+        dim: tile.get(dim, TILE) if isinstance(tile, dict) else tile for dim in spatial
+    }
+
+    budget = memory * MEMORY_FRACTION / (cores * OVERHEAD * bands)
+    elements = max(1, int(min(budget, max_chunk_bytes) // size))
+    side = int(elements ** (1 / max(1, len(spatial))))
+    chunks = {dim: _align(side, tiles[dim], shape[dim]) for dim in spatial}
+    if time_dim is not None:
+        per_step = math.prod(chunks.values())
+        chunks = {time_dim: max(1, min(shape[time_dim], elements // per_step))} | chunks
+
+    def n_chunks():
+        return math.prod(-(-shape[dim] // chunks[dim]) for dim in chunks)
+
+    while n_chunks() < cores:
+        if time_dim is not None and chunks[time_dim] > 1:
+            chunks[time_dim] = -(-chunks[time_dim] // 2)
+            continue
+        dim = max(spatial, key=lambda dim: chunks[dim] / tiles[dim], default=None)
+        if dim is None or chunks[dim] <= tiles[dim]:
+            break
+        chunks[dim] = _align(chunks[dim] // 2, tiles[dim], shape[dim])
+    return ChunkPlan(
+        {dim: chunks[dim] for dim in shape}, dict(shape), size, bands, cores, memory
+    )
+
+
+def _as_dict(item) -> Dict:
+    return item.to_dict() if hasattr(item, "to_dict") else item
+
+
+def stac_shape(items: Iterable, bands: Iterable[str]) -> Tuple[Dict[str, int], str]:
+    # Dims and dtype at native resolution from the projection and raster
+    # extensions of the items; one time step per distinct datetime
+    items = [_as_dict(item) for item in items]
+    times = {item["properties"].get("datetime") for item in items}
+    height = width = 0
+    dtype = "float32"
+    for item in items:
+        for band in bands:
+            props = item["properties"] | item["assets"][band]
+            if "proj:shape" in props:
+                height = max(height, props["proj:shape"][0])
+                width = max(width, props["proj:shape"][1])
+            raster = (props.get("raster:bands") or [{}])[0]
+            dtype = raster.get("data_type", dtype)
+    if not height:
+        raise ValueError("The items carry no proj:shape, pass the shape instead")
+    return dict(time=len(times), y=height, x=width), dtype
+
+
+def plan_stac_chunks(items: Iterable, bands: Iterable[str], **kwargs) -> ChunkPlan:
+    # e.g. odc.stac.load(items, bands=bands, chunks=plan.chunks)
+    bands = list(bands)
+    shape, dtype = stac_shape(items, bands)
+    kwargs.setdefault("dtype", dtype)
+    return plan_chunks(shape, bands=len(bands), **kwargs)
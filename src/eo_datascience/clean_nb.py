@@ -1,8 +1,381 @@
 import argparse
+import hashlib
+import json
+import os
 import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from functools import partial
 from pathlib import Path
+from typing import Callable, Dict, List, Literal, Optional
 
 import nbformat
+from eo_datascience._version import __version__
+from eo_datascience.assets import publish_assets
+from eo_datascience.frozen import carry_frozen_outputs, seed_jupyter_cache
+from eo_datascience.manifest import file_digest, load_manifest, save_manifest
+from eo_datascience.nbio import (
+    read_notebook,
+    reads_notebook,
+    validate_notebook,
+    write_notebook,
+    writes_notebook,
+)
+from eo_datascience.outputs import OFFLOAD_THRESHOLD, offload_outputs
+from eo_datascience.profiling import (
+    NULL_PROFILER,
+    add_profile_argument,
+    finish_profile,
+    get_profiler,
+)
+from eo_datascience.streaming import read_notebook_streaming, write_notebook_streaming
+
+CACHE_MANIFEST = ".clean_nb_cache.json"
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    func: Callable
+    scope: Literal["notebook", "cell"] = "notebook"
+    cell_type: Optional[str] = None
+    # Bump when the output of a stage changes to invalidate cached conversions
+    version: int = 1
+    # Whether the stage works without cell outputs, as in streaming conversion
+    streaming: bool = True
+    # Stages reading files other than the notebook defeat the incremental cache
+    cacheable: bool = True
+
+
+# Registry of all conversion stages in the order they were registered
+STAGES: Dict[str, Stage] = {}
+DEFAULT_STAGES = ["frontmatter", "kernel", "callouts", "refs", "bibliography"]
+
+
+def register_stage(
+    name, scope="notebook", cell_type=None, version=1, streaming=True, cacheable=True
+):
+    def decorator(func):
+        STAGES[name] = Stage(
+            name, func, scope, cell_type, version, streaming, cacheable
+        )
+        return func
+
+    return decorator
+
+
+def build_pipeline(stages=DEFAULT_STAGES, options=None):
+    # Resolve stage names and fuse consecutive cell stages into one cell pass
+    options = options or {}
+    pipeline: List = []
+    for stage in stages:
+        if not isinstance(stage, Stage):
+            try:
+                stage = STAGES[stage]
+            except KeyError:
+                raise ValueError(
+                    f"Unknown stage '{stage}', choose from {', '.join(STAGES)}"
+                )
+        if options.get(stage.name):
+            stage = replace(stage, func=partial(stage.func, **options[stage.name]))
+        if stage.scope == "cell":
+            if pipeline and isinstance(pipeline[-1], list):
+                pipeline[-1].append(stage)
+            else:
+                pipeline.append([stage])
+        else:
+            pipeline.append(stage)
+    return pipeline
+
+
+def apply_pipeline(nb, pipeline, nb_path=Path(), profiler=NULL_PROFILER):
+    item = Path(nb_path).as_posix()
+    for step in pipeline:
+        if isinstance(step, Stage):
+            with profiler.timer(step.name, item):
+                step.func(nb, Path(nb_path))
+            continue
+        for cell in nb["cells"]:
+            source = cell["source"]
+            for stage in step:
+                if stage.cell_type is None or stage.cell_type == cell["cell_type"]:
+                    if profiler.enabled:
+                        start = time.perf_counter()
+                        new_source = stage.func(source)
+                        profiler.add(
+                            stage.name,
+                            item,
+                            time.perf_counter() - start,
+                            cells=1,
+                            changed_cells=int(new_source != source),
+                        )
+                        source = new_source
+                    else:
+                        source = stage.func(source)
+            cell["source"] = source
+    return nb
+
+
+def pipeline_fingerprint(pipeline):
+    stages = []
+    for step in pipeline:
+        for stage in step if isinstance(step, list) else [step]:
+            kwargs = getattr(stage.func, "keywords", {})
+            stages.append([stage.name, stage.version, kwargs])
+    payload = json.dumps([__version__, nbformat.__version__, stages], default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def convert_notebook(
+    nb_path,
+    dir,
+    out=None,
+    pipeline=None,
+    save=True,
+    data=None,
+    validate=False,
+    profiler=NULL_PROFILER,
+    stream=False,
+):
+    if pipeline is None:
+        pipeline = build_pipeline()
+    rel_path = Path(nb_path).relative_to(dir)
+    item = rel_path.as_posix()
+    if stream:
+        return _convert_streaming(nb_path, dir, out, pipeline, save, profiler)
+    if data is None:
+        with profiler.timer("read", item) as counters:
+            data = Path(nb_path).read_bytes()
+            counters["bytes_read"] = len(data)
+    with profiler.timer("parse", item) as counters:
+        nb = reads_notebook(data)
+        counters["cells"] = len(nb["cells"])
+    apply_pipeline(nb, pipeline, rel_path, profiler)
+    # Validation is opt-in and runs once, on the converted notebook
+    if validate:
+        with profiler.timer("validate", item):
+            validate_notebook(nb)
+    if save:
+        with profiler.timer("write", item) as counters:
+            counters["bytes_written"] = write_if_changed(
+                nb, substitute_path(nb_path, dir, out)
+            )
+    return nb
+
+
+def _convert_streaming(nb_path, dir, out, pipeline, save, profiler):
+    # Outputs are never parsed: they are copied from the source file on write
+    item = Path(nb_path).relative_to(dir).as_posix()
+    with profiler.timer("parse", item) as counters:
+        nb = read_notebook_streaming(nb_path)
+        counters["cells"] = len(nb["cells"])
+    apply_pipeline(nb, pipeline, Path(nb_path).relative_to(dir), profiler)
+    if save:
+        with profiler.timer("write", item) as counters:
+            counters["bytes_written"] = write_notebook_streaming(
+                nb, substitute_path(nb_path, dir, out)
+            )
+    return nb
+
+
+def _stages(pipeline):
+    return [
+        s for step in pipeline for s in (step if isinstance(step, list) else [step])
+    ]
+
+
+def _cacheable(pipeline):
+    return all(stage.cacheable for stage in _stages(pipeline))
+
+
+def check_streaming(pipeline, validate=False):
+    stages = _stages(pipeline)
+    unsupported = [stage.name for stage in stages if not stage.streaming]
+    if unsupported:
+        raise ValueError(
+            f"Stage(s) {', '.join(unsupported)} need cell outputs and cannot stream"
+        )
+    if validate:
+        raise ValueError("Validation needs the full notebook and cannot stream")
+
+
+def write_if_changed(nb, nb_path):
+    # Mirror `nbformat.write`, but leave identical outputs (and their mtime) alone
+    text = writes_notebook(nb)
+    if not text.endswith("\n"):
+        text += "\n"
+    data = text.encode("utf-8")
+    nb_path = Path(nb_path)
+    if nb_path.exists() and nb_path.read_bytes() == data:
+        return 0
+    nb_path.write_bytes(data)
+    return len(data)
+
+
+def prune_outputs(out, stale):
+    for rel_path in stale:
+        (Path(out) / rel_path).unlink(missing_ok=True)
+
+
+class ConversionError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(
+            f"{len(errors)} notebook(s) failed to convert:\n"
+            + "\n".join(f"  {path}: {error}" for path, error in errors.items())
+        )
+
+
+def _convert_collecting_errors(
+    nb_path,
+    dir,
+    out,
+    pipeline,
+    save,
+    manifest=None,
+    validate=False,
+    profile=False,
+    stream=False,
+):
+    # Runs in worker processes, so profiles are passed back as plain records
+    profiler = get_profiler(profile)
+    item = Path(nb_path).relative_to(dir).as_posix()
+    try:
+        with profiler.timer("read", item) as counters:
+            if stream:
+                data, digest = None, file_digest(nb_path)
+            else:
+                data = Path(nb_path).read_bytes()
+                digest = hashlib.sha256(data).hexdigest()
+            counters["bytes_read"] = Path(nb_path).stat().st_size
+        if manifest is not None:
+            out_path = substitute_path(nb_path, dir, out)
+            if manifest.get(item) == digest and out_path.exists():
+                profiler.add("cached", item)
+                return None, None, digest, profiler.export()
+        nb = convert_notebook(
+            nb_path, dir, out, pipeline, save, data, validate, profiler, stream
+        )
+        # Saved notebooks are not sent back, pickling them costs as much memory
+        return None if save else nb, None, digest, profiler.export()
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}", None, profiler.export()
+
+
+def convert_notebooks(
+    dir="./notebooks",
+    out=None,
+    stages=DEFAULT_STAGES,
+    save=True,
+    jobs=1,
+    cache=False,
+    options=None,
+    validate=False,
+    profiler=NULL_PROFILER,
+    stream=False,
+):
+    options = {name: dict(kwargs) for name, kwargs in (options or {}).items()}
+    # Offloaded outputs are stored in the root of the converted tree
+    options.setdefault("offload", {}).setdefault("root", dir if out is None else out)
+    pipeline = build_pipeline(stages, options)
+    if stream:
+        check_streaming(pipeline, validate)
+    nb_paths = find_ipynb(dir)
+    # Incremental conversion only makes sense when writing to a separate tree
+    cache = cache and save and out is not None and _cacheable(pipeline)
+    if cache:
+        fingerprint = pipeline_fingerprint(pipeline)
+        manifest = load_manifest(Path(out) / CACHE_MANIFEST)
+        previous = manifest.get("notebooks", {})
+        # Changed stages invalidate all entries, but stale outputs are still pruned
+        cached = previous if manifest.get("fingerprint") == fingerprint else {}
+    else:
+        cached = None
+    convert = partial(
+        _convert_collecting_errors,
+        dir=dir,
+        out=out,
+        pipeline=pipeline,
+        save=save,
+        manifest=cached,
+        validate=validate,
+        profile=profiler.enabled,
+        stream=stream,
+    )
+    jobs = min(jobs or os.cpu_count() or 1, len(nb_paths))
+    if jobs > 1:
+        chunksize = max(1, len(nb_paths) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(convert, nb_paths, chunksize=chunksize))
+    else:
+        results = [convert(nb_path) for nb_path in nb_paths]
+    for *_, records in results:
+        profiler.merge(records)
+
+    if cache:
+        rel_paths = [nb_path.relative_to(dir).as_posix() for nb_path in nb_paths]
+        prune_outputs(out, set(previous) - set(rel_paths))
+        notebooks = {
+            rel_path: digest
+            for rel_path, (_, error, digest, _) in zip(rel_paths, results)
+            if not error
+        }
+        save_manifest(
+            Path(out) / CACHE_MANIFEST,
+            dict(fingerprint=fingerprint, notebooks=notebooks),
+        )
+
+    errors = {
+        nb_path: error for nb_path, (_, error, _, _) in zip(nb_paths, results) if error
+    }
+    if errors:
+        raise ConversionError(errors)
+    if not save:
+        return [nb for nb, *_ in results]
+
+
+def _convert_in_memory(nb_path, dir, pipeline, profile=False):
+    profiler = get_profiler(profile)
+    nb = convert_notebook(nb_path, dir, None, pipeline, save=False, profiler=profiler)
+    return Path(nb_path).relative_to(dir), nb, profiler.export()
+
+
+def iter_converted(
+    dir="./notebooks",
+    stages=DEFAULT_STAGES,
+    options=None,
+    jobs=1,
+    profiler=NULL_PROFILER,
+):
+    # Lazily yield (relative path, converted notebook) without writing anything
+    options = {name: dict(kwargs) for name, kwargs in (options or {}).items()}
+    options.setdefault("offload", {}).setdefault("root", dir)
+    pipeline = build_pipeline(stages, options)
+    nb_paths = find_ipynb(dir)
+    convert = partial(
+        _convert_in_memory, dir=dir, pipeline=pipeline, profile=profiler.enabled
+    )
+    jobs = min(jobs or os.cpu_count() or 1, len(nb_paths))
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for rel_path, nb, records in executor.map(convert, nb_paths):
+                profiler.merge(records)
+                yield rel_path, nb
+    else:
+        for nb_path in nb_paths:
+            rel_path, nb, records = convert(nb_path)
+            profiler.merge(records)
+            yield rel_path, nb
+
+
+def _run_stages(dir, out, save, stages):
+    pipeline = build_pipeline(stages)
+    for nb_path in find_ipynb(dir):
+        nb = convert_notebook(nb_path, dir, out, pipeline, save)
+        if not save:
+            return nbformat.from_dict(nb)
 
 
 def set_kernel_all_notebooks(
@@ -12,149 +385,264 @@ def set_kernel_all_notebooks(
     name="python3",
     display_name="Python 3 (ipykernel)",
 ):
-    nb_paths = find_ipynb(dir)
-    for nb_path in nb_paths:
-        nb = nbformat.read(nb_path, as_version=4)
-        nb.metadata.kernelspec.name = name
-        nb.metadata.kernelspec.display_name = display_name
-        # Save notebook
-        nb_path = substitute_path(nb_path, dir, out)
-        if save:
-            nbformat.write(nb, nb_path)
-        else:
-            return nb
+    stage = Stage(
+        "kernel",
+        lambda nb, nb_path: set_kernel(nb, nb_path, name, display_name),
+    )
+    return _run_stages(dir, out, save, [stage])
 
 
-def clean_up_frontmatter(dir="./notebooks", out=None, save=True):
-    # Define the path to the notebooks
-    nb_paths = find_ipynb(dir)
+@register_stage("kernel")
+def set_kernel(
+    nb,
+    nb_path=None,
+    name="python3",
+    display_name="Python 3 (ipykernel)",
+    kernels=None,
+):
+    # `kernels` maps notebook paths to kernels, as written by merge_envs --cluster
+    if kernels and nb_path is not None and Path(nb_path).as_posix() in kernels:
+        name = display_name = kernels[Path(nb_path).as_posix()]
+    kernelspec = nb["metadata"]["kernelspec"]
+    kernelspec["name"] = name
+    kernelspec["display_name"] = display_name
+    return nb
 
-    # Iterate over the notebooks
-    for nb_path in nb_paths:
-        # Load the notebook
-        nb = nbformat.read(nb_path, as_version=4)
-        if nb.cells[0].source.startswith("---"):
-            # Load frontmatter
-            fm = nb.cells[0].source.split("\n")
 
-            # Extract the title and the subtitle and convert
-            i = 1
+def clean_up_frontmatter(dir="./notebooks", out=None, save=True):
+    return _run_stages(dir, out, save, ["frontmatter"])
+
+
+@register_stage("frontmatter")
+def convert_frontmatter(nb, nb_path=None):
+    if nb["cells"][0]["source"].startswith("---"):
+        # Load frontmatter
+        fm = nb["cells"][0]["source"].split("\n")
+
+        # Extract the title and the subtitle and convert
+        i = 1
+        line = fm[i]
+        new_text = []
+        while not line.startswith("---"):
+            if line.startswith("title"):
+                new_text.append(f"# {line.split(': ')[1]}")
+            if line.startswith("subtitle"):
+                new_text.append(f"**{line.split(': ')[1]}**")
+
+            i += 1
             line = fm[i]
-            new_text = []
-            while not line.startswith("---"):
-                if line.startswith("title"):
-                    new_text.append(f"# {line.split(': ')[1]}")
-                if line.startswith("subtitle"):
-                    new_text.append(f"**{line.split(': ')[1]}**")
-
-                i += 1
-                line = fm[i]
-
-            new_text += fm[i + 1 :]  # noqa
-            nb.cells[0].source = "\n".join(new_text) + "\n"
-            nb.cells[0].cell_type = "markdown"
-        # Save notebook
-        nb_path = substitute_path(nb_path, dir, out)
-        if save:
-            nbformat.write(nb, nb_path)
-        else:
-            return nb
+
+        new_text += fm[i + 1 :]  # noqa
+        nb["cells"][0]["source"] = "\n".join(new_text) + "\n"
+        nb["cells"][0]["cell_type"] = "markdown"
+    return nb
 
 
 def convert_bibliography(nb_path="./notebooks/references.ipynb", out=None, save=True):
     nb_path = Path(nb_path)
     if nb_path.exists():
-        nb = nbformat.read(nb_path, as_version=4)
-        nb.cells[
-            0
-        ].source = """# References
-```{bibliography}
-:style: plain
-```
-"""
+        nb = read_notebook(nb_path)
+        set_bibliography(nb)
         # Save the notebook
         nb_path = substitute_path(nb_path, nb_path.parent, out)
         if save:
-            nbformat.write(nb, nb_path)
+            write_notebook(nb, nb_path)
         else:
-            return nb
+            return nbformat.from_dict(nb)
 
 
-def convert_callout_notes(dir="./notebooks", out=None, save=True):
-    nb_paths = find_ipynb(dir)
+@register_stage("bibliography")
+def convert_bibliography_stage(nb, nb_path):
+    if nb_path == Path("references.ipynb"):
+        set_bibliography(nb)
+    return nb
 
-    # Iterate over the notebooks
-    for nb_path in nb_paths:
-        # Load the notebook
-        nb = nbformat.read(nb_path, as_version=4)
-        for i in range(len(nb.cells)):
-            if nb.cells[i]["cell_type"] == "markdown":
-                nb.cells[i].source = quarto_note_replace(nb.cells[i].source)
-        # Save the notebook
-        nb_path = substitute_path(nb_path, dir, out)
-        if save:
-            nbformat.write(nb, nb_path)
-        else:
-            return nb
+
+def set_bibliography(nb):
+    nb["cells"][0]["source"] = """# References
+```{bibliography}
+:style: plain
+```
+"""
+    return nb
+
+
+register_stage("offload", streaming=False)(offload_outputs)
+register_stage("frozen", streaming=False, cacheable=False)(carry_frozen_outputs)
 
 
+def convert_callout_notes(dir="./notebooks", out=None, save=True):
+    return _run_stages(dir, out, save, ["callouts"])
+
+
+CALLOUT_ADMONITIONS = {
+    "callout-note": "note",
+    "callout-tip": "tip",
+    "callout-warning": "warning",
+    "callout-important": "important",
+    "callout-caution": "caution",
+}
+_DIV_OPEN = re.compile(r"^:{3,}\s*(?:\{(?P<attrs>[^}]*)\}|(?P<cls>[\w-]+))\s*$")
+_DIV_CLOSE = re.compile(r"^:{3,}\s*$")
+_CODE_FENCE = re.compile(r"^[ \t]*(`{3,}|~{3,})")
+_DIV_ATTR = re.compile(
+    r"\.(?P<cls>[\w-]+)|#(?P<id>[\w-]+)"
+    r"|(?P<key>[\w-]+)=(?:\"(?P<dq>[^\"]*)\"|'(?P<sq>[^']*)'|(?P<bare>\S+))"
+)
+_HEADING = re.compile(r"^#{1,6}\s+(?P<title>.+?)\s*$")
+
+
+def _parse_div_attrs(attrs):
+    classes, options = [], {}
+    for match in _DIV_ATTR.finditer(attrs):
+        if match.group("cls"):
+            classes.append(match.group("cls"))
+        elif match.group("id"):
+            options["id"] = match.group("id")
+        else:
+            value = [match.group(i) for i in ("dq", "sq", "bare")]
+            options[match.group("key")] = next(v for v in value if v is not None)
+    return classes, options
+
+
+def _render_admonition(div):
+    body = div["body"]
+    kind = div["kind"]
+    title = div["options"].get("title")
+    if title is None:
+        # Quarto also takes the title from a leading heading in the callout body
+        for i, line in enumerate(body):
+            if line.strip():
+                heading = _HEADING.match(line)
+                if heading:
+                    title = heading.group("title")
+                    body = body[:i] + body[i + 1 :]  # noqa
+                break
+
+    classes = [kind] if title else []
+    if div["options"].get("collapse", "").lower() == "true":
+        classes.append("dropdown")
+    # MyST needs outer colon fences to be longer than the nested ones
+    fence = ":" * max(3, div["depth"] + 1)
+    lines = [f"{fence}{{admonition}} {title}\n" if title else f"{fence}{{{kind}}}\n"]
+    if classes:
+        lines.append(f":class: {' '.join(classes)}\n")
+    if "id" in div["options"]:
+        lines.append(f":name: {div['options']['id']}\n")
+    lines += body
+    lines.append(fence + div["newline"])
+    return lines
+
+
+@register_stage("callouts", scope="cell", cell_type="markdown", version=2)
 def quarto_note_replace(quarto):
-    note_rst_start = r":::{note}"
-    note_rst_end = r":::"
-    nts = re.findall(r"(?<=:::\s\{\.callout\-note\})[^:::]+", quarto)
-    for i in nts:
-        quarto = re.sub(
-            r":::\s\{\.callout\-note\}" + re.escape(i) + r":::",
-            note_rst_start + i + note_rst_end,
-            quarto,
-        )
-    return quarto
+    # Single pass over the lines; open divs buffer their (converted) body
+    root = []
+    stack = []
+    code_fence = None
+    for line in quarto.splitlines(keepends=True):
+        target = stack[-1]["body"] if stack else root
+        stripped = line.strip()
+        if code_fence is not None:
+            if stripped.startswith(code_fence) and not stripped.strip(code_fence[0]):
+                code_fence = None
+            target.append(line)
+            continue
+        if not stripped.startswith((":::", "```", "~~~")):
+            target.append(line)
+            continue
+
+        fence = _CODE_FENCE.match(line)
+        if fence:
+            code_fence = fence.group(1)
+            target.append(line)
+        elif _DIV_CLOSE.match(stripped):
+            if not stack:
+                root.append(line)
+                continue
+            div = stack.pop()
+            parent = stack[-1] if stack else None
+            if div["kind"] is None:
+                lines = [div["open"]] + div["body"] + [line]
+            else:
+                div["newline"] = line[len(line.rstrip("\r\n")) :]  # noqa
+                lines = _render_admonition(div)
+            if parent is not None:
+                parent["body"] += lines
+                parent["depth"] = max(parent["depth"], div["depth"] + 1)
+            else:
+                root += lines
+        elif _DIV_OPEN.match(stripped):
+            match = _DIV_OPEN.match(stripped)
+            if match.group("attrs") is not None:
+                classes, options = _parse_div_attrs(match.group("attrs"))
+            else:
+                classes, options = [match.group("cls")], {}
+            kind = next(
+                (CALLOUT_ADMONITIONS[c] for c in classes if c in CALLOUT_ADMONITIONS),
+                None,
+            )
+            stack.append(dict(open=line, body=[], kind=kind, options=options, depth=2))
+        else:
+            target.append(line)
+
+    # Unclosed divs are left as they were written
+    for div in stack:
+        root += [div["open"]] + div["body"]
+    return "".join(root)
 
 
 def convert_refs(dir="./notebooks", out=None, save=True):
-    nb_paths = find_ipynb(dir)
+    return _run_stages(dir, out, save, ["refs"])
 
-    # Iterate over the notebooks
-    for nb_path in nb_paths:
-        # Load the notebook
-        nb = nbformat.read(nb_path, as_version=4)
-        for i in range(len(nb.cells)):
-            if nb.cells[i]["cell_type"] == "markdown":
-                nb.cells[i].source = quarto_ref_figure_replace(nb.cells[i].source)
-                nb.cells[i].source = quarto_ref_person_replace(nb.cells[i].source)
-                nb.cells[i].source = quarto_ref_time_replace(nb.cells[i].source)
 
-        # Save the notebook
-        nb_path = substitute_path(nb_path, dir, out)
-        if save:
-            nbformat.write(nb, nb_path)
-        else:
-            return nb
+# Pandoc citation keys, without trailing punctuation such as "@key."
+_CITE_KEY = r"\w(?:[\w:.#$%&+?<>~/-]*\w)?"
+# One alternation for all reference forms; code is matched (and kept) first
+_REF_PATTERN = re.compile(
+    r"(?P<fenced>^[ \t]*(?P<fence>`{3,}|~{3,}).*?(?:^[ \t]*(?P=fence)[ \t]*$|\Z))"
+    r"|(?P<code>(?P<ticks>`+).+?(?P=ticks))"
+    rf"|\(@(?P<fig>{_CITE_KEY})\)"
+    rf"|\[(?P<cites>@{_CITE_KEY}(?:\s*;\s*@{_CITE_KEY})*)\]"
+    rf"|(?<![\w@])@(?P<key>{_CITE_KEY})",
+    re.MULTILINE | re.DOTALL,
+)
+_CITE_SEPARATOR = re.compile(r"\s*;\s*@")
+
+
+def _replace_refs(quarto, kinds=("fig", "cites", "key")):
+    def replace(match):
+        if "fig" in kinds and match.group("fig") is not None:
+            return ""
+        if "cites" in kinds and match.group("cites") is not None:
+            keys = _CITE_SEPARATOR.split(match.group("cites")[1:])
+            return "{cite:p}`" + ",".join(keys) + "`"
+        if "key" in kinds and match.group("key") is not None:
+            return "{cite:t}`" + match.group("key") + "`"
+        return match.group(0)
+
+    return _REF_PATTERN.sub(replace, quarto)
+
+
+@register_stage("refs", scope="cell", cell_type="markdown", version=2)
+def quarto_ref_replace(quarto):
+    return _replace_refs(quarto)
 
 
 def quarto_ref_figure_replace(quarto):
-    bibs = re.findall(r"(?<=\(\@)[^\)]+", quarto)
-    for i in bibs:
-        quarto = re.sub(r"\(\@" + i + r"\)", "", quarto)
-    return quarto
+    return _replace_refs(quarto, ("fig",))
 
 
 def quarto_ref_person_replace(quarto):
-    bibs = re.findall(r"(?<=\[\@)[^\]]+", quarto)
-    for i in bibs:
-        quarto = re.sub(r"\[\@" + i + r"\]", r"{cite:p}`" + i + "`", quarto)
-    return quarto
+    return _replace_refs(quarto, ("cites",))
 
 
 def quarto_ref_time_replace(quarto):
-    bibs = re.findall(r"(?<=\@)[^\s]+", quarto)
-    for i in bibs:
-        quarto = re.sub(r"\@" + i, r"{cite:t}`" + i + "`", quarto)
-    return quarto
+    return _replace_refs(quarto, ("key",))
 
 
 def find_ipynb(dir):
-    return list(Path(dir).rglob("*.ipynb"))
+    return sorted(Path(dir).rglob("*.ipynb"))
 
 
 def substitute_path(nb_path, dir, out):
@@ -169,13 +657,154 @@ def main():
     parser = argparse.ArgumentParser(description="Convert Quarto to Jupyter Book")
     parser.add_argument("dir", type=str, help="Input Directory")
     parser.add_argument("out", type=str, help="Destination directory")
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=list(STAGES),
+        default=DEFAULT_STAGES,
+        help="Conversion stages to apply, in order (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes (default: number of cores)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_false",
+        help=f"Reconvert all notebooks, ignoring {CACHE_MANIFEST} in the output",
+    )
+    parser.add_argument(
+        "--offload-threshold",
+        type=int,
+        default=OFFLOAD_THRESHOLD,
+        help="Size in bytes above which the offload stage moves outputs to files",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Validate the converted notebooks against the nbformat schema",
+    )
+    parser.add_argument(
+        "--executed",
+        type=str,
+        default="chapters",
+        help="Directory with Quarto's executed notebooks (.quarto_ipynb) whose "
+        "outputs the opt-in frozen stage carries over; the stage disables the "
+        "incremental cache and is not needed after make post-render, which moves "
+        "the executed notebooks into the input (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--jupyter-cache",
+        type=str,
+        metavar="PATH",
+        help="Register the converted, executed notebooks in this jupyter-cache "
+        "database (e.g. <book>/_build/.jupyter_cache)",
+    )
+    parser.add_argument(
+        "--assets",
+        type=str,
+        metavar="SOURCE",
+        help="Publish the images the converted notebooks reference from SOURCE "
+        "(e.g. chapters), hardlinked and tracked in a content-hash manifest",
+    )
+    parser.add_argument(
+        "--web-max-bytes",
+        type=int,
+        help="With --assets, re-encode GIF/PNG images larger than this as WebP",
+    )
+    parser.add_argument(
+        "--assets-include",
+        nargs="+",
+        default=[],
+        metavar="PATH",
+        help="With --assets, also publish these files or directories of SOURCE, "
+        "e.g. images/logos images/icons for the book config",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Parse only metadata and sources and copy outputs straight to the "
+        "destination, keeping memory flat for notebooks with huge outputs",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and reconvert notebooks as they change",
+    )
+    parser.add_argument(
+        "--quarto",
+        type=str,
+        default="_quarto.yml",
+        help="Quarto book config watched for TOC changes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--toc-dir",
+        type=str,
+        help="Directory of the _toc.yml regenerated in watch mode "
+        "(default: parent of the destination directory)",
+    )
+    parser.add_argument(
+        "--kernel-map",
+        type=str,
+        help="JSON mapping of notebook paths to kernel names, used by the kernel "
+        "stage (e.g. kernels.json from merge_envs --cluster)",
+    )
+    add_profile_argument(parser)
     args = parser.parse_args()
-
-    clean_up_frontmatter(args.dir, args.out)
-    set_kernel_all_notebooks(args.out)
-    convert_callout_notes(args.out)
-    convert_refs(args.out)
-    convert_bibliography(out=args.out)
+    options = dict(
+        offload=dict(threshold=args.offload_threshold),
+        frozen=dict(executed=args.executed),
+    )
+    if args.kernel_map:
+        options["kernel"] = dict(kernels=json.loads(Path(args.kernel_map).read_text()))
+
+    if args.watch:
+        from eo_datascience.watch import watch
+
+        toc_dir = args.toc_dir or Path(args.out).resolve().parent
+        watch(
+            args.dir,
+            args.out,
+            args.stages,
+            options,
+            quarto=args.quarto,
+            toc_dir=toc_dir,
+            jobs=args.jobs,
+        )
+        return
+
+    profiler = get_profiler(args.profile is not None)
+    try:
+        convert_notebooks(
+            args.dir,
+            args.out,
+            args.stages,
+            jobs=args.jobs,
+            cache=args.cache,
+            options=options,
+            validate=args.validate,
+            profiler=profiler,
+            stream=args.stream,
+        )
+        if args.assets:
+            with profiler.timer("assets", args.assets) as counters:
+                manifest = publish_assets(
+                    args.assets, args.out, args.web_max_bytes, args.assets_include
+                )
+                counters["assets"] = len(manifest["assets"])
+            for asset in manifest["missing"]:
+                print(f"Missing asset: {asset}", file=sys.stderr)
+        if args.jupyter_cache:
+            with profiler.timer("seed", args.jupyter_cache) as counters:
+                counters["notebooks"] = seed_jupyter_cache(args.out, args.jupyter_cache)
+    except (ConversionError, ValueError, ImportError) as e:
+        sys.exit(str(e))
+    finally:
+        finish_profile(profiler, args.profile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+import nbformat
+from eo_datascience.instrument import CellInstrument
+from eo_datascience.merge_envs import is_environment_file, notebooks_for_environment
+from eo_datascience.nbio import read_notebook, write_notebook
+
+try:
+    from nbclient import NotebookClient
+    from nbclient.exceptions import (
+        CellExecutionError,
+        CellTimeoutError,
+        DeadKernelError,
+    )
+except ImportError:  # pragma: no cover
+    NotebookClient = None
+
+STATUS_FILE = "execution_status.json"
+DEFAULT_KERNEL = "python3"
+
+
+@dataclass
+class ExecutionResult:
+    path: str
+    kernel: str
+    status: str
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+class NotebookTimeout(Exception):
+    pass
+
+
+def kernel_map(dir: str | Path, kernels: Optional[Dict[str, str]] = None) -> Dict:
+    # Kernels are named after the environment file, as in `make kernel`
+    dir = Path(dir)
+    mapping = {}
+    for env_file in sorted(dir.rglob("*.yml")):
+        if is_environment_file(env_file):
+            for nb_path in notebooks_for_environment(env_file):
+                mapping[nb_path.relative_to(dir).as_posix()] = env_file.stem
+    mapping.update(kernels or {})
+    return mapping
+
+
+def load_status(path: str | Path) -> Dict[str, Dict]:
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def schedule(rel_paths: Iterable[str], previous: Dict[str, Dict]) -> List[str]:
+    # Longest first (unknown durations count as longest), so the total run
+    # time approaches that of the slowest notebook rather than the sum
+    def key(rel_path):
+        seconds = previous.get(rel_path, {}).get("seconds")
+        return (seconds is not None, -(seconds or 0.0), rel_path)
+
+    return sorted(rel_paths, key=key)
+
+
+async def _execute(client, timeout: Optional[float]) -> None:
+    # The deadline starts once the kernel is up. On expiry the execution is
+    # cancelled and nbclient's kernel context shuts the kernel down on the way out
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    deadline = []
+
+    def start(notebook):
+        if timeout:
+            deadline.append(loop.call_later(timeout, task.cancel))
+
+    client.on_notebook_start = start
+    try:
+        await client.async_execute()
+    except (asyncio.CancelledError, DeadKernelError):
+        # nbclient reports a cancelled cell as a dead kernel
+        if deadline and deadline[0].when() <= loop.time():
+            raise NotebookTimeout(f"exceeded {timeout} s") from None
+        raise
+    finally:
+        for handle in deadline:
+            handle.cancel()
+
+
+def execute_notebook(
+    nb_path: str | Path,
+    out_path: str | Path,
+    kernel: str,
+    rel_path: str = "",
+    timeout: Optional[float] = None,
+    cell_timeout: Optional[int] = None,
+    memory_limit: Optional[int] = None,
+    instrument: bool = False,
+) -> ExecutionResult:
+    # Runs in a worker process: the memory limit is inherited by the kernel
+    # it starts
+    if NotebookClient is None:
+        raise ImportError("Executing notebooks requires nbclient and ipykernel")
+    nb = read_notebook(nb_path)
+    if not any(cell["cell_type"] == "code" for cell in nb["cells"]):
+        if Path(out_path) != Path(nb_path):
+            Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+            write_notebook(nb, out_path)
+        return ExecutionResult(rel_path, kernel, "skipped")
+    nb["metadata"].setdefault("kernelspec", {}).update(name=kernel, display_name=kernel)
+    # nbclient works on NotebookNodes
+    nb = nbformat.from_dict(nb)
+    client = NotebookClient(
+        nb,
+        kernel_name=kernel,
+        timeout=cell_timeout,
+        resources={"metadata": {"path": str(Path(nb_path).parent)}},
+    )
+    if instrument:
+        CellInstrument().attach(client)
+    limits = resource.getrlimit(resource.RLIMIT_DATA)
+    start = time.perf_counter()
+    status, error = "ok", None
+    try:
+        if memory_limit:
+            resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, limits[1]))
+        asyncio.run(_execute(client, timeout))
+    except (NotebookTimeout, CellTimeoutError) as e:
+        status, error = "timeout", str(e) or f"exceeded {timeout} s"
+    except DeadKernelError as e:
+        status, error = "died", str(e)
+    except CellExecutionError as e:
+        status, error = "error", f"{e.ename}: {e.evalue}"
+    finally:
+        resource.setrlimit(resource.RLIMIT_DATA, limits)
+    seconds = time.perf_counter() - start
+    # Partial outputs are written too, they show where execution stopped
+    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+    write_notebook(nb, out_path)
+    return ExecutionResult(rel_path, kernel, status, seconds, error)
+
+
+def execute_notebooks(
+    dir: str | Path,
+    out: Optional[str | Path] = None,
+    jobs: int = 1,
+    timeout: Optional[float] = None,
+    cell_timeout: Optional[int] = None,
+    memory_limit: Optional[int] = None,
+    kernels: Optional[Dict[str, str]] = None,
+    instrument: bool = False,
+    envs: Optional[str | Path] = None,
+    runner: Callable = execute_notebook,
+) -> Dict[str, ExecutionResult]:
+    # `envs` is the source tree holding the environment files when `dir` is a
+    # converted copy of it without them
+    dir = Path(dir)
+    out = dir if out is None else Path(out)
+    status_path = out / STATUS_FILE
+    mapping = kernel_map(dir if envs is None else envs, kernels)
+    rel_paths = schedule(
+        [p.relative_to(dir).as_posix() for p in sorted(dir.rglob("*.ipynb"))],
+        load_status(status_path),
+    )
+    run = partial(
+        runner,
+        timeout=timeout,
+        cell_timeout=cell_timeout,
+        memory_limit=memory_limit,
+        instrument=instrument,
+    )
+    results = {}
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(rel_paths)))
+    # Workers are processes even for one job, so limits never hit this process
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(
+                run,
+                dir / rel_path,
+                out / rel_path,
+                mapping.get(rel_path, DEFAULT_KERNEL),
+                rel_path,
+            ): rel_path
+            for rel_path in rel_paths
+        }
+        for future in as_completed(futures):
+            rel_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                kernel = mapping.get(rel_path, DEFAULT_KERNEL)
+                result = ExecutionResult(
+                    rel_path, kernel, "failed", error=f"{type(e).__name__}: {e}"
+                )
+            results[rel_path] = result
+            print(
+                f"{result.status:8} {result.seconds:8.1f} s  {rel_path}",
+                file=sys.stderr,
+            )
+
+    results = dict(sorted(results.items()))
+    out.mkdir(parents=True, exist_ok=True)
+    status_path.write_text(
+        json.dumps({k: asdict(v) for k, v in results.items()}, indent=1) + "\n"
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Execute notebooks concurrently, each in its environment's kernel"
+    )
+    parser.add_argument("dir", type=str, help="Notebook directory")
+    parser.add_argument(
+        "out",
+        type=str,
+        nargs="?",
+        help="Destination directory (default: execute in place)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of notebooks executed concurrently (default: number of cores)",
+    )
+    parser.add_argument(
+        "--timeout", type=float, help="Wall-clock limit per notebook in seconds"
+    )
+    parser.add_argument(
+        "--cell-timeout", type=int, help="Execution limit per cell in seconds"
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=int,
+        metavar="MIB",
+        help="Data segment limit per kernel in MiB",
+    )
+    parser.add_argument(
+        "--envs",
+        type=str,
+        metavar="DIR",
+        help="Source tree with the environment files, e.g. notebooks, when "
+        "executing a converted copy (default: the notebook directory)",
+    )
+    parser.add_argument(
+        "--kernel-map",
+        type=str,
+        help="JSON mapping of notebook paths to kernels, overriding the ones "
+        "derived from the environment files (e.g. from merge_envs --cluster)",
+    )
+    parser.add_argument(
+        "--instrument",
+        action="store_true",
+        help="Record wall time, CPU time and peak memory of every cell in its "
+        "metadata (see cell_report)",
+    )
+    args = parser.parse_args()
+    kernels = json.loads(Path(args.kernel_map).read_text()) if args.kernel_map else None
+    results = execute_notebooks(
+        args.dir,
+        args.out,
+        jobs=args.jobs,
+        timeout=args.timeout,
+        cell_timeout=args.cell_timeout,
+        memory_limit=args.memory_limit * 2**20 if args.memory_limit else None,
+        kernels=kernels,
+        instrument=args.instrument,
+        envs=args.envs,
+    )
+    failed = [
+        path
+        for path, result in results.items()
+        if result.status not in ("ok", "skipped")
+    ]
+    print(f"Executed {len(results) - len(failed)}/{len(results)} notebooks.")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from eo_datascience.nbio import read_notebook
+
+try:
+    from jupyter_cache import get_cache
+except ImportError:  # pragma: no cover
+    get_cache = None
+
+# Quarto keeps the executed notebook next to the source with `keep-ipynb: true`
+EXECUTED_SUFFIXES = (".quarto_ipynb", ".ipynb")
+EXECUTED_DIR = "chapters"
+
+
+def find_executed(rel_path: str | Path, executed: str | Path) -> Optional[Path]:
+    for suffix in EXECUTED_SUFFIXES:
+        candidate = (Path(executed) / rel_path).with_suffix(suffix)
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def carry_outputs(nb: Dict, executed_nb: Dict) -> int:
+    # Code cells are matched on their source, so inserted or removed markdown
+    # cells (e.g. the converted front matter) do not shift the outputs
+    executed = defaultdict(deque)
+    for cell in executed_nb["cells"]:
+        if cell["cell_type"] == "code":
+            executed[cell["source"]].append(cell)
+    carried = 0
+    for cell in nb["cells"]:
+        if cell["cell_type"] != "code" or not executed[cell["source"]]:
+            continue
+        match = executed[cell["source"]].popleft()
+        cell["outputs"] = match.get("outputs", [])
+        cell["execution_count"] = match.get("execution_count")
+        carried += 1
+    return carried
+
+
+def carry_frozen_outputs(nb: Dict, nb_path=None, executed=EXECUTED_DIR) -> Dict:
+    executed_path = find_executed(nb_path, executed) if nb_path is not None else None
+    if executed_path is not None:
+        carry_outputs(nb, read_notebook(executed_path))
+    return nb
+
+
+def is_executed(nb: Dict) -> bool:
+    # jupyter-cache only accepts a single top-to-bottom run: counts 1, 2, ...
+    counts = [
+        cell.get("execution_count")
+        for cell in nb["cells"]
+        if cell["cell_type"] == "code"
+    ]
+    return bool(counts) and counts == list(range(1, len(counts) + 1))
+
+
+def seed_jupyter_cache(
+    dir: str | Path, cache_path: str | Path, nb_paths: Optional[Iterable[Path]] = None
+) -> int:
+    # Registered notebooks are keyed on their code sources and kernelspec, so
+    # jupyter-book's `execute_notebooks: cache` gets hits instead of running them
+    if get_cache is None:
+        raise ImportError(
+            "Seeding the execution cache requires jupyter-cache; "
+            "install it with `pip install eo_datascience[cache]`"
+        )
+    cache = get_cache(str(cache_path))
+    seeded = 0
+    if nb_paths is None:
+        nb_paths = sorted(Path(dir).rglob("*.ipynb"))
+    for nb_path in nb_paths:
+        if is_executed(read_notebook(nb_path)):
+            cache.cache_notebook_file(
+                str(nb_path), uri=str(Path(nb_path).resolve()), overwrite=True
+            )
+            seeded += 1
+    return seeded
@@ -0,0 +1,218 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from eo_datascience.nbio import read_notebook
+
+METADATA_KEY = "eo_datascience"
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS = 1.0
+MIN_BYTES = 64 * 2**20
+
+
+def _proc(pid: int) -> Optional[Tuple[float, int, int]]:
+    # CPU seconds, RSS and peak RSS of a (kernel) process; None off Linux
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return None
+    # Fields after the parenthesised command name start at the state (3rd)
+    fields = stat.rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    memory = {}
+    for line in status.splitlines():
+        key, _, value = line.partition(":")
+        if key in ("VmRSS", "VmHWM"):
+            memory[key] = int(value.split()[0]) * 1024
+    return cpu, memory.get("VmRSS", 0), memory.get("VmHWM", 0)
+
+
+def _reset_peak(pid: int) -> bool:
+    try:
+        Path(f"/proc/{pid}/clear_refs").write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+class CellInstrument:
+    # nbclient hooks storing wall time, kernel CPU time and the kernel's peak
+    # RSS increase of every executed cell in its metadata
+
+    def __init__(self):
+        self.start: Dict[int, Tuple] = {}
+
+    def attach(self, client):
+        client.on_cell_execute = self.before
+        client.on_cell_executed = self.after
+        self.client = client
+        return client
+
+    def _pid(self) -> Optional[int]:
+        process = getattr(getattr(self.client.km, "provisioner", None), "process", None)
+        return getattr(process, "pid", None)
+
+    def before(self, cell, cell_index):
+        pid = self._pid()
+        usage = _proc(pid) if pid else None
+        reset = usage is not None and _reset_peak(pid)
+        self.start[cell_index] = (time.perf_counter(), usage, reset)
+
+    def after(self, cell, cell_index, execute_reply=None):
+        start, usage, reset = self.start.pop(cell_index, (None, None, False))
+        if start is None:
+            return
+        profile = dict(wall_seconds=round(time.perf_counter() - start, 3))
+        pid = self._pid()
+        now = _proc(pid) if pid and usage is not None else None
+        if now is not None:
+            cpu, rss, peak = usage
+            # Without a reset the previous peak is the baseline, a lower bound
+            baseline = rss if reset else peak
+            profile["cpu_seconds"] = round(now[0] - cpu, 3)
+            profile["peak_rss_delta"] = max(0, now[2] - baseline)
+        cell["metadata"][METADATA_KEY] = profile
+
+
+@dataclass
+class CellProfile:
+    notebook: str
+    index: int
+    key: str
+    source: str
+    wall_seconds: float
+    cpu_seconds: Optional[float] = None
+    peak_rss_delta: Optional[int] = None
+
+
+def cell_key(rel_path: str, source: str) -> str:
+    # Keyed on the source, so moved cells keep their baseline and edited ones
+    # start afresh
+    return f"{rel_path}#{hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]}"
+
+
+def collect_profiles(dir: str | Path) -> List[CellProfile]:
+    dir = Path(dir)
+    profiles = []
+    for nb_path in sorted(dir.rglob("*.ipynb")):
+        rel_path = nb_path.relative_to(dir).as_posix()
+        for index, cell in enumerate(read_notebook(nb_path)["cells"]):
+            profile = cell.get("metadata", {}).get(METADATA_KEY)
+            if cell["cell_type"] != "code" or not profile:
+                continue
+            profiles.append(
+                CellProfile(
+                    rel_path,
+                    index,
+                    cell_key(rel_path, cell["source"]),
+                    cell["source"].strip().split("\n")[0][:60],
+                    **profile,
+                )
+            )
+    return profiles
+
+
+def regressions(
+    profiles: List[CellProfile], baseline: Dict[str, Dict], threshold: float = 1.5
+) -> List[Tuple[CellProfile, str, float, float]]:
+    found = []
+    for profile in profiles:
+        previous = baseline.get(profile.key)
+        if previous is None:
+            continue
+        for metric, minimum in (
+            ("wall_seconds", MIN_SECONDS),
+            ("peak_rss_delta", MIN_BYTES),
+        ):
+            old, new = previous.get(metric), getattr(profile, metric)
+            if old is None or new is None:
+                continue
+            if new > old * threshold and new - old > minimum:
+                found.append((profile, metric, old, new))
+    return found
+
+
+def _format(metric: str, value: float) -> str:
+    if metric == "peak_rss_delta":
+        return f"{value / 2**20:8.1f} MiB"
+    return f"{value:8.1f} s  "
+
+
+def format_report(
+    profiles: List[CellProfile], top: int = 10, found: Optional[List] = None
+) -> str:
+    lines = []
+    for metric, title in (
+        ("wall_seconds", "Slowest cells"),
+        ("peak_rss_delta", "Most memory-hungry cells"),
+    ):
+        ranked = sorted(
+            (p for p in profiles if getattr(p, metric) is not None),
+            key=lambda p: getattr(p, metric),
+            reverse=True,
+        )
+        if not ranked:
+            continue
+        lines.append(f"{title}:")
+        for p in ranked[:top]:
+            value = _format(metric, getattr(p, metric))
+            lines.append(f"  {value}  {p.notebook}[{p.index}]  {p.source}")
+    if found:
+        lines.append("Regressions against the baseline:")
+        for p, metric, old, new in found:
+            lines.append(
+                f"  {_format(metric, old).strip()} -> {_format(metric, new).strip()}"
+                f"  {p.notebook}[{p.index}]  {p.source}"
+            )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rank the cells of executed notebooks by time and memory"
+    )
+    parser.add_argument("dir", type=str, help="Directory of executed notebooks")
+    parser.add_argument("--top", type=int, default=10, help="Cells listed per ranking")
+    parser.add_argument(
+        "--baseline", type=str, help="Baseline JSON to flag regressions against"
+    )
+    parser.add_argument(
+        "--save-baseline", type=str, help="Write the current profiles as a baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.5,
+        help="Ratio to the baseline counted as a regression (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print the profiles as JSON"
+    )
+    args = parser.parse_args()
+
+    profiles = collect_profiles(args.dir)
+    found = []
+    if args.baseline and Path(args.baseline).exists():
+        baseline = json.loads(Path(args.baseline).read_text())
+        found = regressions(profiles, baseline, args.threshold)
+    if args.json:
+        print(json.dumps([asdict(p) for p in profiles], indent=1))
+    else:
+        print(format_report(profiles, args.top, found))
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(
+            json.dumps({p.key: asdict(p) for p in profiles}, indent=1) + "\n"
+        )
+    if found:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
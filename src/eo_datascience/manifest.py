@@ -0,0 +1,25 @@
+import hashlib
+import json
+from functools import partial
+from pathlib import Path
+from typing import Dict
+
+
+def file_digest(path: str | Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(partial(f.read, chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path: str | Path) -> Dict:
+    # A missing or corrupt manifest just means nothing is known yet
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path: str | Path, manifest: Dict) -> None:
+    Path(path).write_text(json.dumps(manifest, indent=1, sort_keys=True) + "\n")
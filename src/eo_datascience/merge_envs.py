@@ -1,41 +1,558 @@
 import argparse
-from pathlib import Path
-from typing import Dict, Iterable, List, Set, Tuple
+import hashlib
+import json
+import os
+import re
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import combinations
+from pathlib import Path, PurePath
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import yaml
-from packaging.version import parse
+from eo_datascience.profiling import (
+    NULL_PROFILER,
+    add_profile_argument,
+    finish_profile,
+    get_profiler,
+)
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.specifiers import SpecifierSet
+from packaging.version import InvalidVersion, Version, parse
+
+# libyaml's loader is an order of magnitude faster when PyYAML was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+CACHE_FILE = ".merge_envs_cache.json"
+# Stored inside the prefix, so removing the environment also removes its record
+PREFIX_FINGERPRINT = Path("conda-meta") / "eo-datascience-fingerprint"
+KERNEL_MAP = "kernels.json"
+_ENV_KEY = re.compile(rb"^dependencies\s*:", re.MULTILINE)
+
+# A version bound: parsed version and its original text, or None for unbounded
+Bound = Optional[Tuple[Version, str]]
+# Half-open or closed version interval: (lower, lower inclusive, upper, inclusive)
+Interval = Tuple[Bound, bool, Bound, bool]
+UNBOUNDED: Tuple[Interval, ...] = ((None, False, None, False),)
+
+_SPEC = re.compile(
+    r"^(?:(?P<channel>[^\s:]+)::)?(?P<name>[A-Za-z0-9_.\-]+)"
+    r"(?:\[(?P<brackets>[^\]]*)\])?\s*(?P<rest>.*?)$"
+)
+_BRACKET_ITEM = re.compile(r"(\w+)\s*=\s*(?:'([^']*)'|\"([^\"]*)\"|([^,\s]+))")
+_TERM = re.compile(r"^(?P<op>==|!=|>=|<=|~=|>|<|=)?\s*(?P<version>[^\s,|]+)$")
+
+
+@dataclass(frozen=True)
+class MatchSpec:
+    name: str
+    version: Optional[str] = None
+    build: Optional[str] = None
+    channel: Optional[str] = None
+    spec: str = ""
+    intervals: Tuple[Interval, ...] = field(default=UNBOUNDED, compare=False)
+    source: Optional[str] = field(default=None, compare=False)
+
+
+@dataclass(frozen=True)
+class Conflict:
+    name: str
+    specs: Tuple[MatchSpec, ...]
+
+    def __str__(self):
+        specs = ", ".join(f"{s.spec} ({s.source or 'unknown'})" for s in self.specs)
+        return f"{self.name}: no version satisfies {specs}"
+
+
+@lru_cache(maxsize=None)
+def version_key(version: str) -> Version:
+    try:
+        return parse(version)
+    except InvalidVersion:
+        # Conda allows versions outside PEP 440; compare on the numeric prefix
+        match = re.match(r"\d+(?:\.\d+)*", version.lstrip("=<>!~ "))
+        return parse(match.group(0) if match else "0")
+
+
+def _bound(version: str) -> Bound:
+    return version_key(version), version
+
+
+def _next_prefix(version: str) -> str:
+    parts = version.split(".")
+    for i in range(len(parts) - 1, -1, -1):
+        if parts[i].isdigit():
+            return ".".join(parts[:i] + [str(int(parts[i]) + 1)])
+    return version + "~"
+
+
+def _prefix_interval(prefix: str) -> Interval:
+    return (_bound(prefix), True, _bound(_next_prefix(prefix)), False)
+
+
+def _term_intervals(term: str) -> Tuple[Interval, ...]:
+    match = _TERM.match(term.strip())
+    if match is None:
+        raise ValueError(f"Invalid version constraint '{term}'")
+    op, version = match.group("op") or "", match.group("version")
+    wildcard = version.endswith("*")
+    prefix = version.rstrip("*").rstrip(".")
+    if op in ("", "==", "=") and (wildcard or op == "="):
+        return (_prefix_interval(prefix),) if prefix else UNBOUNDED
+    if op in ("", "=="):
+        return ((_bound(version), True, _bound(version), True),)
+    if op == "!=":
+        if wildcard:
+            lower, _, upper, _ = _prefix_interval(prefix)
+            return ((None, False, lower, False), (upper, True, None, False))
+        return (
+            (None, False, _bound(version), False),
+            (_bound(version), False, None, False),
+        )
+    if op == "~=":
+        upper = _next_prefix(version.rsplit(".", 1)[0])
+        return ((_bound(version), True, _bound(upper), False),)
+    if op in (">", ">="):
+        return ((_bound(version), op == ">=", None, False),)
+    return ((None, False, _bound(version), op == "<="),)
+
+
+def _intersect_interval(a: Interval, b: Interval) -> Optional[Interval]:
+    lower, lower_inc = a[0], a[1]
+    if b[0] is not None and (
+        lower is None or b[0][0] > lower[0] or (b[0][0] == lower[0] and not b[1])
+    ):
+        lower, lower_inc = b[0], b[1]
+    upper, upper_inc = a[2], a[3]
+    if b[2] is not None and (
+        upper is None or b[2][0] < upper[0] or (b[2][0] == upper[0] and not b[3])
+    ):
+        upper, upper_inc = b[2], b[3]
+    if lower is not None and upper is not None:
+        if lower[0] > upper[0] or (
+            lower[0] == upper[0] and not (lower_inc and upper_inc)
+        ):
+            return None
+    return lower, lower_inc, upper, upper_inc
+
+
+def intersect_intervals(
+    a: Tuple[Interval, ...], b: Tuple[Interval, ...]
+) -> Tuple[Interval, ...]:
+    return tuple(
+        interval
+        for i in a
+        for j in b
+        if (interval := _intersect_interval(i, j)) is not None
+    )
+
+
+def parse_version_spec(version: str) -> Tuple[Interval, ...]:
+    # A leading single "=" makes every bare version fuzzy: `=3.11|3.12`
+    fuzzy = version.startswith("=") and not version.startswith("==")
+    if fuzzy:
+        version = version[1:]
+    intervals: Tuple[Interval, ...] = ()
+    for alternative in version.split("|"):
+        conjunction = UNBOUNDED
+        for term in alternative.split(","):
+            if fuzzy and term[:1].isalnum():
+                term = "=" + term
+            conjunction = intersect_intervals(conjunction, _term_intervals(term))
+        intervals += conjunction
+    return intervals
+
+
+@lru_cache(maxsize=None)
+def _parse_spec(spec: str) -> MatchSpec:
+    match = _SPEC.match(spec.strip())
+    if match is None:
+        raise ValueError(f"Invalid conda match spec '{spec}'")
+    name, rest = match.group("name"), match.group("rest").strip()
+    channel, version, build = match.group("channel"), None, None
+    if rest.startswith("=") and not rest.startswith("=="):
+        # name=version[=build] pins are fuzzy: `numpy=1.26` means 1.26.*
+        version, _, build = rest[1:].partition("=")
+        version = "=" + version
+    elif rest:
+        version, _, build = rest.partition(" ")
+    for key, *values in _BRACKET_ITEM.findall(match.group("brackets") or ""):
+        value = next(v for v in values if v)
+        if key == "version":
+            version = value
+        elif key == "build":
+            build = value
+        elif key == "channel":
+            channel = value
+    version = version.replace(" ", "") if version else None
+    intervals = parse_version_spec(version) if version else UNBOUNDED
+    return MatchSpec(
+        name.lower(),
+        version,
+        (build or "").strip() or None,
+        channel,
+        spec.strip(),
+        intervals,
+    )
+
+
+def parse_spec(spec: str, source: Optional[str | Path] = None) -> MatchSpec:
+    parsed = _parse_spec(spec)
+    if source is None:
+        return parsed
+    return MatchSpec(
+        parsed.name,
+        parsed.version,
+        parsed.build,
+        parsed.channel,
+        parsed.spec,
+        parsed.intervals,
+        str(source),
+    )
+
+
+def parse_environment_dependencies(
+    dependencies: List, source: Optional[str | Path] = None
+) -> Tuple[List[MatchSpec], List[Tuple[str, Optional[str]]]]:
+    conda_specs, pip_specs = [], []
+    for dependency in dependencies:
+        if isinstance(dependency, dict):
+            for requirement in dependency.get("pip", []):
+                pip_specs.append((requirement, None if source is None else str(source)))
+        else:
+            conda_specs.append(parse_spec(str(dependency), source))
+    return conda_specs, pip_specs
+
+
+def load_cache(path: Optional[str | Path]) -> Dict:
+    if path is None:
+        return {}
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(path: Optional[str | Path], cache: Dict) -> None:
+    if path is not None:
+        Path(path).write_text(json.dumps(dict(sorted(cache.items())), indent=1) + "\n")
+
+
+def load_dependencies(file: Path, cache: Optional[Dict] = None) -> List:
+    # Cache entries are checked on (mtime, size) first and on content hash
+    # second, so a touched but unchanged file is not parsed again either
+    if cache is None:
+        environment = get_environment_from_yml(file) or {}
+        return environment.get("dependencies") or []
+    key = str(file)
+    stat = file.stat()
+    entry = cache.get(key)
+    if entry and (entry["mtime_ns"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+        return entry["dependencies"]
+    digest = hashlib.sha256(file.read_bytes()).hexdigest()
+    if entry is None or entry["sha256"] != digest:
+        environment = get_environment_from_yml(file) or {}
+        dependencies = environment.get("dependencies") or []
+    else:
+        dependencies = entry["dependencies"]
+    cache[key] = dict(
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        sha256=digest,
+        dependencies=dependencies,
+    )
+    return dependencies
+
+
+def load_all_dependencies(
+    files: List[Path],
+    cache: Optional[Dict] = None,
+    jobs: int = 1,
+    profiler=NULL_PROFILER,
+) -> List[List]:
+    def load(file):
+        with profiler.timer("load", file) as counters:
+            dependencies = load_dependencies(file, cache)
+            counters["dependencies"] = len(dependencies)
+        return dependencies
+
+    if jobs <= 1 or len(files) <= 1:
+        return [load(file) for file in files]
+    # Threads: environment files are small, so process start-up would dominate
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(load, files))
+
+
+def aggregate_env_specs(
+    files: List[Path],
+    profiler=NULL_PROFILER,
+    cache: Optional[Dict] = None,
+    jobs: int = 1,
+) -> Tuple[List[MatchSpec], List[Tuple[str, Optional[str]]]]:
+    conda_specs, pip_specs = [], []
+    loaded = load_all_dependencies(files, cache, jobs, profiler)
+    for file, dependencies in zip(files, loaded):
+        conda, pip = parse_environment_dependencies(dependencies, file)
+        conda_specs += conda
+        pip_specs += pip
+    return conda_specs, pip_specs
+
+
+def _render_intervals(name: str, intervals: Tuple[Interval, ...]) -> str:
+    alternatives = []
+    for lower, lower_inc, upper, upper_inc in intervals:
+        if lower is not None and upper is not None and lower[0] == upper[0]:
+            alternatives.append(f"=={lower[1]}")
+            continue
+        terms = []
+        if lower is not None:
+            terms.append((">=" if lower_inc else ">") + lower[1])
+        if upper is not None:
+            terms.append(("<=" if upper_inc else "<") + upper[1])
+        alternatives.append(",".join(terms))
+    return name + "|".join(alternatives)
+
+
+def resolve_package(
+    name: str, specs: List[MatchSpec]
+) -> Tuple[str, Optional[Conflict]]:
+    intervals = UNBOUNDED
+    for spec in specs:
+        intervals = intersect_intervals(intervals, spec.intervals)
+    builds = {spec.build for spec in specs if spec.build}
+    channels = {spec.channel for spec in specs if spec.channel}
+    if not intervals or len(builds) > 1 or len(channels) > 1:
+        # Keep the newest pin so the environment can still be written
+        newest = max(specs, key=lambda spec: _upper_key(spec.intervals))
+        return newest.spec, Conflict(name, tuple(specs))
+
+    # Prefer an original spelling that already describes the intersection
+    for spec in sorted(specs, key=lambda spec: (spec.build is None, spec.spec)):
+        if spec.intervals == intervals:
+            return spec.spec, None
+    rendered = _render_intervals(name, intervals)
+    if channels:
+        rendered = f"{channels.pop()}::{rendered}"
+    if builds:
+        rendered = f"{rendered} {builds.pop()}"
+    return rendered, None
+
+
+def _upper_key(intervals: Tuple[Interval, ...]):
+    bounds = [b[0] for i in intervals for b in (i[0], i[2]) if b is not None]
+    return max(bounds, default=version_key("0"))
+
+
+def resolve_specs(specs: Iterable[MatchSpec]) -> Tuple[List[str], List[Conflict]]:
+    by_name: Dict[str, List[MatchSpec]] = defaultdict(list)
+    for spec in specs:
+        by_name[spec.name].append(spec)
+
+    resolved, conflicts = [], []
+    for name, package_specs in sorted(by_name.items()):
+        spec, conflict = resolve_package(name, package_specs)
+        resolved.append(spec)
+        if conflict is not None:
+            conflicts.append(conflict)
+    return resolved, conflicts
+
+
+def resolve_pip_requirements(
+    requirements: Iterable[Tuple[str, Optional[str]]],
+) -> List[str]:
+    by_name: Dict[str, Tuple[Requirement, SpecifierSet]] = {}
+    passthrough = []
+    for requirement, _ in requirements:
+        try:
+            parsed = Requirement(requirement)
+        except InvalidRequirement:
+            # URLs, editable installs and options are kept verbatim
+            if requirement not in passthrough:
+                passthrough.append(requirement)
+            continue
+        name = re.sub(r"[-_.]+", "-", parsed.name).lower()
+        if name in by_name:
+            first, specifier = by_name[name]
+            by_name[name] = (first, specifier & parsed.specifier)
+        else:
+            by_name[name] = (parsed, parsed.specifier)
+    resolved = []
+    for name, (requirement, specifier) in sorted(by_name.items()):
+        extras = (
+            f"[{','.join(sorted(requirement.extras))}]" if requirement.extras else ""
+        )
+        resolved.append(f"{requirement.name}{extras}{specifier}")
+    return resolved + passthrough
+
+
+def is_environment_file(file: Path) -> bool:
+    # Cheap textual check, so unrelated YAML (e.g. _toc.yml) is never parsed
+    try:
+        return _ENV_KEY.search(file.read_bytes()) is not None
+    except OSError:
+        return False
+
+
+def group_by_source(
+    conda_specs: List[MatchSpec], pip_specs: List[Tuple[str, Optional[str]]]
+) -> Dict[str, Tuple[List[MatchSpec], List[Tuple[str, Optional[str]]]]]:
+    environments: Dict = defaultdict(lambda: ([], []))
+    for spec in conda_specs:
+        environments[spec.source][0].append(spec)
+    for requirement in pip_specs:
+        environments[requirement[1]][1].append(requirement)
+    return dict(environments)
+
+
+def _compatible(*specs: List[MatchSpec]) -> bool:
+    return not resolve_specs([spec for group in specs for spec in group])[1]
+
+
+def cluster_environments(environments: Dict[str, List[MatchSpec]]) -> List[List[str]]:
+    # Greedy colouring of the conflict graph: the most conflicted (then the
+    # largest) environments are placed first, each into the compatible group
+    # it shares the most packages with
+    names = sorted(environments)
+    conflicts: Dict[str, Set[str]] = {name: set() for name in names}
+    for a, b in combinations(names, 2):
+        if not _compatible(environments[a], environments[b]):
+            conflicts[a].add(b)
+            conflicts[b].add(a)
+
+    def packages(members):
+        return {spec.name for member in members for spec in environments[member]}
+
+    groups: List[List[str]] = []
+    order = sorted(names, key=lambda n: (-len(conflicts[n]), -len(environments[n]), n))
+    for name in order:
+        candidates = [
+            group
+            for group in groups
+            if not conflicts[name].intersection(group)
+            and _compatible(environments[name], *(environments[m] for m in group))
+        ]
+        if candidates:
+            best = max(candidates, key=lambda g: len(packages(g) & packages([name])))
+            best.append(name)
+        else:
+            groups.append([name])
+    return sorted(sorted(group) for group in groups)
+
+
+def check_unique_names(env_files: Iterable[Path]) -> None:
+    # Kernels and prefixes are named after the file, so equal stems would collide
+    names = [env_file.stem for env_file in env_files]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(
+            f"Environment names must be unique: {', '.join(sorted(duplicates))}"
+        )
+
+
+def environment_covers(env_file: str | PurePath, notebook: str | PurePath) -> bool:
+    # `name.yml` covers `name.ipynb` next to it and every notebook in `name/`
+    stem = PurePath(env_file).with_suffix("")
+    notebook = PurePath(notebook)
+    return notebook == stem.with_suffix(".ipynb") or stem in notebook.parents
+
+
+def notebooks_for_environment(env_file: Path) -> List[Path]:
+    stem = env_file.with_suffix("")
+    candidates = [stem.with_suffix(".ipynb"), *sorted(stem.rglob("*.ipynb"))]
+    return [
+        notebook
+        for notebook in candidates
+        if notebook.is_file() and environment_covers(env_file, notebook)
+    ]
+
+
+def build_environment_groups(
+    files: List[Path],
+    conda_specs: List[MatchSpec],
+    pip_specs: List[Tuple[str, Optional[str]]],
+    root: Path,
+) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+    check_unique_names(files)
+    by_source = group_by_source(conda_specs, pip_specs)
+    env_files = {file.stem: file for file in files}
+    environments = {
+        name: by_source.get(str(file), ([], []))[0] for name, file in env_files.items()
+    }
+
+    groups, kernels = {}, {}
+    for members in cluster_environments(environments):
+        # Named after its largest member, which is usually what it resembles
+        group = max(members, key=lambda m: (len(environments[m]), m))
+        specs, requirements = [], []
+        for member in members:
+            member_specs, member_requirements = by_source.get(
+                str(env_files[member]), ([], [])
+            )
+            specs += member_specs
+            requirements += member_requirements
+            for notebook in notebooks_for_environment(env_files[member]):
+                kernels[notebook.relative_to(root).as_posix()] = group
+        dependencies, _ = resolve_specs(specs)
+        pip_dependencies = resolve_pip_requirements(requirements)
+        if pip_dependencies:
+            if "pip" not in dependencies:
+                dependencies.append("pip")
+            dependencies.append({"pip": pip_dependencies})
+        groups[group] = create_master_environment(dependencies, name=group)
+    return groups, dict(sorted(kernels.items()))
+
+
+def write_environment_groups(
+    out_dir: str | Path, groups: Dict[str, Dict], kernels: Dict[str, str]
+) -> List[Path]:
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    changed = []
+    for name, environment in groups.items():
+        path = out_dir / f"{name}.yml"
+        if write_if_changed(path, render_environment(environment)):
+            changed.append(path)
+    path = out_dir / KERNEL_MAP
+    if write_if_changed(path, json.dumps(kernels, indent=1) + "\n"):
+        changed.append(path)
+    return changed
 
 
 def collect_yaml_files(root: Path) -> List[Path]:
-    files = list(root.glob("**/*.yml"))
+    files = sorted(f for f in root.glob("**/*.yml") if is_environment_file(f))
     files.append(root.parent / "environment.yml")
     return files
 
 
 def get_environment_from_yml(file: Path) -> Dict:
     with file.open("r") as f:
-        environment = yaml.safe_load(f)
+        environment = yaml.load(f, Loader=YAML_LOADER)
     return environment
 
 
-def aggregate_env_dependencies(files: List[Path]) -> List[str]:
+def aggregate_env_dependencies(files: List[Path], profiler=NULL_PROFILER) -> List[str]:
     unrefined_dependencies: List = []
     for file in files:
-        environment = get_environment_from_yml(file)
-        unrefined_dependencies.extend(environment.get("dependencies", []))
+        with profiler.timer("load", file) as counters:
+            environment = get_environment_from_yml(file)
+            dependencies = environment.get("dependencies", [])
+            counters["dependencies"] = len(dependencies)
+        unrefined_dependencies.extend(dependencies)
     return unrefined_dependencies
 
 
 def extract_unique_dependencies(dep: List[str]) -> Tuple[Set, Dict]:
     dependencies = set()
     multi_versions = dict()
-    for d in dep:
-        parts = d.split("=")
-        name = parts[0]
+    conda_specs, _ = parse_environment_dependencies(dep)
+    for spec in conda_specs:
+        name = spec.name
         dependencies.add(name)
         # Check if version is specified
-        if len(parts) > 1:
-            version = parts[-1]
+        if spec.version is not None:
+            version = spec.version.lstrip("=")
             if name in multi_versions:
                 multi_versions[name].append(version)
             else:
@@ -49,7 +566,7 @@ def resolve_dependency_versions(
     final_dependencies = set()
     for name in unique_dependencies:
         if name in multi_versions:
-            latest_version = max(multi_versions[name], key=parse)
+            latest_version = max(multi_versions[name], key=version_key)
             final_dependencies.add(f"{name}={latest_version}")
         else:
             final_dependencies.add(name)
@@ -59,10 +576,13 @@ def resolve_dependency_versions(
 def create_master_environment(
     final_dependencies: List | Set, name: str = "eo-datascience-cookbook-dev"
 ) -> Dict:
+    # Pip sub-lists (dicts) go last, after the sorted conda specs
+    conda = sorted(d for d in final_dependencies if not isinstance(d, dict))
+    pip = [d for d in final_dependencies if isinstance(d, dict)]
     master_env = {
         "name": name,
         "channels": ["conda-forge"],
-        "dependencies": sorted(final_dependencies),
+        "dependencies": conda + pip,
     }
     return master_env
 
@@ -79,16 +599,88 @@ def dump_environment(output_file: str | Path, master_env: Dict) -> None:
         )
 
 
+def _indent_list_items(lines: Iterable[str]) -> str:
+    # Add two spaces before every list item
+    return "".join(
+        "  " + line if line.strip().startswith("-") else line for line in lines
+    )
+
+
 def fix_yml_indentation(output_file):
     with open(output_file, "r") as f:
         lines = f.readlines()
 
     with open(output_file, "w") as f:
-        for line in lines:
-            if line.strip().startswith("-"):
-                f.write("  " + line)  # Add two spaces before the line
-            else:
-                f.write(line)
+        f.write(_indent_list_items(lines))
+
+
+def render_environment(master_env: Dict) -> str:
+    # Same text as dump_environment followed by fix_yml_indentation
+    text = yaml.dump(
+        master_env, default_flow_style=False, sort_keys=False, indent=2, width=80
+    )
+    return _indent_list_items(text.splitlines(True))
+
+
+def environment_fingerprint(master_env: Dict) -> str:
+    # The name is irrelevant for prefix environments, so it is left out
+    canonical = json.dumps(
+        dict(
+            channels=master_env["channels"],
+            dependencies=master_env["dependencies"],
+        ),
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def write_if_changed(path: str | Path, text: str) -> bool:
+    path = Path(path)
+    try:
+        if path.read_text() == text:
+            return False
+    except OSError:
+        pass
+    path.write_text(text)
+    return True
+
+
+def lockfile_path(output_file: str | Path) -> Path:
+    return Path(output_file).with_suffix(".lock.json")
+
+
+def write_lockfile(
+    output_file: str | Path, master_env: Dict, fingerprint: str, files: List[Path]
+) -> bool:
+    lock = dict(
+        fingerprint=fingerprint,
+        sources=sorted(Path(os.path.relpath(file)).as_posix() for file in files),
+        **master_env,
+    )
+    return write_if_changed(
+        lockfile_path(output_file), json.dumps(lock, indent=1) + "\n"
+    )
+
+
+def read_fingerprint(output_file: str | Path) -> Optional[str]:
+    try:
+        return json.loads(lockfile_path(output_file).read_text())["fingerprint"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_prefix_fingerprint(prefix: str | Path) -> Optional[str]:
+    try:
+        return (Path(prefix) / PREFIX_FINGERPRINT).read_text().strip()
+    except OSError:
+        return None
+
+
+def record_prefix_fingerprint(prefix: str | Path, fingerprint: str) -> None:
+    path = Path(prefix) / PREFIX_FINGERPRINT
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(fingerprint + "\n")
 
 
 def main() -> None:
@@ -105,30 +697,125 @@ def main() -> None:
         help="Name of the environment",
         default="eo-datascience-cookbook-dev",
     )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Fail instead of keeping the newest pin on conflicting constraints",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of environment files loaded concurrently",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Parse every environment file instead of reusing {CACHE_FILE}",
+    )
+    parser.add_argument(
+        "--prefix",
+        type=str,
+        help="Conda prefix the environment is (or will be) installed into",
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--cluster",
+        type=str,
+        metavar="DIR",
+        help="Instead of one master environment, write a minimal set of "
+        f"conflict-free shared environments and a notebook {KERNEL_MAP} to DIR",
+    )
+    mode.add_argument(
+        "--check",
+        action="store_true",
+        help="Write nothing; exit 1 if the prefix (or, without --prefix, the "
+        "output file) is out of date",
+    )
+    mode.add_argument(
+        "--record",
+        action="store_true",
+        help="Record the fingerprint in --prefix after the environment was built",
+    )
+    add_profile_argument(parser)
     args = parser.parse_args()
+    if args.record and args.prefix is None:
+        parser.error("--record requires --prefix")
+    profiler = get_profiler(args.profile is not None)
+    cache_path = None if args.no_cache else Path(args.out).parent / CACHE_FILE
 
     root = Path("notebooks").resolve()
-    files = collect_yaml_files(root)
+    with profiler.timer("collect") as counters:
+        files = collect_yaml_files(root)
+        counters["files"] = len(files)
 
     # Collect all dependencies from all YAML files
-    unrefined_dependencies = aggregate_env_dependencies(files)
+    cache = load_cache(cache_path) if cache_path is not None else None
+    conda_specs, pip_specs = aggregate_env_specs(files, profiler, cache, args.jobs)
+    save_cache(cache_path, cache or {})
 
-    unique_dependencies, multi_versions = extract_unique_dependencies(
-        unrefined_dependencies
-    )
-    # Update dependencies set with latest versions
-    final_dependencies = resolve_dependency_versions(
-        unique_dependencies, multi_versions
-    )
+    # Intersect the version constraints of every package
+    with profiler.timer("resolve"):
+        final_dependencies, conflicts = resolve_specs(conda_specs)
+        pip_dependencies = resolve_pip_requirements(pip_specs)
+    for conflict in conflicts:
+        print(f"Conflicting constraints for {conflict}", file=sys.stderr)
+    if conflicts and args.strict:
+        sys.exit(1)
+    if pip_dependencies:
+        if "pip" not in final_dependencies:
+            final_dependencies.append("pip")
+        final_dependencies.append({"pip": pip_dependencies})
+
+    if args.cluster:
+        notebook_files = [file for file in files if root in file.parents]
+        with profiler.timer("cluster") as counters:
+            try:
+                groups, kernels = build_environment_groups(
+                    notebook_files, conda_specs, pip_specs, root
+                )
+            except ValueError as e:
+                sys.exit(str(e))
+            counters["environments"] = len(groups)
+        with profiler.timer("write", args.cluster):
+            write_environment_groups(args.cluster, groups, kernels)
+        finish_profile(profiler, args.profile)
+        print(
+            f"Merged {len(notebook_files)} environments into {len(groups)}: "
+            + ", ".join(groups)
+        )
+        return
 
-    # Create master YAML file
     master_env = create_master_environment(final_dependencies, name=args.name)
-    dump_environment(args.out, master_env)
+    fingerprint = environment_fingerprint(master_env)
+
+    if args.check:
+        if args.prefix is not None:
+            current = read_prefix_fingerprint(args.prefix)
+            target = args.prefix
+        else:
+            current = read_fingerprint(args.out)
+            target = args.out
+        finish_profile(profiler, args.profile)
+        if current != fingerprint:
+            print(f"{target} is out of date.")
+            sys.exit(1)
+        print(f"{target} is up to date.")
+        return
 
-    # Dirty fix: Read the file and add two spaces before
-    fix_yml_indentation(args.out)
+    # Create master YAML file, leaving it untouched when nothing changed
+    with profiler.timer("write", args.out):
+        changed = write_if_changed(args.out, render_environment(master_env))
+        write_lockfile(args.out, master_env, fingerprint, files)
+    if args.record:
+        record_prefix_fingerprint(args.prefix, fingerprint)
+    finish_profile(profiler, args.profile)
     print("Environments have been merged.")
-    print(f"{args.out} file created successfully.")
+    if changed:
+        print(f"{args.out} file created successfully.")
+    else:
+        print(f"{args.out} is up to date.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,143 @@
+import json
+from pathlib import Path
+from typing import Dict
+
+import nbformat
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Mimetypes that nbformat stores as lists of lines although they are not text/*
+_NON_TEXT_SPLIT_MIMES = {"application/javascript", "image/svg+xml"}
+
+
+def _loads(data: bytes | str) -> Dict:
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN and Infinity, which nbformat reads and writes but orjson rejects
+            pass
+    return json.loads(data)
+
+
+def _is_json_mime(mime: str) -> bool:
+    return mime == "application/json" or (
+        mime.startswith("application/") and mime.endswith("+json")
+    )
+
+
+def _rejoin_mimebundle(data: Dict) -> None:
+    for key, value in data.items():
+        if (
+            not _is_json_mime(key)
+            and isinstance(value, list)
+            and all(isinstance(line, str) for line in value)
+        ):
+            data[key] = "".join(value)
+
+
+def _split_mimebundle(data: Dict) -> Dict:
+    return {
+        key: (
+            value.splitlines(True)
+            if isinstance(value, str)
+            and (key.startswith("text/") or key in _NON_TEXT_SPLIT_MIMES)
+            else value
+        )
+        for key, value in data.items()
+    }
+
+
+def reads_notebook(data: bytes | str) -> Dict:
+    nb = _loads(data)
+    if nb.get("nbformat") != 4:
+        # Older notebooks need nbformat's upgrade path
+        text = data.decode("utf-8") if isinstance(data, bytes) else data
+        return nbformat.reads(text, as_version=4)
+
+    # Same in-memory layout as `nbformat.reads`, but on plain dicts
+    nb["metadata"].pop("orig_nbformat", None)
+    nb["metadata"].pop("orig_nbformat_minor", None)
+    nb["metadata"].pop("signature", None)
+    for cell in nb["cells"]:
+        cell["metadata"].pop("trusted", None)
+        if isinstance(cell.get("source"), list):
+            cell["source"] = "".join(cell["source"])
+        for attachment in cell.get("attachments", {}).values():
+            _rejoin_mimebundle(attachment)
+        if cell.get("cell_type") == "code":
+            for output in cell.get("outputs", []):
+                output_type = output.get("output_type", "")
+                if output_type in ("execute_result", "display_data"):
+                    _rejoin_mimebundle(output.get("data", {}))
+                elif output_type and isinstance(output.get("text", ""), list):
+                    output["text"] = "".join(output["text"])
+    return nb
+
+
+def read_notebook(nb_path: str | Path) -> Dict:
+    return reads_notebook(Path(nb_path).read_bytes())
+
+
+def _split_cell(cell: Dict) -> Dict:
+    # Shallow copies only; the in-memory notebook is left untouched
+    cell = dict(cell)
+    if isinstance(cell.get("source"), str):
+        cell["source"] = cell["source"].splitlines(True)
+    if "attachments" in cell:
+        cell["attachments"] = {
+            name: _split_mimebundle(bundle)
+            for name, bundle in cell["attachments"].items()
+        }
+    if cell.get("cell_type") == "code":
+        outputs = []
+        for output in cell.get("outputs", []):
+            output = dict(output)
+            if output["output_type"] in ("execute_result", "display_data"):
+                output["data"] = _split_mimebundle(output.get("data", {}))
+            elif output["output_type"] == "stream" and isinstance(output["text"], str):
+                output["text"] = output["text"].splitlines(True)
+            outputs.append(output)
+        cell["outputs"] = outputs
+    cell["metadata"] = {
+        key: value for key, value in cell["metadata"].items() if key != "trusted"
+    }
+    return cell
+
+
+def writes_notebook(nb: Dict) -> str:
+    # Byte-identical to `nbformat.writes` for v4 notebooks, without validation
+    transient = ("orig_nbformat", "orig_nbformat_minor", "signature")
+    nb = dict(nb)
+    nb["metadata"] = {
+        key: value for key, value in nb["metadata"].items() if key not in transient
+    }
+    nb["cells"] = [_split_cell(cell) for cell in nb["cells"]]
+    return json.dumps(
+        nb,
+        indent=1,
+        sort_keys=True,
+        separators=(",", ": "),
+        ensure_ascii=False,
+        default=_encode_bytes,
+    )
+
+
+def _encode_bytes(obj):
+    if isinstance(obj, bytes):
+        return obj.decode("ascii")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def write_notebook(nb: Dict, nb_path: str | Path) -> None:
+    text = writes_notebook(nb)
+    if not text.endswith("\n"):
+        text += "\n"
+    Path(nb_path).write_text(text, encoding="utf-8")
+
+
+def validate_notebook(nb: Dict) -> None:
+    nbformat.validate(nb, version=4)
@@ -0,0 +1,143 @@
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+OUTPUTS_DIR = "_outputs"
+OFFLOAD_THRESHOLD = 100 * 1024
+BINARY_MIMETYPES = {"image/png", "image/jpeg", "image/gif", "image/webp", "image/bmp"}
+METADATA_KEY = "offloaded"
+JAVASCRIPT = "application/javascript"
+
+
+def _is_offloadable(mime: str) -> bool:
+    # JSON bundles (e.g. the BokehJS and HoloViews loaders) are kept inline:
+    # their renderers read the data from the notebook, a link cannot replace it
+    return mime.startswith("image/") or mime in ("text/html", JAVASCRIPT)
+
+
+def _script_tag(link: str) -> str:
+    return f'\n<script type="text/javascript" src="{link}"></script>'
+
+
+def _extension(mime: str) -> str:
+    if mime.endswith("+json") or mime == "application/json":
+        return ".json"
+    return mimetypes.guess_extension(mime) or ".bin"
+
+
+def _payload(mime: str, value) -> bytes:
+    if mime in BINARY_MIMETYPES:
+        text = "".join(value) if isinstance(value, list) else value
+        return base64.b64decode(text)
+    if isinstance(value, (dict, list)) and _extension(mime) == ".json":
+        return json.dumps(value, sort_keys=True).encode("utf-8")
+    text = "".join(value) if isinstance(value, list) else value
+    return text.encode("utf-8")
+
+
+def _size(value) -> int:
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return sum(len(v) for v in value)
+    return len(json.dumps(value))
+
+
+def store_blob(data: bytes, ext: str, root: str | Path) -> Path:
+    # Content addressed, so identical outputs across notebooks are stored once
+    rel_path = Path(OUTPUTS_DIR) / (hashlib.sha256(data).hexdigest() + ext)
+    blob = Path(root) / rel_path
+    if not blob.exists():
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp = blob.with_suffix(f"{blob.suffix}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(blob)
+    return rel_path
+
+
+def offload_outputs(
+    nb: Dict,
+    nb_path: str | Path,
+    root: str | Path,
+    threshold: int = OFFLOAD_THRESHOLD,
+) -> Dict:
+    for cell in nb["cells"]:
+        for output in cell.get("outputs", []):
+            offload_output(output, nb_path, root, threshold)
+    return nb
+
+
+def offload_output(
+    output: Dict, nb_path: str | Path, root: str | Path, threshold: int
+) -> Optional[Dict]:
+    data = output.get("data")
+    if not data:
+        return None
+    offloaded = {}
+    has_script = JAVASCRIPT in data
+    for mime in list(data):
+        if not _is_offloadable(mime) or _size(data[mime]) <= threshold:
+            continue
+        # Offloaded scripts are loaded from the HTML, which therefore stays inline
+        if mime == "text/html" and has_script:
+            continue
+        rel_path = store_blob(_payload(mime, data[mime]), _extension(mime), root)
+        # Links are relative to the notebook, so the converted tree can be moved
+        link = Path(os.path.relpath(rel_path, Path(nb_path).parent)).as_posix()
+        offloaded[mime] = link
+        del data[mime]
+
+    if not offloaded:
+        return None
+    if JAVASCRIPT in offloaded:
+        html = data.get("text/html", "")
+        html = "".join(html) if isinstance(html, list) else html
+        data["text/html"] = html + _script_tag(offloaded[JAVASCRIPT])
+    if "text/markdown" not in data:
+        markdown = _markdown_reference(offloaded)
+        if markdown is not None:
+            data["text/markdown"] = markdown
+    output.setdefault("metadata", {})[METADATA_KEY] = offloaded
+    return offloaded
+
+
+def _markdown_reference(offloaded: Dict[str, str]) -> Optional[str]:
+    for mime, link in offloaded.items():
+        if mime.startswith("image/"):
+            return f"![]({link})"
+    if "text/html" in offloaded:
+        return "```{raw} html\n:file: " + offloaded["text/html"] + "\n```"
+    return None
+
+
+def restore_outputs(nb: Dict, nb_path: str | Path, root: str | Path) -> Dict:
+    nb_dir = Path(root) / Path(nb_path).parent
+    for cell in nb["cells"]:
+        for output in cell.get("outputs", []):
+            offloaded = output.get("metadata", {}).pop(METADATA_KEY, None)
+            if not offloaded:
+                continue
+            markdown = _markdown_reference(offloaded)
+            if markdown is not None and markdown == output["data"].get("text/markdown"):
+                del output["data"]["text/markdown"]
+            if JAVASCRIPT in offloaded:
+                html = output["data"].pop("text/html")
+                html = html[: -len(_script_tag(offloaded[JAVASCRIPT]))]
+                if html:
+                    output["data"]["text/html"] = html
+            for mime, link in offloaded.items():
+                output["data"][mime] = _restore_payload(mime, nb_dir / link)
+    return nb
+
+
+def _restore_payload(mime: str, blob: Path) -> str | Dict:
+    data = blob.read_bytes()
+    if mime in BINARY_MIMETYPES:
+        return base64.b64encode(data).decode("ascii")
+    if _extension(mime) == ".json":
+        return json.loads(data)
+    return data.decode("utf-8")
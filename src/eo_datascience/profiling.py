@@ -0,0 +1,146 @@
+import csv
+import json
+import resource
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, TextIO, Tuple
+
+Key = Tuple[str, str]
+
+
+class Profiler:
+    enabled = True
+
+    def __init__(self):
+        # (stage, item) -> summed seconds and counters
+        self.records: Dict[Key, Dict[str, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+
+    def add(self, stage: str, item: str = "", seconds: float = 0.0, **counters):
+        record = self.records[(stage, str(item))]
+        record["seconds"] += seconds
+        record["calls"] += 1
+        for name, value in counters.items():
+            record[name] += value
+
+    @contextmanager
+    def timer(self, stage: str, item: str = "", **counters) -> Iterator[Dict]:
+        # Counters can be filled in by the caller while the block runs
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            self.add(stage, item, time.perf_counter() - start, **counters)
+
+    def merge(self, records: Optional[Dict[Key, Dict[str, float]]]) -> None:
+        for (stage, item), record in (records or {}).items():
+            target = self.records[(stage, item)]
+            for name, value in record.items():
+                target[name] += value
+
+    def export(self) -> Dict[Key, Dict[str, float]]:
+        return {key: dict(record) for key, record in self.records.items()}
+
+    def rows(self):
+        for (stage, item), record in sorted(self.records.items()):
+            yield dict(stage=stage, item=item, **record)
+
+    def totals(self, by: str) -> Dict[str, float]:
+        index = 0 if by == "stage" else 1
+        totals: Dict[str, float] = defaultdict(float)
+        for key, record in self.records.items():
+            totals[key[index]] += record["seconds"]
+        return totals
+
+    def write(self, path: str | Path) -> None:
+        path = Path(path)
+        rows = list(self.rows())
+        if path.suffix == ".csv":
+            fields = ["stage", "item"] + sorted(
+                {name for row in rows for name in row} - {"stage", "item"}
+            )
+            with path.open("w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=fields, restval=0)
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            report = dict(peak_rss_bytes=peak_rss(), records=rows)
+            path.write_text(json.dumps(report, indent=1) + "\n")
+
+    def summary(self, top: int = 10, file: TextIO = sys.stderr) -> None:
+        for by in ("stage", "item"):
+            totals = self.totals(by)
+            if by == "item":
+                totals.pop("", None)
+            if not totals:
+                continue
+            print(f"Slowest {by}s:", file=file)
+            ranked = sorted(totals.items(), key=lambda kv: kv[1], reverse=True)
+            for name, seconds in ranked[:top]:
+                print(f"  {seconds * 1e3:10.1f} ms  {name}", file=file)
+        print(f"Peak RSS: {peak_rss() / 2**20:.1f} MiB", file=file)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfiler:
+    # Stand-in when profiling is disabled; every call is a cheap no-op
+    enabled = False
+    _timer = _NullTimer()
+
+    def add(self, stage, item="", seconds=0.0, **counters):
+        pass
+
+    def timer(self, stage, item="", **counters):
+        return self._timer
+
+    def merge(self, records):
+        pass
+
+    def export(self):
+        return None
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def peak_rss() -> int:
+    # Linux reports kilobytes, macOS bytes; worker processes count as children
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale
+
+
+def get_profiler(enabled: bool) -> Profiler | NullProfiler:
+    return Profiler() if enabled else NULL_PROFILER
+
+
+def finish_profile(profiler: Profiler | NullProfiler, report: Optional[str]) -> None:
+    if not profiler.enabled:
+        return
+    if report:
+        profiler.write(report)
+    profiler.summary()
+
+
+def add_profile_argument(parser) -> None:
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="REPORT",
+        help="Profile stages and print a summary; optionally write a .json or "
+        ".csv report",
+    )
@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from eo_datascience.merge_envs import (
+    check_unique_names,
+    environment_fingerprint,
+    get_environment_from_yml,
+    is_environment_file,
+    read_prefix_fingerprint,
+    record_prefix_fingerprint,
+)
+
+try:
+    from jupyter_core.paths import jupyter_data_dir
+except ImportError:  # pragma: no cover
+    jupyter_data_dir = None
+
+PREFIX_ROOT = ".conda_envs"
+
+
+@dataclass
+class ProvisionResult:
+    name: str
+    prefix: Path
+    status: str
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+class CondaInstaller:
+    # Creates prefixes with conda (or mamba); concurrent runs share the
+    # package cache in `pkgs_dir`, which conda locks per package
+    def __init__(self, conda: str = "conda", pkgs_dir: Optional[str | Path] = None):
+        self.conda = conda
+        self.env = dict(os.environ)
+        if pkgs_dir is not None:
+            self.env["CONDA_PKGS_DIRS"] = str(Path(pkgs_dir).resolve())
+
+    def install(self, env_file: Path, prefix: Path) -> None:
+        if (prefix / "conda-meta").is_dir():
+            command = ["env", "update", "--prune"]
+        else:
+            command = ["env", "create"]
+        subprocess.run(
+            [self.conda, *command, "--file", str(env_file), "--prefix", str(prefix)],
+            env=self.env,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+
+
+def default_kernel_dir() -> Path:
+    # Where `ipykernel install --user` puts kernelspecs
+    if jupyter_data_dir is not None:
+        return Path(jupyter_data_dir())
+    return Path("~/.local/share/jupyter").expanduser()
+
+
+def environment_files(root: str | Path) -> List[Path]:
+    return sorted(f for f in Path(root).glob("**/*.yml") if is_environment_file(f))
+
+
+def spec_fingerprint(env_file: Path) -> str:
+    env = get_environment_from_yml(env_file)
+    return environment_fingerprint(
+        dict(
+            channels=env.get("channels") or [],
+            dependencies=env.get("dependencies") or [],
+        )
+    )
+
+
+def _python(prefix: Path) -> Path:
+    if sys.platform == "win32":
+        return prefix / "python.exe"
+    return prefix / "bin" / "python"
+
+
+def register_kernels(prefixes: Dict[str, Path], kernel_dir: str | Path) -> List[str]:
+    # Writing the kernelspecs directly is what `ipykernel install` does, minus
+    # starting every environment's interpreter
+    registered = []
+    for name, prefix in sorted(prefixes.items()):
+        spec = dict(
+            argv=[
+                str(_python(prefix.resolve())),
+                "-m",
+                "ipykernel_launcher",
+                "-f",
+                "{connection_file}",
+            ],
+            display_name=name,
+            language="python",
+            metadata=dict(debugger=True),
+        )
+        path = Path(kernel_dir) / "kernels" / name / "kernel.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        text = json.dumps(spec, indent=1) + "\n"
+        if not path.exists() or path.read_text() != text:
+            path.write_text(text)
+        registered.append(name)
+    return registered
+
+
+def provision_environment(
+    env_file: Path, prefix: Path, installer, force: bool = False
+) -> ProvisionResult:
+    name = env_file.stem
+    start = time.perf_counter()
+    try:
+        fingerprint = spec_fingerprint(env_file)
+        if not force and read_prefix_fingerprint(prefix) == fingerprint:
+            return ProvisionResult(name, prefix, "skipped")
+        existed = (prefix / "conda-meta").is_dir()
+        installer.install(env_file, prefix)
+        # Recorded last, so an interrupted install is retried next time
+        record_prefix_fingerprint(prefix, fingerprint)
+    except subprocess.CalledProcessError as e:
+        error = (e.stderr or "").strip().splitlines()[-1:] or [str(e)]
+        return ProvisionResult(
+            name, prefix, "failed", time.perf_counter() - start, error[0]
+        )
+    except Exception as e:
+        return ProvisionResult(
+            name, prefix, "failed", time.perf_counter() - start, str(e)
+        )
+    status = "updated" if existed else "created"
+    return ProvisionResult(name, prefix, status, time.perf_counter() - start)
+
+
+def provision_environments(
+    env_files: List[Path],
+    prefix_root: str | Path = PREFIX_ROOT,
+    installer=None,
+    jobs: int = 1,
+    kernel_dir: Optional[str | Path] = None,
+    force: bool = False,
+) -> List[ProvisionResult]:
+    installer = installer or CondaInstaller()
+    prefix_root = Path(prefix_root)
+    check_unique_names(env_files)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(env_files)))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(
+            executor.map(
+                lambda env_file: provision_environment(
+                    env_file, prefix_root / env_file.stem, installer, force
+                ),
+                env_files,
+            )
+        )
+    if kernel_dir is not None:
+        register_kernels(
+            {r.name: r.prefix for r in results if r.status != "failed"}, kernel_dir
+        )
+    return results
+
+
+def format_results(results: List[ProvisionResult]) -> str:
+    lines = []
+    for result in sorted(results, key=lambda r: r.seconds, reverse=True):
+        line = f"{result.status:8} {result.seconds:8.1f} s  {result.name}"
+        if result.error:
+            line += f"  ({result.error})"
+        lines.append(line)
+    total = sum(result.seconds for result in results)
+    lines.append(f"{len(results)} environments, {total:.1f} s of install time")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Create the notebook conda environments and their kernels"
+    )
+    parser.add_argument(
+        "root",
+        type=str,
+        nargs="?",
+        default="notebooks",
+        help="Directory searched for environment files (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--prefix",
+        type=str,
+        default=PREFIX_ROOT,
+        help="Directory holding one prefix per environment (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of environments installed concurrently",
+    )
+    parser.add_argument(
+        "--conda",
+        type=str,
+        default="conda",
+        help="conda-compatible executable, e.g. mamba (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pkgs-dir",
+        type=str,
+        help="Package cache shared by all installs (default: conda's own)",
+    )
+    parser.add_argument(
+        "--kernel-dir",
+        type=str,
+        help="Jupyter data directory to register the kernels in "
+        "(default: jupyter --data-dir)",
+    )
+    parser.add_argument(
+        "--no-kernels",
+        action="store_true",
+        help="Only create the environments",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Reinstall even if the recorded fingerprint matches the YAML",
+    )
+    args = parser.parse_args()
+
+    kernel_dir = None
+    if not args.no_kernels:
+        kernel_dir = args.kernel_dir or default_kernel_dir()
+    try:
+        results = provision_environments(
+            environment_files(args.root),
+            args.prefix,
+            CondaInstaller(args.conda, args.pkgs_dir),
+            jobs=args.jobs,
+            kernel_dir=kernel_dir,
+            force=args.force,
+        )
+    except ValueError as e:
+        sys.exit(str(e))
+    print(format_results(results))
+    if any(result.status == "failed" for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,58 @@
 import argparse
+import os
+import sys
 from pathlib import Path
-from typing import Literal
+from typing import Literal, Set
 
 import yaml
-from eo_datascience.clean_nb import substitute_path
-
-
-def render_toc(p, out="."):
-    with open(p, "r") as ff:
-        quarto_toc = yaml.safe_load(ff)
-    toc = _render_toc(quarto_toc)
-    with open((Path(out) / "_toc.yml").resolve().as_posix(), "w+") as ff:
-        yaml.dump(toc, ff)
-
-
-def _render_toc(toc):
+from eo_datascience.profiling import (
+    NULL_PROFILER,
+    add_profile_argument,
+    finish_profile,
+    get_profiler,
+)
+
+SOURCE_DIR = "chapters"
+TARGET_DIR = "notebooks"
+DOCUMENT_SUFFIXES = (".qmd", ".ipynb", ".md")
+
+
+def render_toc(p, out=".", profiler=NULL_PROFILER):
+    with profiler.timer("read", p):
+        with open(p, "r") as ff:
+            quarto_toc = yaml.safe_load(ff)
+    missing = []
+    with profiler.timer("index", p) as counters:
+        index = build_file_index(Path(p).parent)
+        counters["files"] = len(index)
+    with profiler.timer("render", p):
+        toc = _render_toc(quarto_toc, index, missing)
+    for file_path in missing:
+        print(f"TOC entry {file_path} does not exist", file=sys.stderr)
+    toc_path = (Path(out) / "_toc.yml").resolve().as_posix()
+    with profiler.timer("write", toc_path):
+        with open(toc_path, "w+") as ff:
+            yaml.dump(toc, ff)
+    return missing
+
+
+def build_file_index(root=".", dirs=(SOURCE_DIR, TARGET_DIR)) -> Set[str]:
+    # One walk over the book sources, instead of a stat per TOC entry
+    index = set()
+    for dir in dirs:
+        for parent, subdirs, files in os.walk(Path(root) / dir):
+            subdirs[:] = [d for d in subdirs if not d.startswith((".", "_"))]
+            rel_parent = Path(os.path.relpath(parent, root)).as_posix()
+            index.update(f"{rel_parent}/{file}" for file in files)
+    return index
+
+
+def _render_toc(toc, index=None, missing=None):
+    if index is None:
+        index = build_file_index()
     ls = [dict(caption="Preamble", chapters=[dict(file="notebooks/how-to-cite")])]
-    ls += transform_main(toc) + transform_appendix(toc)
+    ls += transform_main(toc, index, missing)
+    ls += transform_appendix(toc, index, missing)
     ls += [dict(caption="References", chapters=[dict(file="notebooks/references")])]
     return dict(format="jb-book", root="README", parts=ls)
 
@@ -29,82 +65,101 @@ def extract_appendix(toc):
     return toc["book"]["appendices"][:-1]
 
 
-def transform_main(toc):
-    return rename_keys_section(extract_main(toc), "main")
+def transform_main(toc, index=None, missing=None):
+    return rename_keys_section(extract_main(toc), "main", index, missing)
 
 
-def transform_appendix(toc):
-    return rename_keys_section(extract_appendix(toc), "appendix")
+def transform_appendix(toc, index=None, missing=None):
+    return rename_keys_section(extract_appendix(toc), "appendix", index, missing)
 
 
 def rename_keys_section(
     sec,
     part: Literal["main", "appendix"],
+    index=None,
+    missing=None,
 ):
-    sections = sec.copy()
-    for i, section in enumerate(sections):
-        sections[i] = _rename_keys_section(section, ("part", "caption"))
+    if index is None:
+        index = build_file_index()
+    parts = []
+    for section in sec:
+        caption, node = _transform_part(section, index, missing)
         if part == "main":
-            restructure_section_main(sections, i)
-        elif part == "appendix":
-            restructure_section_appendix(sections, i)
+            caption = "Courses"
+        # Consecutive parts with the same caption share one Jupyter Book part
+        if parts and parts[-1]["caption"] == caption:
+            parts[-1]["chapters"] += node
         else:
-            sections[i]["caption"] = sections[i]["caption"][0]["file"]
-
-    return sections
-
-
-def restructure_section_main(sections, i):
-    restruct = [
-        {
-            "file": sections[i]["caption"][i]["file"],
-            "sections": sections[i]["chapters"],
-        }
-    ]
-    sections[i]["chapters"] = restruct
-    sections[i]["caption"] = "Courses"
-
-
-def restructure_section_appendix(sections, i):
-    restruct = [
-        {
-            "file": sections[i]["caption"][0]["file"],
-            "sections": sections[i]["chapters"],
-        }
-    ]
-    name = sections[i]["caption"][0]["file"].split("/")[1]
-    sections[i]["chapters"] = restruct
-    sections[i]["caption"] = name.capitalize()
-
-
-def _rename_keys_section(section, key_rename):
-    keys = [i.replace(*key_rename) for i in section.keys()]
-    section = dict(zip(keys, section.values()))
-
-    for key in section.keys():
-        try:
-            file_path = section[key]
-            if not isinstance(file_path, list):
-                file_path = [file_path]
-            section[key] = [{"file": rename_file_path(i)} for i in file_path]
-        except KeyError:
-            pass
-    return section
-
-
-def rename_file_path(file_path):
-    if Path(file_path).exists():
-        file_path = str(
-            substitute_path(file_path, "chapters", "notebooks").with_suffix("")
+            parts.append(dict(caption=caption, chapters=node))
+    return parts
+
+
+def _transform_part(section, index, missing):
+    title = section.get("part") if isinstance(section, dict) else None
+    if title is not None and not _is_document(title):
+        # `part: "Title"` only names the part; its chapters are the entries
+        children = section.get("chapters") or []
+        return title, [_transform_entry(c, index, missing) for c in children]
+    node = _transform_entry(section, index, missing)
+    return _caption(node["file"]), [node]
+
+
+def _transform_entry(entry, index, missing):
+    # Linear recursive pass over part/chapters/sections trees of any depth
+    if not isinstance(entry, dict):
+        return {"file": rename_file_path(entry, index, missing)}
+    file_path = entry.get("part") or entry.get("file") or entry.get("href")
+    children = entry.get("chapters") or entry.get("sections") or []
+    node = {}
+    if file_path is not None:
+        node["file"] = rename_file_path(file_path, index, missing)
+    if children:
+        node["sections"] = [_transform_entry(c, index, missing) for c in children]
+    return node
+
+
+def _is_document(file_path):
+    return Path(file_path).suffix in DOCUMENT_SUFFIXES
+
+
+def _caption(file_path):
+    parts = Path(file_path).parts
+    return (parts[1] if len(parts) > 2 else Path(file_path).stem).capitalize()
+
+
+def _converted_path(file_path):
+    parts = Path(file_path).parts
+    if parts and parts[0] == SOURCE_DIR:
+        parts = (TARGET_DIR,) + parts[1:]
+    return Path(*parts)
+
+
+def rename_file_path(file_path, index=None, missing=None):
+    converted = _converted_path(file_path)
+    if index is None:
+        exists = Path(file_path).exists()
+    else:
+        exists = (
+            Path(file_path).as_posix() in index
+            or converted.with_suffix(".ipynb").as_posix() in index
         )
-    return file_path
+    if not exists:
+        if missing is not None:
+            missing.append(file_path)
+        return file_path
+    return converted.with_suffix("").as_posix()
 
 
 def main():
     parser = argparse.ArgumentParser(description="Convert Quarto to Jupyter Book")
     parser.add_argument("out", type=str, help="Destination directory")
+    add_profile_argument(parser)
     args = parser.parse_args()
-    render_toc(p=Path("_quarto.yml").absolute().as_posix(), out=args.out)
+    profiler = get_profiler(args.profile is not None)
+    render_toc(
+        p=Path("_quarto.yml").absolute().as_posix(), out=args.out, profiler=profiler
+    )
+    finish_profile(profiler, args.profile)
 
 
 if __name__ == "__main__":
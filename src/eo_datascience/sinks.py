@@ -0,0 +1,67 @@
+import zipfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from eo_datascience.clean_nb import write_if_changed
+from eo_datascience.nbio import writes_notebook
+
+
+def _text(nb: Dict) -> str:
+    text = writes_notebook(nb)
+    return text if text.endswith("\n") else text + "\n"
+
+
+class Sink(ABC):
+    @abstractmethod
+    def add(self, rel_path: str | Path, nb: Dict) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class DirectorySink(Sink):
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def add(self, rel_path: str | Path, nb: Dict) -> None:
+        nb_path = self.root / rel_path
+        nb_path.parent.mkdir(parents=True, exist_ok=True)
+        write_if_changed(nb, nb_path)
+
+
+class ZipSink(Sink):
+    def __init__(self, path: str | Path, compression: int = zipfile.ZIP_DEFLATED):
+        self.archive = zipfile.ZipFile(path, "w", compression=compression)
+
+    def add(self, rel_path: str | Path, nb: Dict) -> None:
+        self.archive.writestr(Path(rel_path).as_posix(), _text(nb))
+
+    def close(self) -> None:
+        self.archive.close()
+
+
+class MappingSink(Sink):
+    # Keeps the converted notebooks themselves, keyed by posix relative path
+    def __init__(self, mapping: Optional[Dict] = None):
+        self.mapping = {} if mapping is None else mapping
+
+    def add(self, rel_path: str | Path, nb: Dict) -> None:
+        self.mapping[Path(rel_path).as_posix()] = nb
+
+
+def write_all(notebooks: Iterable[Tuple[str | Path, Dict]], sink: Sink) -> int:
+    count = 0
+    with sink:
+        for rel_path, nb in notebooks:
+            sink.add(rel_path, nb)
+            count += 1
+    return count
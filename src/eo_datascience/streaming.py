@@ -0,0 +1,213 @@
+import filecmp
+import json
+import mmap
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+from eo_datascience.nbio import _split_cell
+
+# Cell members that can hold large payloads; they are copied, never parsed
+RAW_KEYS = ("outputs", "attachments")
+COPY_CHUNK = 1 << 20
+
+_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+_STRING_SPECIAL = re.compile(rb'["\\]')
+_STRUCTURAL = re.compile(rb'[\[\]{}"]')
+_SCALAR = re.compile(rb"[^,\]}\s]*")
+_MARKER = "@@eo-datascience-raw-{}@@"
+QUOTE, OPEN_OBJECT, CLOSE_OBJECT, OPEN_ARRAY, CLOSE_ARRAY = b'"{}[]'
+
+
+@dataclass(frozen=True)
+class RawJSON:
+    # Byte span of an unparsed JSON value in the source notebook
+    path: str
+    start: int
+    end: int
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.start)
+            return json.loads(f.read(self.end - self.start))
+
+
+def _skip_whitespace(buf, i: int) -> int:
+    return _WHITESPACE.match(buf, i).end()
+
+
+def _string_end(buf, i: int) -> int:
+    # `i` points at the opening quote
+    i += 1
+    while True:
+        match = _STRING_SPECIAL.search(buf, i)
+        if match is None:
+            raise ValueError("Unterminated string in notebook JSON")
+        if match.group() == b"\\":
+            i = match.end() + 1
+        else:
+            return match.end()
+
+
+def _value_end(buf, i: int) -> int:
+    char = buf[i]
+    if char == QUOTE:
+        return _string_end(buf, i)
+    if char not in (OPEN_OBJECT, OPEN_ARRAY):
+        return _SCALAR.match(buf, i).end()
+    depth = 0
+    while True:
+        match = _STRUCTURAL.search(buf, i)
+        if match is None:
+            raise ValueError("Unterminated container in notebook JSON")
+        token = match.group()
+        if token == b'"':
+            i = _string_end(buf, match.start())
+            continue
+        i = match.end()
+        depth += 1 if token in (b"{", b"[") else -1
+        if depth == 0:
+            return i
+
+
+def _members(buf, i: int) -> Iterator[Tuple[str, int, int]]:
+    # Yield (key, value start, value end) of the object starting at `i`
+    i = _skip_whitespace(buf, i)
+    if buf[i] != OPEN_OBJECT:
+        raise ValueError("Expected a JSON object in notebook")
+    i = _skip_whitespace(buf, i + 1)
+    if buf[i] == CLOSE_OBJECT:
+        return
+    while True:
+        key_end = _string_end(buf, i)
+        key = json.loads(buf[i:key_end])
+        i = _skip_whitespace(buf, key_end)
+        i = _skip_whitespace(buf, i + 1)  # colon
+        end = _value_end(buf, i)
+        yield key, i, end
+        i = _skip_whitespace(buf, end)
+        if buf[i] == CLOSE_OBJECT:
+            return
+        i = _skip_whitespace(buf, i + 1)  # comma
+
+
+def _items(buf, i: int) -> Iterator[Tuple[int, int]]:
+    i = _skip_whitespace(buf, i)
+    i = _skip_whitespace(buf, i + 1)
+    if buf[i] == CLOSE_ARRAY:
+        return
+    while True:
+        end = _value_end(buf, i)
+        yield i, end
+        i = _skip_whitespace(buf, end)
+        if buf[i] == CLOSE_ARRAY:
+            return
+        i = _skip_whitespace(buf, i + 1)
+
+
+def _read_cell(buf, start: int, path: str) -> Dict:
+    cell = {}
+    for key, value_start, value_end in _members(buf, start):
+        if key in RAW_KEYS:
+            cell[key] = RawJSON(path, value_start, value_end)
+        else:
+            cell[key] = json.loads(buf[value_start:value_end])
+    # Same in-memory layout as `reads_notebook` for everything that is parsed
+    cell.setdefault("metadata", {}).pop("trusted", None)
+    if isinstance(cell.get("source"), list):
+        cell["source"] = "".join(cell["source"])
+    return cell
+
+
+def read_notebook_streaming(nb_path) -> Dict:
+    # Only metadata and cell sources are parsed; outputs stay on disk
+    path = os.fspath(Path(nb_path).resolve())
+    with open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buf:
+        nb = {}
+        for key, value_start, value_end in _members(buf, 0):
+            if key == "cells":
+                nb["cells"] = [
+                    _read_cell(buf, start, path)
+                    for start, _ in _items(buf, value_start)
+                ]
+            else:
+                nb[key] = json.loads(buf[value_start:value_end])
+    if nb.get("nbformat") != 4:
+        raise ValueError("Streaming conversion requires nbformat 4 notebooks")
+    for key in ("orig_nbformat", "orig_nbformat_minor", "signature"):
+        nb["metadata"].pop(key, None)
+    return nb
+
+
+def _dumps(value, depth: int) -> str:
+    # nbformat layout (indent=1, sorted keys) for a value nested `depth` deep
+    text = json.dumps(
+        value, indent=1, sort_keys=True, separators=(",", ": "), ensure_ascii=False
+    )
+    return text.replace("\n", "\n" + " " * depth)
+
+
+def _copy_span(src, dst, raw: RawJSON) -> None:
+    src.seek(raw.start)
+    remaining = raw.end - raw.start
+    while remaining:
+        chunk = src.read(min(COPY_CHUNK, remaining))
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def _write_cell(cell: Dict, dst, sources: Dict) -> None:
+    raws = {key: value for key, value in cell.items() if isinstance(value, RawJSON)}
+    parsed = _split_cell(
+        {key: value for key, value in cell.items() if key not in raws}
+        | ({"outputs": []} if "outputs" in raws else {})
+    )
+    # Raw members are dumped as markers and replaced by their source bytes
+    parsed.update({key: _MARKER.format(key) for key in raws})
+    text = _dumps(parsed, 2)
+    markers = sorted(raws, key=lambda key: text.index(_MARKER.format(key)))
+    for key in markers:
+        head, text = text.split(json.dumps(_MARKER.format(key)), 1)
+        dst.write(head.encode("utf-8"))
+        raw = raws[key]
+        if raw.path not in sources:
+            sources[raw.path] = open(raw.path, "rb")
+        _copy_span(sources[raw.path], dst, raw)
+    dst.write(text.encode("utf-8"))
+
+
+def write_notebook_streaming(nb: Dict, nb_path) -> int:
+    # Written to a temporary file first: the source may be the destination,
+    # and an unchanged output keeps its mtime. Returns the bytes written.
+    nb_path = Path(nb_path)
+    tmp = nb_path.with_name(f".{nb_path.name}.{os.getpid()}.tmp")
+    sources: Dict = {}
+    try:
+        with tmp.open("wb") as dst:
+            dst.write(b"{")
+            for i, key in enumerate(sorted(nb)):
+                dst.write((',\n "' if i else '\n "').encode() + key.encode() + b'": ')
+                if key != "cells":
+                    dst.write(_dumps(nb[key], 1).encode("utf-8"))
+                elif not nb["cells"]:
+                    dst.write(b"[]")
+                else:
+                    dst.write(b"[")
+                    for j, cell in enumerate(nb["cells"]):
+                        dst.write(b",\n  " if j else b"\n  ")
+                        _write_cell(cell, dst, sources)
+                    dst.write(b"\n ]")
+            dst.write(b"\n}\n")
+    finally:
+        for source in sources.values():
+            source.close()
+    if nb_path.exists() and filecmp.cmp(tmp, nb_path, shallow=False):
+        tmp.unlink()
+        return 0
+    size = tmp.stat().st_size
+    tmp.replace(nb_path)
+    return size
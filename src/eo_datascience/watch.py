@@ -0,0 +1,198 @@
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+import yaml
+from eo_datascience.clean_nb import (
+    DEFAULT_STAGES,
+    ConversionError,
+    build_pipeline,
+    convert_notebook,
+    convert_notebooks,
+    substitute_path,
+)
+from eo_datascience.render_sfinx_toc import render_toc
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # pragma: no cover
+    Observer = None
+
+Snapshot = Dict[Path, Tuple[int, int]]
+
+
+def _is_watched(path: Path, quarto: Path) -> bool:
+    return path.suffix == ".ipynb" or path == quarto
+
+
+def snapshot(roots: Iterable[Path], quarto: Path) -> Snapshot:
+    state = {}
+    for root in roots:
+        paths = [root] if root.is_file() else root.rglob("*")
+        for path in paths:
+            if _is_watched(path, quarto):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                state[path] = (stat.st_mtime_ns, stat.st_size)
+    return state
+
+
+def poll(
+    roots: Iterable[Path],
+    quarto: Path,
+    events: queue.Queue,
+    stop: threading.Event,
+    interval: float = 0.5,
+) -> None:
+    # Fallback when inotify (watchdog) is not available
+    roots = list(roots)
+    previous = snapshot(roots, quarto)
+    while not stop.wait(interval):
+        current = snapshot(roots, quarto)
+        for path in previous.keys() | current.keys():
+            if previous.get(path) != current.get(path):
+                events.put(path)
+        previous = current
+
+
+def _start_observer(
+    roots: Iterable[Path], quarto: Path, events: queue.Queue
+) -> Optional[Callable]:
+    if Observer is None:
+        return None
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            for attr in ("src_path", "dest_path"):
+                path = Path(getattr(event, attr, "") or "")
+                if path.name and _is_watched(path.resolve(), quarto):
+                    events.put(path.resolve())
+
+    observer = Observer()
+    for root in roots:
+        target = root.parent if root.is_file() else root
+        observer.schedule(Handler(), str(target), recursive=root.is_dir())
+    observer.start()
+    return observer.stop
+
+
+def debounce(
+    events: queue.Queue, stop: threading.Event, delay: float = 0.3
+) -> Optional[Set[Path]]:
+    # Wait for a first event, then until `delay` passes without new ones
+    while not stop.is_set():
+        try:
+            batch = {events.get(timeout=0.1)}
+        except queue.Empty:
+            continue
+        while True:
+            try:
+                batch.add(events.get(timeout=delay))
+            except queue.Empty:
+                return batch
+    return None
+
+
+def book_structure(quarto: Path):
+    try:
+        with quarto.open() as f:
+            book = yaml.safe_load(f).get("book", {})
+    except (OSError, yaml.YAMLError, AttributeError):
+        return None
+    return book.get("chapters"), book.get("appendices")
+
+
+def rebuild(
+    batch: Set[Path],
+    dir: Path,
+    out: Path,
+    pipeline,
+    quarto: Path,
+    toc_dir: Optional[Path],
+    structure,
+):
+    converted, removed = [], []
+    for path in sorted(batch):
+        if path.suffix != ".ipynb" or dir not in path.parents:
+            continue
+        if path.exists():
+            try:
+                convert_notebook(path, dir, out, pipeline)
+                converted.append(path)
+            except Exception as e:
+                print(f"Failed to convert {path}: {e}", file=sys.stderr)
+        else:
+            substitute_path(path, dir, out).unlink(missing_ok=True)
+            removed.append(path)
+
+    if quarto in batch and toc_dir is not None:
+        # Only regenerate the TOC when the book structure itself changed
+        new_structure = book_structure(quarto)
+        if new_structure is not None and new_structure != structure:
+            render_toc(quarto.as_posix(), toc_dir)
+            print(f"Regenerated {Path(toc_dir) / '_toc.yml'}", file=sys.stderr)
+            structure = new_structure
+    for path in converted:
+        print(f"Converted {path}", file=sys.stderr)
+    for path in removed:
+        print(f"Removed {substitute_path(path, dir, out)}", file=sys.stderr)
+    return structure
+
+
+def watch(
+    dir,
+    out,
+    stages=DEFAULT_STAGES,
+    options=None,
+    quarto="_quarto.yml",
+    toc_dir=None,
+    delay=0.3,
+    poll_interval=0.5,
+    use_inotify=True,
+    stop=None,
+    jobs=1,
+):
+    dir, out, quarto = Path(dir).resolve(), Path(out).resolve(), Path(quarto).resolve()
+    stop = stop or threading.Event()
+    options = {name: dict(kwargs) for name, kwargs in (options or {}).items()}
+    options.setdefault("offload", {}).setdefault("root", out)
+
+    try:
+        convert_notebooks(dir, out, stages, jobs=jobs, cache=True, options=options)
+    except ConversionError as e:
+        print(e, file=sys.stderr)
+    pipeline = build_pipeline(stages, options)
+    structure = book_structure(quarto)
+
+    roots = [dir] + ([quarto] if quarto.exists() else [])
+    events: queue.Queue = queue.Queue()
+    stop_observer = _start_observer(roots, quarto, events) if use_inotify else None
+    if stop_observer is None:
+        poller = threading.Thread(
+            target=poll, args=(roots, quarto, events, stop, poll_interval), daemon=True
+        )
+        poller.start()
+    print(f"Watching {dir} for changes", file=sys.stderr)
+
+    try:
+        while not stop.is_set():
+            batch = debounce(events, stop, delay)
+            if batch:
+                start = time.perf_counter()
+                structure = rebuild(
+                    batch, dir, out, pipeline, quarto, toc_dir, structure
+                )
+                elapsed = (time.perf_counter() - start) * 1e3
+                print(f"Rebuilt in {elapsed:.0f} ms", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        if stop_observer is not None:
+            stop_observer()
@@ -0,0 +1,123 @@
+import os
+
+import nbformat
+import pytest
+from eo_datascience.assets import ASSET_MANIFEST, publish_assets, referenced_assets
+from eo_datascience.manifest import load_manifest
+
+
+def _write_notebook(path, *sources):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_markdown_cell(source) for source in sources]
+    nbformat.write(nb, path)
+
+
+def _write_book(root):
+    (root / "chapters" / "images").mkdir(parents=True)
+    (root / "chapters" / "images" / "used.png").write_bytes(b"png" * 100)
+    (root / "chapters" / "images" / "unused.png").write_bytes(b"unused")
+    _write_notebook(
+        root / "notebooks" / "courses" / "a.ipynb",
+        "![Image from [Survey](https://example.org)](../images/used.png){#fig-a}",
+        '<img src="https://example.org/remote.png">',
+    )
+
+
+def test_referenced_assets():
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_markdown_cell(
+            '![a](../../images/x.gif "Title") ![b](<./local.png>) '
+            "![c](https://host/y.png) ![d](data:image/png;base64,AAA)"
+        ),
+        nbformat.v4.new_markdown_cell('<img width="50" src="../../images/z.svg">'),
+        nbformat.v4.new_code_cell("![not](markdown.png)"),
+    ]
+    assert referenced_assets(nb, "courses/part/nb.ipynb") == {
+        "images/x.gif",
+        "courses/part/local.png",
+        "images/z.svg",
+    }
+
+
+def test_publish_assets_links_only_referenced_files(tmp_path):
+    _write_book(tmp_path)
+    out = tmp_path / "notebooks"
+    manifest = publish_assets(tmp_path / "chapters", out)
+
+    assert list(manifest["assets"]) == ["images/used.png"]
+    assert manifest["missing"] == []
+    assert not (out / "images" / "unused.png").exists()
+    assert os.path.samefile(
+        out / "images" / "used.png", tmp_path / "chapters" / "images" / "used.png"
+    )
+    assert (
+        load_manifest(out / ASSET_MANIFEST)["assets"]["images/used.png"]["size"] == 300
+    )
+
+    # Unchanged assets are left alone
+    inode = (out / "images" / "used.png").stat().st_ino
+    publish_assets(tmp_path / "chapters", out)
+    assert (out / "images" / "used.png").stat().st_ino == inode
+
+    # Unreferenced ones are pruned, missing ones reported
+    _write_notebook(out / "courses" / "a.ipynb", "![](../images/missing.png)")
+    manifest = publish_assets(tmp_path / "chapters", out)
+    assert manifest["assets"] == {}
+    assert manifest["missing"] == ["images/missing.png"]
+    assert not (out / "images" / "used.png").exists()
+    assert (tmp_path / "chapters" / "images" / "used.png").exists()
+    assert (out / ASSET_MANIFEST).exists()
+
+
+def test_publish_assets_includes_config_images(tmp_path):
+    _write_book(tmp_path)
+    (tmp_path / "chapters" / "images" / "logos").mkdir()
+    (tmp_path / "chapters" / "images" / "logos" / "logo.svg").write_text("<svg/>")
+    out = tmp_path / "notebooks"
+    manifest = publish_assets(tmp_path / "chapters", out, include=["images/logos"])
+    assert sorted(manifest["assets"]) == ["images/logos/logo.svg", "images/used.png"]
+    assert (out / "images" / "logos" / "logo.svg").read_text() == "<svg/>"
+
+    # Dropping the option prunes them like unreferenced images
+    publish_assets(tmp_path / "chapters", out)
+    assert not (out / "images" / "logos" / "logo.svg").exists()
+
+
+def test_publish_assets_web_variants(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    pytest.importorskip("PIL.WebPImagePlugin")
+    (tmp_path / "chapters" / "images").mkdir(parents=True)
+    frames = [
+        Image.effect_noise((200, 200), 64 + 16 * i).convert("P") for i in range(4)
+    ]
+    gif = tmp_path / "chapters" / "images" / "anim.gif"
+    frames[0].save(gif, save_all=True, append_images=frames[1:], duration=100)
+    out = tmp_path / "notebooks"
+    # Only the link is rewritten, not other mentions of the path
+    _write_notebook(out / "a.ipynb", "![](images/anim.gif) from `images/anim.gif`")
+
+    manifest = publish_assets(tmp_path / "chapters", out, web_max_bytes=1000)
+    variant = manifest["variants"]["images/anim.gif"]
+    assert (out / variant).stat().st_size < gif.stat().st_size
+    assert (
+        nbformat.read(out / "a.ipynb", 4).cells[0].source
+        == f"![]({variant}) from `images/anim.gif`"
+    )
+
+    # The rewritten notebook still counts as referencing the original
+    mtime = (out / variant).stat().st_mtime_ns
+    nb_mtime = (out / "a.ipynb").stat().st_mtime_ns
+    manifest = publish_assets(tmp_path / "chapters", out, web_max_bytes=1000)
+    assert manifest["variants"] == {"images/anim.gif": variant}
+    assert (out / variant).stat().st_mtime_ns == mtime
+    assert (out / "a.ipynb").stat().st_mtime_ns == nb_mtime
+
+    # Without web variants the notebook links the original again
+    publish_assets(tmp_path / "chapters", out)
+    assert not (out / variant).exists()
+    assert (
+        nbformat.read(out / "a.ipynb", 4).cells[0].source
+        == "![](images/anim.gif) from `images/anim.gif`"
+    )
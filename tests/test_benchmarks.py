@@ -0,0 +1,37 @@
+import json
+import sys
+from unittest.mock import patch
+
+import nbformat
+import yaml
+
+from benchmarks.__main__ import main
+from benchmarks.synthetic import generate_book
+
+
+def test_generate_book(tmp_path):
+    book = generate_book(tmp_path / "book", notebooks=6, cells=4, parts=1)
+    notebooks = sorted((book / "notebooks").rglob("*.ipynb"))
+    assert len(notebooks) >= 6
+    for nb_path in notebooks:
+        nbformat.validate(nbformat.read(nb_path, as_version=4))
+    quarto = yaml.safe_load((book / "_quarto.yml").read_text())
+    assert quarto["book"]["chapters"][0] == "index.qmd"
+    assert quarto["book"]["appendices"][-1] == "chapters/references.qmd"
+    for path in (book / "chapters").rglob("*.qmd"):
+        assert path.read_text()
+
+
+def test_run_once(tmp_path):
+    out = tmp_path / "results.json"
+    argv = ["benchmarks", "run", "--notebooks", "4", "--cells", "4", "--repeat", "1"]
+    with patch.object(sys, "argv", argv + ["--jobs", "2", "--out", str(out)]):
+        main()
+    results = {r["name"]: r for r in json.loads(out.read_text())["results"]}
+    assert not [r for r in results.values() if "error" in r]
+    assert {"clean_nb.pipeline", "clean_nb.cli", "merge_envs.cli"} <= set(results)
+    assert all(len(r["timings"]) == 1 for r in results.values())
+    # The CLI converts in worker processes, measured by their peak RSS
+    assert results["clean_nb.cli"]["memory"] == "rss"
+    assert results["clean_nb.cli"]["peak_memory_bytes"] > 2**20
+    assert results["clean_nb.pipeline"]["memory"] == "tracemalloc"
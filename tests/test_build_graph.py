@@ -0,0 +1,94 @@
+from eo_datascience.build_graph import build_graph, plan
+
+QUARTO = """
+book:
+  chapters:
+    - index.qmd
+    - part: chapters/courses/course.qmd
+      chapters:
+        - chapters/courses/course/01.qmd
+  appendices:
+    - part: chapters/tutorials/prereqs.qmd
+      chapters:
+        - chapters/tutorials/flood.qmd
+    - chapters/references.qmd
+"""
+
+
+def _write_book(root):
+    files = {
+        "_quarto.yml": QUARTO,
+        "chapters/courses/course.qmd": "",
+        "chapters/courses/course/01.qmd": "",
+        "chapters/tutorials/prereqs.qmd": "",
+        "chapters/tutorials/flood.qmd": "",
+        "chapters/references.qmd": "",
+        "chapters/references.bib": "",
+        "notebooks/courses/course.yml": "dependencies:\n  - python=3.11\n",
+        "notebooks/tutorials/flood.yml": "dependencies:\n  - python=3.12\n",
+        "notebooks/tutorials/flood.ipynb": "{}",
+    }
+    for path, text in files.items():
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(text)
+
+
+def test_build_graph(tmp_path):
+    _write_book(tmp_path)
+    graph = build_graph(tmp_path)
+    assert graph.sources["chapters/courses/course/01.qmd"] == (
+        "notebooks/courses/course/01.ipynb"
+    )
+    assert graph.environments == {
+        "notebooks/courses/course.ipynb": "notebooks/courses/course.yml",
+        "notebooks/courses/course/01.ipynb": "notebooks/courses/course.yml",
+        "notebooks/tutorials/flood.ipynb": "notebooks/tutorials/flood.yml",
+    }
+    assert graph.toc == [
+        "index.qmd",
+        "chapters/courses/course.qmd",
+        "chapters/courses/course/01.qmd",
+        "chapters/tutorials/prereqs.qmd",
+        "chapters/tutorials/flood.qmd",
+        "chapters/references.qmd",
+    ]
+
+
+def test_plan_is_minimal(tmp_path):
+    _write_book(tmp_path)
+    graph = build_graph(tmp_path)
+
+    assert not plan(graph, ["README.md"])
+    build_plan = plan(graph, ["chapters/tutorials/flood.qmd"])
+    assert build_plan.notebooks == ["notebooks/tutorials/flood.ipynb"]
+    assert not (build_plan.environments or build_plan.removed or build_plan.toc)
+
+    build_plan = plan(
+        graph, ["notebooks/courses/course.yml", "chapters/references.bib"]
+    )
+    assert build_plan.notebooks == ["notebooks/references.ipynb"]
+    assert build_plan.environments == [
+        "environment.yml",
+        "notebooks/courses/course.yml",
+    ]
+    # Only converted notebooks can be executed, course's are not yet
+    assert not build_plan.execute
+    build_plan = plan(graph, ["notebooks/tutorials/flood.yml"])
+    assert build_plan.execute == ["notebooks/tutorials/flood.ipynb"]
+    assert not build_plan.notebooks
+
+    (tmp_path / "chapters/courses/course/01.qmd").unlink()
+    build_plan = plan(graph, ["chapters/courses/course/01.qmd"])
+    assert build_plan.removed == ["notebooks/courses/course/01.ipynb"]
+    assert build_plan.toc
+
+    (tmp_path / "notebooks/tutorials/flood.yml").unlink()
+    build_plan = plan(graph, ["notebooks/tutorials/flood.yml"])
+    assert build_plan.execute == ["notebooks/tutorials/flood.ipynb"]
+
+    # Only a changed `book` section regenerates the TOC
+    assert plan(graph, ["_quarto.yml"]).toc
+    book = dict(graph.book)
+    assert not plan(graph, ["_quarto.yml"], previous_book=book).toc
+    book["appendices"] = book["appendices"][:-1]
+    assert plan(graph, ["_quarto.yml"], previous_book=book).toc
@@ -0,0 +1,120 @@
+import os
+import re
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from eo_datascience import cache as block_cache
+from eo_datascience.cache import BlockCache, CacheMiss, CacheServer
+
+PAYLOAD = os.urandom(10_000)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # Stand-in for a COG host: serves PAYLOAD at /data.tif with byte ranges
+    ranges = []
+
+    def do_GET(self):
+        if self.path != "/data.tif":
+            self.send_error(404)
+            return
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        start, end = (int(match.group(1)), int(match.group(2)) + 1) if match else (0, 0)
+        end = min(end, len(PAYLOAD))
+        self.ranges.append((start, end))
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(PAYLOAD)}")
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(PAYLOAD[start:end])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    RangeHandler.ranges = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/data.tif", httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_partial_reads_are_cached_per_block(tmp_path, server):
+    url, _ = server
+    cache = BlockCache(tmp_path, block_size=1000)
+    assert cache.read(url, 2500, 4200) == PAYLOAD[2500:4200]
+    # Probe (first block), then blocks 2-4 in one range request
+    assert RangeHandler.ranges == [(0, 1000), (2000, 5000)]
+    assert cache.read(url, 2900, 3100) == PAYLOAD[2900:3100]
+    assert cache.read(url, 0, 100) == PAYLOAD[:100]
+    assert len(RangeHandler.ranges) == 2
+    assert cache.read(url) == PAYLOAD
+    assert RangeHandler.ranges[2:] == [(1000, 2000), (5000, 10000)]
+    assert cache.size(url) == len(PAYLOAD)
+
+
+def test_least_recently_used_blocks_are_evicted(tmp_path, server):
+    url, _ = server
+    cache = BlockCache(tmp_path, max_bytes=3000, block_size=1000)
+    cache.read(url, 0, 10)
+    cache.read(url, 5000, 5010)
+    cache.read(url, 0, 10)
+    cache.read(url, 8000, 9010)
+    assert cache.total_bytes() <= 3000
+    # Block 0 was used again after block 5, so block 5 went first
+    cache.read(url, 0, 10)
+    cache.read(url, 5000, 5010)
+    assert RangeHandler.ranges.count((5000, 6000)) == 2
+    assert RangeHandler.ranges.count((0, 1000)) == 1
+
+
+def test_offline_mode_reads_only_from_disk(tmp_path, server):
+    url, httpd = server
+    BlockCache(tmp_path, block_size=1000).read(url, 0, 1500)
+    httpd.shutdown()
+    offline = BlockCache(tmp_path, block_size=1000, offline=True)
+    assert offline.read(url, 100, 1500) == PAYLOAD[100:1500]
+    with pytest.raises(CacheMiss):
+        offline.read(url, 5000, 5100)
+    with pytest.raises(CacheMiss):
+        offline.read(url.replace("data", "other"))
+
+
+def test_cache_server_serves_ranges(tmp_path, server):
+    url, _ = server
+    cache_server = CacheServer(BlockCache(tmp_path, block_size=1000))
+    try:
+        local = cache_server.patch_url(url)
+        assert local.startswith("http://127.0.0.1")
+        request = urllib.request.Request(local, headers={"Range": "bytes=10-19"})
+        with urllib.request.urlopen(request) as response:
+            assert response.status == 206
+            assert response.read() == PAYLOAD[10:20]
+        with urllib.request.urlopen(local) as response:
+            assert response.read() == PAYLOAD
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(cache_server.patch_url(url + ".ovr"))
+        assert e.value.code == 404
+    finally:
+        cache_server.close()
+
+
+def test_enable_routes_fsspec_reads(tmp_path, server):
+    fsspec = pytest.importorskip("fsspec")
+    url, _ = server
+    try:
+        block_cache.enable(tmp_path, offline=False, block_size=1000)
+        with fsspec.open(url, "rb") as f:
+            f.seek(9000)
+            assert f.read(500) == PAYLOAD[9000:9500]
+        assert block_cache._ACTIVE.total_bytes() > 0
+        assert block_cache.patch_url("file.tif") == "file.tif"
+        assert block_cache.patch_url(url) != url
+    finally:
+        block_cache.disable()
+    assert block_cache.patch_url(url) == url
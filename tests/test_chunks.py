@@ -0,0 +1,51 @@
+import pytest
+from eo_datascience.chunks import plan_chunks, plan_stac_chunks
+
+
+def _item(datetime, shape=(10980, 10980), dtype="uint16"):
+    return {
+        "properties": {"datetime": datetime, "proj:shape": list(shape)},
+        "assets": {
+            band: {"href": f"{band}.tif", "raster:bands": [{"data_type": dtype}]}
+            for band in ("VV", "VH")
+        },
+    }
+
+
+def test_chunks_fit_the_memory_per_core():
+    plan = plan_chunks(
+        {"time": 40, "y": 10980, "x": 10980}, "float32", memory=8 * 2**30, cores=8
+    )
+    assert plan.chunks["time"] == 1
+    assert plan.chunks["y"] % 512 == 0 and plan.chunks["x"] % 512 == 0
+    assert plan.peak_bytes <= 8 * 2**30
+    assert plan.tasks == plan.n_chunks >= 8
+
+    # More memory per core makes larger chunks, along time once space is full
+    large = plan_chunks(
+        {"time": 40, "y": 2000, "x": 2000}, "uint8", memory=64 * 2**30, cores=2
+    )
+    assert large.chunks == {"time": 20, "y": 2000, "x": 2000}
+    assert "number of chunks: 2" in large.summary()
+
+
+def test_chunks_are_split_until_every_core_has_work():
+    plan = plan_chunks(
+        {"time": 3, "y": 1000, "x": 1000}, "uint8", memory=2**34, cores=8
+    )
+    assert plan.chunks == {"time": 1, "y": 512, "x": 512}
+    assert plan.n_chunks == 12
+    # Never below one native tile
+    small = plan_chunks({"y": 300, "x": 300}, "float64", memory=2**34, cores=64)
+    assert small.chunks == {"y": 300, "x": 300}
+
+
+def test_plan_stac_chunks_reads_shape_and_dtype():
+    items = [_item("2023-01-01"), _item("2023-01-01"), _item("2023-01-13")]
+    plan = plan_stac_chunks(items, ["VV", "VH"], memory=4 * 2**30, cores=4, tile=1024)
+    assert plan.shape == {"time": 2, "y": 10980, "x": 10980}
+    assert plan.itemsize == 2 and plan.bands == 2
+    assert plan.chunks["x"] % 1024 == 0
+    assert plan.tasks == 2 * plan.n_chunks
+    with pytest.raises(ValueError):
+        plan_stac_chunks([{"properties": {}, "assets": {"VV": {}}}], ["VV"])
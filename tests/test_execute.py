@@ -0,0 +1,142 @@
+import json
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import nbformat
+import pytest  # noqa
+from eo_datascience.execute import (
+    STATUS_FILE,
+    ExecutionResult,
+    execute_notebook,
+    execute_notebooks,
+    kernel_map,
+    main,
+    schedule,
+)
+from eo_datascience.provision import register_kernels
+
+
+def _write_book(root, sources):
+    for rel_path, source in sources.items():
+        nb = nbformat.v4.new_notebook()
+        nb.cells = [nbformat.v4.new_code_cell(source)]
+        (root / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        nbformat.write(nb, root / rel_path)
+
+
+def _fake_runner(nb_path, out_path, kernel, rel_path, **limits):
+    # Stands in for a kernel: the source of the only cell is the run time
+    seconds = float(nbformat.read(nb_path, as_version=4).cells[0].source)
+    time.sleep(seconds)
+    if seconds > 0.5:
+        raise RuntimeError("boom")
+    return ExecutionResult(rel_path, kernel, "ok", seconds)
+
+
+def test_kernel_map_uses_sibling_environments(tmp_path):
+    _write_book(
+        tmp_path,
+        {
+            "courses/course.ipynb": "0",
+            "courses/course/01.ipynb": "0",
+            "tutorials/flood.ipynb": "0",
+            "references.ipynb": "0",
+        },
+    )
+    (tmp_path / "courses" / "course.yml").write_text("dependencies:\n  - numpy\n")
+    (tmp_path / "tutorials" / "flood.yml").write_text("dependencies:\n  - numpy\n")
+    (tmp_path / "tutorials" / "_toc.yml").write_text("root: intro\n")
+    assert kernel_map(tmp_path, {"tutorials/flood.ipynb": "shared"}) == {
+        "courses/course.ipynb": "course",
+        "courses/course/01.ipynb": "course",
+        "tutorials/flood.ipynb": "shared",
+    }
+
+
+def test_schedule_runs_longest_first():
+    previous = {"a.ipynb": {"seconds": 1.0}, "b.ipynb": {"seconds": 9.0}}
+    assert schedule(["a.ipynb", "b.ipynb", "new.ipynb"], previous) == [
+        "new.ipynb",
+        "b.ipynb",
+        "a.ipynb",
+    ]
+
+
+def test_execute_notebooks_runs_concurrently(tmp_path):
+    _write_book(
+        tmp_path / "in",
+        {f"nb{i}.ipynb": "0.3" for i in range(4)} | {"bad.ipynb": "0.6"},
+    )
+    start = time.perf_counter()
+    results = execute_notebooks(
+        tmp_path / "in", tmp_path / "out", jobs=5, runner=_fake_runner
+    )
+    # Roughly the slowest notebook, not the 1.8 s sum
+    assert time.perf_counter() - start < 1.5
+    assert results["nb0.ipynb"].status == "ok"
+    assert results["bad.ipynb"].status == "failed"
+    assert "boom" in results["bad.ipynb"].error
+    status = json.loads((tmp_path / "out" / STATUS_FILE).read_text())
+    assert sorted(status) == sorted(results)
+
+
+def _kernel_pids():
+    pids = set()
+    for cmdline in Path("/proc").glob("[0-9]*/cmdline"):
+        try:
+            if b"ipykernel_launcher" in cmdline.read_bytes():
+                pids.add(cmdline.parent.name)
+        except OSError:
+            pass
+    return pids
+
+
+def test_execute_notebook_with_kernel(tmp_path):
+    pytest.importorskip("nbclient")
+    pytest.importorskip("ipykernel")
+    _write_book(
+        tmp_path / "in",
+        {
+            "ok.ipynb": "print(6 * 7)",
+            "error.ipynb": "1 / 0",
+            "slow.ipynb": "import time\ntime.sleep(30)",
+        },
+    )
+    results = execute_notebooks(tmp_path / "in", tmp_path / "out", jobs=3, timeout=5)
+    assert {path: r.status for path, r in results.items()} == {
+        "error.ipynb": "error",
+        "ok.ipynb": "ok",
+        "slow.ipynb": "timeout",
+    }
+    assert results["slow.ipynb"].seconds < 15
+
+    # The timed out kernel is shut down before the (reused) worker moves on
+    before = _kernel_pids()
+    result = execute_notebook(
+        tmp_path / "in" / "slow.ipynb", tmp_path / "slow.ipynb", "python3", timeout=1
+    )
+    assert result.status == "timeout"
+    assert not _kernel_pids() - before
+    nb = nbformat.read(tmp_path / "out" / "ok.ipynb", as_version=4)
+    assert nb.cells[0].outputs[0].text == "42\n"
+
+
+def test_cli_takes_kernels_from_the_source_tree(tmp_path, monkeypatch):
+    pytest.importorskip("nbclient")
+    pytest.importorskip("ipykernel")
+    # A kernel named after the environment, as `make kernel` registers it
+    register_kernels({"course": Path(sys.prefix)}, tmp_path / "jupyter")
+    monkeypatch.setenv("JUPYTER_PATH", str(tmp_path / "jupyter"))
+    _write_book(tmp_path / "notebooks", {"courses/course/01.ipynb": "print(1)"})
+    (tmp_path / "notebooks/courses/course.yml").write_text("dependencies:\n  - pip\n")
+    # The converted tree has the notebooks but not the environment files
+    _write_book(tmp_path / "preview", {"courses/course/01.ipynb": "print(1)"})
+
+    argv = ["execute_nb", str(tmp_path / "preview"), "--jobs", "1"]
+    with patch.object(sys, "argv", argv + ["--envs", str(tmp_path / "notebooks")]):
+        main()
+    status = json.loads((tmp_path / "preview" / STATUS_FILE).read_text())
+    assert status["courses/course/01.ipynb"]["kernel"] == "course"
+    assert status["courses/course/01.ipynb"]["status"] == "ok"
@@ -0,0 +1,83 @@
+import nbformat
+import pytest  # noqa
+from eo_datascience.clean_nb import DEFAULT_STAGES, convert_notebooks
+from eo_datascience.frozen import carry_outputs, seed_jupyter_cache
+
+
+def _notebook(executed):
+    nb = nbformat.v4.new_notebook(
+        metadata={"kernelspec": {"name": "eo-datascience", "display_name": "eo"}}
+    )
+    nb.cells = [
+        nbformat.v4.new_markdown_cell("---\ntitle: Frozen\n---\nText"),
+        nbformat.v4.new_code_cell("x = 1"),
+        nbformat.v4.new_code_cell("print(x)"),
+        nbformat.v4.new_code_cell("print(x)"),
+    ]
+    if executed:
+        for count, cell in enumerate(nb.cells[1:], start=1):
+            cell.execution_count = count
+            cell.outputs = [nbformat.v4.new_output("stream", text=f"{count}\n")]
+    return nb
+
+
+def _write_book(root):
+    (root / "chapters" / "sub").mkdir(parents=True)
+    (root / "notebooks" / "sub").mkdir(parents=True)
+    nbformat.write(_notebook(True), root / "chapters" / "sub" / "a.quarto_ipynb")
+    nbformat.write(_notebook(False), root / "notebooks" / "sub" / "a.ipynb")
+
+
+def test_carry_outputs_matches_code_cells_by_source():
+    nb, executed = _notebook(False), _notebook(True)
+    # Converted front matter and extra markdown do not shift the outputs
+    nb.cells.insert(2, nbformat.v4.new_markdown_cell("inserted"))
+    executed.cells[2].source = "changed()"
+    assert carry_outputs(nb, executed) == 2
+    assert [cell.get("execution_count") for cell in nb.cells] == [
+        None,
+        1,
+        None,
+        3,
+        None,
+    ]
+
+
+def test_frozen_stage_carries_quarto_outputs(tmp_path):
+    _write_book(tmp_path)
+    convert_notebooks(
+        tmp_path / "notebooks",
+        tmp_path / "out",
+        DEFAULT_STAGES + ["frozen"],
+        cache=True,
+        options=dict(frozen=dict(executed=tmp_path / "chapters")),
+    )
+    nb = nbformat.read(tmp_path / "out" / "sub" / "a.ipynb", as_version=4)
+    assert nb.cells[0].source.startswith("# Frozen")
+    assert [cell.outputs[0].text for cell in nb.cells[1:]] == ["1\n", "2\n", "3\n"]
+    # Outputs depend on files outside the notebook, so nothing is cached
+    assert not (tmp_path / "out" / ".clean_nb_cache.json").exists()
+
+
+def test_seed_jupyter_cache(tmp_path):
+    jupyter_cache = pytest.importorskip("jupyter_cache")
+    _write_book(tmp_path)
+    convert_notebooks(
+        tmp_path / "notebooks",
+        tmp_path / "out",
+        DEFAULT_STAGES + ["frozen"],
+        options=dict(frozen=dict(executed=tmp_path / "chapters")),
+    )
+    assert seed_jupyter_cache(tmp_path / "out", tmp_path / "cache") == 1
+    cache = jupyter_cache.get_cache(str(tmp_path / "cache"))
+    nb = nbformat.read(tmp_path / "out" / "sub" / "a.ipynb", as_version=4)
+    # A notebook with the same code (and no outputs) is a cache hit
+    for cell in nb.cells[1:]:
+        cell.outputs, cell.execution_count = [], None
+    assert cache.match_cache_notebook(nb).pk == 1
+
+    # Cells run out of order are not a valid cache entry; skipped, not an error
+    for count, cell in zip([2, 5, 6], nb.cells[1:]):
+        cell.execution_count = count
+    nbformat.write(nb, tmp_path / "out" / "sub" / "a.ipynb")
+    assert seed_jupyter_cache(tmp_path / "out", tmp_path / "cache") == 0
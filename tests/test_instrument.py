@@ -0,0 +1,80 @@
+import nbformat
+import pytest
+from eo_datascience.execute import execute_notebooks
+from eo_datascience.instrument import (
+    METADATA_KEY,
+    cell_key,
+    collect_profiles,
+    format_report,
+    regressions,
+)
+
+
+def _write_profiled(path, profiles):
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_markdown_cell("# Title")]
+    for source, profile in profiles:
+        cell = nbformat.v4.new_code_cell(source)
+        cell.metadata[METADATA_KEY] = profile
+        nb.cells.append(cell)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    nbformat.write(nb, path)
+
+
+def test_collect_profiles_and_regressions(tmp_path):
+    _write_profiled(
+        tmp_path / "courses" / "a.ipynb",
+        [
+            ("ds = odc_stac.load(items)", dict(wall_seconds=30.0, peak_rss_delta=0)),
+            ("ds.compute()", dict(wall_seconds=2.0, peak_rss_delta=2**30)),
+        ],
+    )
+    _write_profiled(
+        tmp_path / "b.ipynb", [("x = 1", dict(wall_seconds=0.1, cpu_seconds=0.1))]
+    )
+    profiles = collect_profiles(tmp_path)
+    assert [(p.notebook, p.index) for p in profiles] == [
+        ("b.ipynb", 1),
+        ("courses/a.ipynb", 1),
+        ("courses/a.ipynb", 2),
+    ]
+    report = format_report(profiles, top=1)
+    assert "30.0 s" in report and "odc_stac.load" in report
+    assert "1024.0 MiB" in report and "ds.compute()" in report
+
+    baseline = {
+        cell_key("courses/a.ipynb", "ds = odc_stac.load(items)"): dict(
+            wall_seconds=10.0, peak_rss_delta=0
+        ),
+        # Below the noise floor, even though it doubled
+        cell_key("b.ipynb", "x = 1"): dict(wall_seconds=0.05),
+        cell_key("courses/a.ipynb", "ds.compute()"): dict(
+            wall_seconds=2.0, peak_rss_delta=2**29
+        ),
+    }
+    found = regressions(profiles, baseline)
+    assert [(p.index, metric) for p, metric, *_ in found] == [
+        (1, "wall_seconds"),
+        (2, "peak_rss_delta"),
+    ]
+    assert "Regressions" in format_report(profiles, found=found)
+
+
+def test_execute_notebooks_instruments_cells(tmp_path):
+    pytest.importorskip("nbclient")
+    pytest.importorskip("ipykernel")
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_code_cell("x = bytearray(200 * 2**20)"),
+        nbformat.v4.new_code_cell("import time\ntime.sleep(0.3)"),
+    ]
+    (tmp_path / "in").mkdir()
+    nbformat.write(nb, tmp_path / "in" / "nb.ipynb")
+    results = execute_notebooks(tmp_path / "in", tmp_path / "out", instrument=True)
+    assert results["nb.ipynb"].status == "ok"
+
+    memory, sleep = collect_profiles(tmp_path / "out")
+    assert sleep.wall_seconds >= 0.3
+    if memory.peak_rss_delta is not None:
+        assert memory.peak_rss_delta > 150 * 2**20
+        assert sleep.cpu_seconds < 0.3
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from unittest.mock import patch
 
@@ -60,3 +61,221 @@ def test_aggregate_env_dependencies_returns_correct(mock_get_env):
         "seaborn",
     ]
     assert result == expected
+
+
+@pytest.mark.parametrize(
+    "spec, name, version, build, channel",
+    [
+        ("numpy", "numpy", None, None, None),
+        ("numpy=1.26", "numpy", "=1.26", None, None),
+        ("numpy>=1.20,<2", "numpy", ">=1.20,<2", None, None),
+        ("conda-forge::gdal 3.8.* h1234", "gdal", "3.8.*", "h1234", "conda-forge"),
+        ("numpy[version='>=1.2']", "numpy", ">=1.2", None, None),
+        ("pkg=1.0=py_0", "pkg", "=1.0", "py_0", None),
+    ],
+)
+def test_parse_spec_returns_correct(spec, name, version, build, channel):
+    parsed = merge_envs.parse_spec(spec)
+    assert (parsed.name, parsed.version, parsed.build, parsed.channel) == (
+        name,
+        version,
+        build,
+        channel,
+    )
+
+
+def test_resolve_specs_intersects_constraints():
+    specs = [
+        merge_envs.parse_spec(spec)
+        for spec in ["numpy>=1.20", "numpy<2", "numpy=1.26", "xarray>=2023", "zarr"]
+        + ["xarray<2025", "zarr=2.18.4"]
+    ]
+    resolved, conflicts = merge_envs.resolve_specs(specs)
+    assert resolved == ["numpy=1.26", "xarray>=2023,<2025", "zarr=2.18.4"]
+    assert conflicts == []
+
+
+def test_resolve_specs_reports_conflicts_with_sources():
+    specs = [
+        merge_envs.parse_spec("python=3.11", "a.yml"),
+        merge_envs.parse_spec("python=3.12", "b.yml"),
+    ]
+    resolved, conflicts = merge_envs.resolve_specs(specs)
+    # The newest pin is kept so the environment can still be written
+    assert resolved == ["python=3.12"]
+    assert len(conflicts) == 1
+    assert "a.yml" in str(conflicts[0]) and "b.yml" in str(conflicts[0])
+
+
+def test_fuzzy_version_alternatives():
+    spec = merge_envs.parse_spec("python=3.11|3.12")
+    other = merge_envs.parse_spec("python>=3.12.1")
+    resolved, conflicts = merge_envs.resolve_specs([spec, other])
+    assert resolved == ["python>=3.12.1,<3.13"]
+    assert conflicts == []
+
+
+def test_pip_requirements_are_merged():
+    environment = [
+        "numpy",
+        {"pip": ["foo>=1"]},
+        {"pip": ["Foo<3", "git+https://example.com/bar.git"]},
+    ]
+    conda, pip = merge_envs.parse_environment_dependencies(environment)
+    assert [spec.name for spec in conda] == ["numpy"]
+    assert merge_envs.resolve_pip_requirements(pip) == [
+        "foo<3,>=1",
+        "git+https://example.com/bar.git",
+    ]
+    master = merge_envs.create_master_environment(
+        ["pip", {"pip": ["foo"]}, "numpy"], name="eo"
+    )
+    assert master["dependencies"] == ["numpy", "pip", {"pip": ["foo"]}]
+
+
+def test_collect_yaml_files_skips_non_environment_yaml(tmp_path):
+    root = tmp_path / "notebooks"
+    root.mkdir()
+    (root / "env.yml").write_text("name: a\ndependencies:\n  - numpy\n")
+    (root / "_toc.yml").write_text("format: jb-book\nroot: intro\n")
+    files = merge_envs.collect_yaml_files(root)
+    assert files == [root / "env.yml", tmp_path / "environment.yml"]
+
+
+def test_load_dependencies_reuses_cache(tmp_path):
+    env = tmp_path / "env.yml"
+    env.write_text("dependencies:\n  - numpy\n")
+    cache = {}
+    assert merge_envs.load_dependencies(env, cache) == ["numpy"]
+
+    with patch("eo_datascience.merge_envs.get_environment_from_yml") as mock_get_env:
+        # Unchanged stat, and touched but identical content, are both cache hits
+        assert merge_envs.load_dependencies(env, cache) == ["numpy"]
+        os.utime(env, ns=(0, 0))
+        assert merge_envs.load_dependencies(env, cache) == ["numpy"]
+        mock_get_env.assert_not_called()
+
+    env.write_text("dependencies:\n  - xarray\n")
+    assert merge_envs.load_dependencies(env, cache) == ["xarray"]
+
+
+def test_aggregate_env_specs_loads_concurrently(tmp_path):
+    files = []
+    for i in range(8):
+        files.append(tmp_path / f"env{i}.yml")
+        files[-1].write_text(f"dependencies:\n  - pkg{i}\n  - numpy>={i}\n")
+    conda, _ = merge_envs.aggregate_env_specs(files, cache={}, jobs=4)
+    assert [spec.spec for spec in conda[:4]] == ["pkg0", "numpy>=0", "pkg1", "numpy>=1"]
+    assert conda[-1].source == str(files[-1])
+
+
+def _run_main(monkeypatch, *args):
+    monkeypatch.setattr("sys.argv", ["merge_envs", "--no-cache", *args])
+    try:
+        merge_envs.main()
+    except SystemExit as e:
+        return e.code
+    return 0
+
+
+def test_main_writes_only_on_change_and_checks_prefix(tmp_path, monkeypatch):
+    (tmp_path / "notebooks").mkdir()
+    env = tmp_path / "notebooks" / "env.yml"
+    env.write_text("dependencies:\n  - numpy\n")
+    (tmp_path / "environment.yml").write_text("dependencies:\n  - python=3.12\n")
+    monkeypatch.chdir(tmp_path)
+    out, prefix = tmp_path / "out.yml", tmp_path / "prefix"
+
+    assert _run_main(monkeypatch, "--out", str(out)) == 0
+    assert "  - numpy\n" in out.read_text()
+    assert merge_envs.lockfile_path(out).exists()
+    mtime = out.stat().st_mtime_ns
+    assert _run_main(monkeypatch, "--out", str(out), "--check") == 0
+    assert _run_main(monkeypatch, "--out", str(out)) == 0
+    assert out.stat().st_mtime_ns == mtime
+
+    # A prefix without (or with a stale) fingerprint needs a rebuild
+    check = ["--out", str(out), "--prefix", str(prefix), "--check"]
+    assert _run_main(monkeypatch, *check) == 1
+    assert (
+        _run_main(monkeypatch, "--out", str(out), "--prefix", str(prefix), "--record")
+        == 0
+    )
+    assert _run_main(monkeypatch, *check) == 0
+    env.write_text("dependencies:\n  - numpy>=2\n")
+    assert _run_main(monkeypatch, *check) == 1
+    assert _run_main(monkeypatch, "--out", str(out), "--check") == 1
+
+
+def test_render_environment_matches_dump_and_fix(tmp_path):
+    master_env = merge_envs.create_master_environment(
+        ["numpy", "pip", {"pip": ["foo"]}], name="eo"
+    )
+    out = tmp_path / "env.yml"
+    merge_envs.dump_environment(out, master_env)
+    merge_envs.fix_yml_indentation(out)
+    assert merge_envs.render_environment(master_env) == out.read_text()
+
+
+def test_cluster_environments_separates_conflicting_pins():
+    environments = {
+        name: [merge_envs.parse_spec(spec) for spec in specs]
+        for name, specs in {
+            "a": ["python=3.12", "numpy", "xarray"],
+            "b": ["python=3.12", "numpy>=2", "dask"],
+            "c": ["python=3.11", "numpy", "zarr=2.18"],
+            "d": ["zarr>=2", "numpy<2"],
+        }.items()
+    }
+    groups = merge_envs.cluster_environments(environments)
+    assert len(groups) == 2
+    for group in groups:
+        assert merge_envs._compatible(*(environments[m] for m in group))
+
+
+def test_build_environment_groups_maps_notebooks(tmp_path):
+    root = tmp_path / "notebooks"
+    (root / "courses" / "course").mkdir(parents=True)
+    (root / "tutorials").mkdir()
+    files = {
+        root / "courses" / "course.yml": "dependencies:\n  - python=3.11\n",
+        root / "tutorials" / "flood.yml": "dependencies:\n  - python=3.12\n  - dask\n",
+        root / "tutorials" / "other.yml": "dependencies:\n  - python\n",
+    }
+    for path, text in files.items():
+        path.write_text(text)
+    for notebook in ["courses/course/01.ipynb", "tutorials/flood.ipynb"]:
+        (root / notebook).write_text("{}")
+
+    conda, pip = merge_envs.aggregate_env_specs(list(files))
+    groups, kernels = merge_envs.build_environment_groups(list(files), conda, pip, root)
+    assert set(groups) == {"course", "flood"}
+    assert groups["flood"]["dependencies"] == ["dask", "python=3.12"]
+    assert kernels == {
+        "courses/course/01.ipynb": "course",
+        "tutorials/flood.ipynb": "flood",
+    }
+
+    changed = merge_envs.write_environment_groups(tmp_path / "envs", groups, kernels)
+    assert len(changed) == 3
+    assert merge_envs.write_environment_groups(tmp_path / "envs", groups, kernels) == []
+
+    # Kernels are named after the file, so two course.yml files would collide
+    (root / "tutorials" / "course.yml").write_text("dependencies:\n  - python\n")
+    files = [*files, root / "tutorials" / "course.yml"]
+    conda, pip = merge_envs.aggregate_env_specs(files)
+    with pytest.raises(ValueError, match="course"):
+        merge_envs.build_environment_groups(files, conda, pip, root)
+
+
+def test_environment_covers():
+    env_file = "notebooks/courses/course.yml"
+    assert merge_envs.environment_covers(env_file, "notebooks/courses/course.ipynb")
+    assert merge_envs.environment_covers(env_file, "notebooks/courses/course/a/1.ipynb")
+    assert not merge_envs.environment_covers(
+        env_file, "notebooks/courses/course2.ipynb"
+    )
+    assert not merge_envs.environment_covers(
+        env_file, "notebooks/courses/course_x/1.ipynb"
+    )
+    assert not merge_envs.environment_covers(env_file, "notebooks/other.ipynb")
@@ -0,0 +1,63 @@
+from pathlib import Path
+
+import nbformat
+import pytest  # noqa
+from eo_datascience.clean_nb import ConversionError, convert_notebooks
+from eo_datascience.nbio import read_notebook, reads_notebook, writes_notebook
+
+
+def _executed_notebook():
+    nb = nbformat.v4.new_notebook(metadata={"signature": "sha256:abc"})
+    nb.cells = [
+        nbformat.v4.new_markdown_cell(
+            "# Title\nwith ünïcode\n",
+            attachments={"a.svg": {"image/svg+xml": "<s/>\n"}},
+        ),
+        nbformat.v4.new_code_cell(
+            "print('x')\n1.5e-7",
+            execution_count=1,
+            outputs=[
+                nbformat.v4.new_output("stream", text="x\ny\n"),
+                nbformat.v4.new_output(
+                    "execute_result",
+                    {"text/plain": "1.5e-07\n", "application/json": {"a": [1e16]}},
+                    execution_count=1,
+                ),
+                nbformat.v4.new_output("error", ename="E", evalue="", traceback=[]),
+            ],
+        ),
+    ]
+    return nb
+
+
+def test_fast_io_is_byte_identical_to_nbformat():
+    nb = _executed_notebook()
+    text = nbformat.writes(nb)
+    fast = reads_notebook(text.encode("utf-8"))
+    assert type(fast) is dict
+    assert fast == nbformat.reads(text, as_version=4)
+    assert writes_notebook(fast) == text
+
+    for nb_path in Path("notebooks").rglob("*.ipynb"):
+        expected = nbformat.writes(nbformat.read(nb_path, as_version=4))
+        assert writes_notebook(read_notebook(nb_path)) == expected
+
+
+def test_non_finite_numbers_round_trip():
+    nb = _executed_notebook()
+    nb.cells[1].outputs[1].data["application/json"] = {"a": float("nan")}
+    nb.cells[1].metadata["limits"] = [float("-inf"), float("inf")]
+    text = nbformat.writes(nb)
+    assert "NaN" in text and "-Infinity" in text
+    assert writes_notebook(reads_notebook(text.encode("utf-8"))) == text
+
+
+def test_validation_is_opt_in(tmp_path):
+    nb = _executed_notebook()
+    del nb.cells[1]["execution_count"]
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "invalid.ipynb").write_text(nbformat.writes(nb))
+
+    convert_notebooks(tmp_path / "in", tmp_path / "out", stages=[])
+    with pytest.raises(ConversionError, match="ValidationError"):
+        convert_notebooks(tmp_path / "in", tmp_path / "out", stages=[], validate=True)
@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+
+import pytest  # noqa
+from eo_datascience.provision import (
+    environment_files,
+    format_results,
+    provision_environments,
+)
+
+
+class FakeInstaller:
+    # Stands in for conda: creates the prefix layout and tracks concurrency
+    def __init__(self, seconds=0.2, fail=()):
+        self.seconds = seconds
+        self.fail = set(fail)
+        self.installed = []
+        self.running = self.peak = 0
+        self.lock = threading.Lock()
+
+    def install(self, env_file, prefix):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.seconds)
+        with self.lock:
+            self.running -= 1
+            self.installed.append(env_file.stem)
+        if env_file.stem in self.fail:
+            raise RuntimeError("solver failed")
+        (prefix / "conda-meta").mkdir(parents=True, exist_ok=True)
+        (prefix / "bin").mkdir(exist_ok=True)
+        (prefix / "bin" / "python").write_text("")
+
+
+def _write_envs(root, names):
+    for name in names:
+        (root / "courses").mkdir(parents=True, exist_ok=True)
+        (root / "courses" / f"{name}.yml").write_text(
+            f"name: {name}\nchannels:\n  - conda-forge\ndependencies:\n  - numpy\n"
+        )
+    (root / "_toc.yml").write_text("root: intro\n")
+
+
+def test_provision_environments_concurrently_and_skip_unchanged(tmp_path):
+    _write_envs(tmp_path / "notebooks", ["a", "b", "c"])
+    files = environment_files(tmp_path / "notebooks")
+    assert [f.stem for f in files] == ["a", "b", "c"]
+
+    installer = FakeInstaller()
+    start = time.perf_counter()
+    results = provision_environments(
+        files, tmp_path / "envs", installer, jobs=3, kernel_dir=tmp_path / "jupyter"
+    )
+    assert time.perf_counter() - start < 0.5
+    assert installer.peak == 3
+    assert [r.status for r in results] == ["created"] * 3
+    spec = json.loads(
+        (tmp_path / "jupyter" / "kernels" / "b" / "kernel.json").read_text()
+    )
+    assert spec["argv"][0] == str((tmp_path / "envs" / "b" / "bin" / "python"))
+    assert spec["display_name"] == "b"
+
+    # Only the environment whose YAML changed is reinstalled
+    (tmp_path / "notebooks" / "courses" / "b.yml").write_text(
+        "channels:\n  - conda-forge\ndependencies:\n  - numpy\n  - xarray\n"
+    )
+    installer = FakeInstaller()
+    results = provision_environments(files, tmp_path / "envs", installer, jobs=3)
+    assert installer.installed == ["b"]
+    assert {r.name: r.status for r in results} == {
+        "a": "skipped",
+        "b": "updated",
+        "c": "skipped",
+    }
+
+
+def test_failed_environments_are_retried_and_reported(tmp_path):
+    _write_envs(tmp_path / "notebooks", ["a", "b"])
+    files = environment_files(tmp_path / "notebooks")
+    results = provision_environments(
+        files,
+        tmp_path / "envs",
+        FakeInstaller(0, fail={"a"}),
+        kernel_dir=tmp_path / "jupyter",
+    )
+    assert {r.name: r.status for r in results} == {"a": "failed", "b": "created"}
+    assert "solver failed" in format_results(results)
+    assert not (tmp_path / "jupyter" / "kernels" / "a").exists()
+
+    installer = FakeInstaller(0)
+    provision_environments(files, tmp_path / "envs", installer)
+    assert installer.installed == ["a"]
+
+
+def test_duplicate_environment_names_are_rejected(tmp_path):
+    _write_envs(tmp_path / "a", ["flood"])
+    _write_envs(tmp_path / "b", ["flood"])
+    installer = FakeInstaller()
+    with pytest.raises(ValueError, match="flood"):
+        provision_environments(
+            environment_files(tmp_path), tmp_path / "envs", installer
+        )
+    assert installer.installed == []
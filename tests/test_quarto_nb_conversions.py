@@ -1,21 +1,36 @@
+import base64
+import re
+import tracemalloc
 from pathlib import Path
+from unittest.mock import patch
 
 import nbformat  # noqa
 import pytest  # noqa
 import yaml
+from eo_datascience import outputs
 from eo_datascience.clean_nb import (
+    CACHE_MANIFEST,
+    DEFAULT_STAGES,
+    STAGES,
+    ConversionError,
+    build_pipeline,
     clean_up_frontmatter,
     convert_callout_notes,
+    convert_notebooks,
     convert_refs,
     find_ipynb,
     quarto_note_replace,
     quarto_ref_person_replace,
+    quarto_ref_replace,
     quarto_ref_time_replace,
     set_kernel_all_notebooks,
     substitute_path,
 )
+from eo_datascience.nbio import reads_notebook, writes_notebook
+from eo_datascience.profiling import Profiler
 from eo_datascience.render_sfinx_toc import (
     _render_toc,
+    build_file_index,
     extract_appendix,
     extract_main,
     rename_file_path,
@@ -141,6 +156,71 @@ def test_toc_conversion():
     assert _render_toc(quarto_toc) == yaml.safe_load(mock_jb_toc)
 
 
+def test_toc_conversion_of_nested_and_multiple_parts():
+    quarto_toc = yaml.safe_load("""
+    book:
+      chapters:
+        - index.qmd
+        - part: chapters/courses/a.qmd
+          chapters:
+            - chapters/courses/a/01.qmd
+        - part: chapters/courses/b.qmd
+          chapters:
+            - file: chapters/courses/b/01.qmd
+              sections:
+                - chapters/courses/b/01/deep.qmd
+            - chapters/courses/b/missing.qmd
+      appendices:
+        - part: "Extras"
+          chapters:
+            - chapters/extras/x.qmd
+        - chapters/references.qmd
+    """)
+    index = {
+        "chapters/courses/a.qmd",
+        "chapters/courses/a/01.qmd",
+        "chapters/courses/b.qmd",
+        "notebooks/courses/b/01.ipynb",
+        "chapters/courses/b/01/deep.qmd",
+        "chapters/extras/x.qmd",
+    }
+    missing = []
+    parts = _render_toc(quarto_toc, index, missing)["parts"]
+    assert [part["caption"] for part in parts] == [
+        "Preamble",
+        "Courses",
+        "Extras",
+        "References",
+    ]
+    assert parts[1]["chapters"] == [
+        {
+            "file": "notebooks/courses/a",
+            "sections": [{"file": "notebooks/courses/a/01"}],
+        },
+        {
+            "file": "notebooks/courses/b",
+            "sections": [
+                {
+                    "file": "notebooks/courses/b/01",
+                    "sections": [{"file": "notebooks/courses/b/01/deep"}],
+                },
+                {"file": "chapters/courses/b/missing.qmd"},
+            ],
+        },
+    ]
+    assert parts[2]["chapters"] == [{"file": "notebooks/extras/x"}]
+    assert missing == ["chapters/courses/b/missing.qmd"]
+
+
+def test_build_file_index_walks_once(tmp_path):
+    (tmp_path / "chapters" / "a" / ".quarto").mkdir(parents=True)
+    (tmp_path / "chapters" / "a" / "x.qmd").write_text("")
+    (tmp_path / "chapters" / "a" / ".quarto" / "y.qmd").write_text("")
+    (tmp_path / "notebooks").mkdir()
+    (tmp_path / "notebooks" / "z.ipynb").write_text("")
+    assert build_file_index(tmp_path) == {"chapters/a/x.qmd", "notebooks/z.ipynb"}
+
+
 def test_remove_front_matter():
     assert (
         clean_up_frontmatter("./tests", None, False)["cells"][0]["cell_type"]
@@ -185,7 +265,7 @@ def test_conversion_of_refs():
 
 def test_conversion_of_callout_notes():
     rst = ":::{note}\nThis a callout note.\n:::"
-    assert quarto_note_replace(r"::: {.callout-note}\nThis a callout note.\n:::") == rst
+    assert quarto_note_replace("::: {.callout-note}\nThis a callout note.\n:::") == rst
     assert convert_callout_notes("./tests", None, False)["cells"][1]["source"] == rst
 
 
@@ -196,3 +276,312 @@ def test_setting_kernelspec():
     new_meta_mock_nb = set_kernel_all_notebooks(dir="tests", save=False).metadata
     assert kernel_display_name_mock_nb != new_meta_mock_nb.kernelspec.display_name
     assert kernel_name_mock_nb != new_meta_mock_nb.kernelspec.name
+
+
+def _write_mock_book(root):
+    nb = nbformat.v4.new_notebook(
+        metadata={"kernelspec": {"name": "eo-datascience", "display_name": "eo"}}
+    )
+    nb.cells = [
+        nbformat.v4.new_markdown_cell("---\ntitle: Mock\nsubtitle: Book\n---\nText"),
+        nbformat.v4.new_markdown_cell("::: {.callout-note}\nA note.\n:::"),
+        nbformat.v4.new_markdown_cell("lorem ipsum [@anon2024] and @anon2025"),
+        nbformat.v4.new_code_cell("x = '[@not_a_ref]'"),
+    ]
+    (root / "chapter").mkdir(parents=True)
+    nbformat.write(nb, root / "chapter" / "mock.ipynb")
+    nbformat.write(nb, root / "references.ipynb")
+    return nb
+
+
+def test_kernel_stage_uses_kernel_map(tmp_path):
+    _write_mock_book(tmp_path / "in")
+    options = dict(kernel=dict(kernels={"chapter/mock.ipynb": "floodmapping"}))
+    convert_notebooks(tmp_path / "in", tmp_path / "out", ["kernel"], options=options)
+    mapped = nbformat.read(tmp_path / "out" / "chapter" / "mock.ipynb", as_version=4)
+    default = nbformat.read(tmp_path / "out" / "references.ipynb", as_version=4)
+    assert mapped.metadata.kernelspec.name == "floodmapping"
+    assert mapped.metadata.kernelspec.display_name == "floodmapping"
+    assert default.metadata.kernelspec.name == "python3"
+
+
+def test_pipeline_reads_and_writes_each_notebook_once(tmp_path):
+    _write_mock_book(tmp_path / "in")
+    with patch(
+        "eo_datascience.clean_nb.reads_notebook", wraps=reads_notebook
+    ) as read, patch(
+        "eo_datascience.clean_nb.writes_notebook", wraps=writes_notebook
+    ) as write:
+        convert_notebooks(tmp_path / "in", tmp_path / "out")
+    assert read.call_count == 2
+    assert write.call_count == 2
+
+    nb = nbformat.read(tmp_path / "out" / "chapter" / "mock.ipynb", as_version=4)
+    assert nb.metadata.kernelspec.name == "python3"
+    assert [cell.source for cell in nb.cells] == [
+        "# Mock\n**Book**\nText\n",
+        ":::{note}\nA note.\n:::",
+        "lorem ipsum {cite:p}`anon2024` and {cite:t}`anon2025`",
+        "x = '[@not_a_ref]'",
+    ]
+    refs = nbformat.read(tmp_path / "out" / "references.ipynb", as_version=4)
+    assert refs.cells[0].source.startswith("# References")
+
+
+def test_pipeline_stage_selection_and_order(tmp_path):
+    _write_mock_book(tmp_path / "in")
+    nbs = convert_notebooks(tmp_path / "in", stages=["refs", "kernel"], save=False)
+    assert nbs[0]["cells"][0]["source"].startswith("---")
+    assert nbs[0]["metadata"]["kernelspec"]["name"] == "python3"
+
+    pipeline = build_pipeline(["callouts", "refs", "kernel"])
+    assert [stage.name for stage in pipeline[0]] == ["callouts", "refs"]
+    assert pipeline[1] is STAGES["kernel"]
+    with pytest.raises(ValueError):
+        build_pipeline(["unknown"])
+
+
+def test_parallel_conversion_is_deterministic_and_collects_errors(tmp_path):
+    nb = _write_mock_book(tmp_path / "in")
+    for i in range(4):
+        nbformat.write(nb, tmp_path / "in" / "chapter" / f"nb{i}.ipynb")
+    (tmp_path / "in" / "broken.ipynb").write_text("{not json")
+
+    with pytest.raises(ConversionError) as e:
+        convert_notebooks(tmp_path / "in", tmp_path / "out", jobs=3)
+    assert list(e.value.errors) == [tmp_path / "in" / "broken.ipynb"]
+
+    serial = convert_notebooks(tmp_path / "out", save=False, jobs=1)
+    parallel = convert_notebooks(tmp_path / "out", save=False, jobs=3)
+    assert len(serial) == 6
+    assert serial == parallel
+
+
+def test_saved_notebooks_are_not_kept_in_memory(tmp_path):
+    (tmp_path / "in").mkdir()
+    output = nbformat.v4.new_output("stream", text=("y" * 99 + "\n") * 10000)
+    for i in range(8):
+        nb = nbformat.v4.new_notebook()
+        nb.cells = [nbformat.v4.new_code_cell("x", outputs=[output])]
+        nbformat.write(nb, tmp_path / "in" / f"{i}.ipynb")
+    size = sum(p.stat().st_size for p in (tmp_path / "in").iterdir())
+    tracemalloc.start()
+    try:
+        assert convert_notebooks(tmp_path / "in", tmp_path / "out", ["refs"]) is None
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # One notebook at a time, not the whole book
+    assert peak < size
+
+
+def test_incremental_conversion_cache(tmp_path):
+    nb = _write_mock_book(tmp_path / "in")
+    out = tmp_path / "out"
+    convert_notebooks(tmp_path / "in", out, cache=True)
+    assert (out / CACHE_MANIFEST).exists()
+    mtime = (out / "chapter" / "mock.ipynb").stat().st_mtime_ns
+
+    with patch("eo_datascience.clean_nb.reads_notebook") as read:
+        convert_notebooks(tmp_path / "in", out, cache=True)
+    assert read.call_count == 0
+
+    # A changed pipeline reconverts, but identical outputs are not rewritten
+    convert_notebooks(tmp_path / "in", out, stages=DEFAULT_STAGES[::-1], cache=True)
+    assert (out / "chapter" / "mock.ipynb").stat().st_mtime_ns == mtime
+
+    nb.cells.append(nbformat.v4.new_markdown_cell("more text"))
+    nbformat.write(nb, tmp_path / "in" / "chapter" / "mock.ipynb")
+    (tmp_path / "in" / "references.ipynb").unlink()
+    convert_notebooks(tmp_path / "in", out, cache=True)
+    converted = nbformat.read(out / "chapter" / "mock.ipynb", as_version=4)
+    assert converted.cells[-1].source == "more text"
+    assert not (out / "references.ipynb").exists()
+
+
+def test_conversion_of_refs_in_single_pass():
+    quarto = (
+        "See (@fig-map), [@anon2024; @anon2025] and @anon2026. Mail me@tuwien.ac.at"
+        " or run `f(@x)`.\n```python\n@decorator\n```\n[@a.b+c]"
+    )
+    assert quarto_ref_replace(quarto) == (
+        "See , {cite:p}`anon2024,anon2025` and {cite:t}`anon2026`. Mail"
+        " me@tuwien.ac.at or run `f(@x)`.\n```python\n@decorator\n```\n"
+        "{cite:p}`a.b+c`"
+    )
+    many = " ".join(f"[@key{i}] @key{i}" for i in range(5000))
+    converted = quarto_ref_replace(many)
+    assert converted.count("{cite:p}") == converted.count("{cite:t}") == 5000
+
+
+def test_conversion_of_nested_and_titled_callouts():
+    quarto = (
+        '::: {.callout-tip title="Tip: use dask" collapse="true"}\n'
+        "Body with a colon: here\n"
+        "::: {.callout-warning #warn}\n"
+        "## Careful\n"
+        "Nested body\n"
+        ":::\n"
+        ":::\n"
+        "::: {#refs}\n"
+        ":::\n"
+        "```\n"
+        "::: {.callout-caution}\n"
+        "```\n"
+    )
+    assert quarto_note_replace(quarto) == (
+        "::::{admonition} Tip: use dask\n"
+        ":class: tip dropdown\n"
+        "Body with a colon: here\n"
+        ":::{admonition} Careful\n"
+        ":class: warning\n"
+        ":name: warn\n"
+        "Nested body\n"
+        ":::\n"
+        "::::\n"
+        "::: {#refs}\n"
+        ":::\n"
+        "```\n"
+        "::: {.callout-caution}\n"
+        "```\n"
+    )
+    for kind in ("note", "tip", "warning", "important", "caution"):
+        quarto = f"::: {{.callout-{kind}}}\ntext\n:::"
+        assert quarto_note_replace(quarto) == f":::{{{kind}}}\ntext\n:::"
+    unclosed = "::: {.callout-note}\nno end\n"
+    assert quarto_note_replace(unclosed) == unclosed
+    large = "::: {.callout-note}\na: b\n:::\n" * 20000
+    assert quarto_note_replace(large).count(":::{note}") == 20000
+
+
+def test_offload_large_outputs(tmp_path):
+    png = base64.b64encode(b"\x89PNG" + bytes(4096)).decode()
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_code_cell(
+            "plot()",
+            outputs=[
+                nbformat.v4.new_output(
+                    "display_data", {"image/png": png, "text/plain": "<Figure>"}
+                ),
+                nbformat.v4.new_output("display_data", {"text/html": "<b>small</b>"}),
+                nbformat.v4.new_output(
+                    "execute_result", {"text/html": "<div>" + "x" * 4096 + "</div>"}
+                ),
+            ],
+        )
+    ]
+    (tmp_path / "in" / "sub").mkdir(parents=True)
+    nbformat.write(nb, tmp_path / "in" / "a.ipynb")
+    nbformat.write(nb, tmp_path / "in" / "sub" / "b.ipynb")
+
+    convert_notebooks(
+        tmp_path / "in",
+        tmp_path / "out",
+        stages=["offload"],
+        options=dict(offload=dict(threshold=1024)),
+    )
+    blobs = sorted(p.suffix for p in (tmp_path / "out" / "_outputs").iterdir())
+    assert blobs == [".html", ".png"]
+
+    converted = nbformat.read(tmp_path / "out" / "sub" / "b.ipynb", as_version=4)
+    image, small, html = converted.cells[0].outputs
+    link = image.metadata.offloaded["image/png"]
+    assert link.startswith("../_outputs/") and link.endswith(".png")
+    assert image.data == {"text/markdown": f"![]({link})", "text/plain": "<Figure>"}
+    assert small.data == {"text/html": "<b>small</b>"}
+    assert html.data["text/markdown"].startswith("```{raw} html\n:file: ../_outputs/")
+
+    restored = outputs.restore_outputs(converted, "sub/b.ipynb", tmp_path / "out")
+    assert restored.cells[0].outputs == nb.cells[0].outputs
+
+
+# Mimetype priority of jupyter-book's (myst-nb's) HTML output
+RENDER_PRIORITY = [
+    "application/vnd.jupyter.widget-view+json",
+    "application/javascript",
+    "text/html",
+    "image/svg+xml",
+    "image/png",
+    "image/jpeg",
+    "text/markdown",
+    "text/latex",
+    "text/plain",
+]
+
+
+def _render(output, nb_dir):
+    # The HTML a static build produces for an output, with linked scripts inlined
+    mime = next(m for m in RENDER_PRIORITY if m in output.data)
+    html = output.data[mime]
+    if mime == "application/javascript":
+        return f'<script type="text/javascript">{html}</script>'
+    for src in re.findall(r'<script type="text/javascript" src="([^"]+)">', html):
+        script = (nb_dir / src).read_text()
+        html = html.replace(f' src="{src}">', f">{script}")
+    return html
+
+
+def test_offloaded_scripts_still_render(tmp_path):
+    loader = "var Bokeh = {};" + " " * 4096
+    plot = "Bokeh.embed('plot');" + " " * 4096
+    load = {"application/javascript": loader}
+    load["application/vnd.bokehjs_load.v0+json"] = loader
+    show = {"text/html": '<div id="plot"></div>', "application/javascript": plot}
+    show["application/vnd.bokehjs_exec.v0+json"] = ""
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_code_cell(
+            "show(p)",
+            outputs=[
+                nbformat.v4.new_output("display_data", load),
+                nbformat.v4.new_output("display_data", show),
+            ],
+        )
+    ]
+    (tmp_path / "in" / "sub").mkdir(parents=True)
+    nbformat.write(nb, tmp_path / "in" / "sub" / "a.ipynb")
+    nb_dir = tmp_path / "out" / "sub"
+
+    convert_notebooks(
+        tmp_path / "in",
+        tmp_path / "out",
+        stages=["offload"],
+        options=dict(offload=dict(threshold=1024)),
+    )
+    converted = nbformat.read(nb_dir / "a.ipynb", as_version=4)
+    load_output, show_output = converted.cells[0].outputs
+    assert "application/javascript" not in load_output.data
+    # The renderers' JSON stays inline
+    assert load_output.data["application/vnd.bokehjs_load.v0+json"] == loader
+    assert show_output.data["text/html"].startswith('<div id="plot"></div>')
+    # The page still runs both scripts, and shows the plot's div
+    rendered = [_render(output, nb_dir) for output in converted.cells[0].outputs]
+    assert f'<script type="text/javascript">{loader}</script>' in rendered[0]
+    assert f'<script type="text/javascript">{plot}</script>' in rendered[1]
+    assert '<div id="plot"></div>' in rendered[1]
+
+    restored = outputs.restore_outputs(converted, "sub/a.ipynb", tmp_path / "out")
+    assert restored.cells[0].outputs == nb.cells[0].outputs
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_profiling_conversion(tmp_path, jobs):
+    _write_mock_book(tmp_path / "in")
+    profiler = Profiler()
+    convert_notebooks(tmp_path / "in", tmp_path / "out", jobs=jobs, profiler=profiler)
+    records = profiler.export()
+
+    item = "chapter/mock.ipynb"
+    assert records[("read", item)]["bytes_read"] > 0
+    assert records[("write", item)]["bytes_written"] > 0
+    assert records[("parse", item)]["cells"] == 4
+    assert records[("refs", item)]["cells"] == 3
+    assert records[("refs", item)]["changed_cells"] == 1
+    assert {"frontmatter", "kernel", "callouts", "bibliography"} <= {
+        stage for stage, _ in records
+    }
+
+    profiler.write(tmp_path / "report.json")
+    profiler.write(tmp_path / "report.csv")
+    assert (tmp_path / "report.csv").read_text().startswith("stage,item,")
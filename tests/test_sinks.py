@@ -0,0 +1,67 @@
+import zipfile
+
+import nbformat
+import pytest  # noqa
+from eo_datascience.clean_nb import convert_notebooks, iter_converted
+from eo_datascience.sinks import DirectorySink, MappingSink, Sink, ZipSink, write_all
+
+
+def _write_book(root):
+    nb = nbformat.v4.new_notebook(
+        metadata={"kernelspec": {"name": "eo-datascience", "display_name": "eo"}}
+    )
+    nb.cells = [
+        nbformat.v4.new_markdown_cell("---\ntitle: Mock\n---\nText"),
+        nbformat.v4.new_markdown_cell("::: {.callout-note}\nA note.\n:::"),
+    ]
+    (root / "chapter").mkdir(parents=True)
+    for rel_path in ["chapter/a.ipynb", "chapter/b.ipynb", "c.ipynb"]:
+        nbformat.write(nb, root / rel_path)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_iter_converted_yields_every_notebook(tmp_path, jobs):
+    _write_book(tmp_path / "in")
+    converted = list(iter_converted(tmp_path / "in", jobs=jobs))
+    assert [rel_path.as_posix() for rel_path, _ in converted] == [
+        "c.ipynb",
+        "chapter/a.ipynb",
+        "chapter/b.ipynb",
+    ]
+    for _, nb in converted:
+        assert nb["cells"][0]["source"].startswith("# Mock")
+        assert nb["metadata"]["kernelspec"]["name"] == "python3"
+    # Nothing is written next to the sources
+    assert sorted(p.name for p in (tmp_path / "in").rglob("*")) == [
+        "a.ipynb",
+        "b.ipynb",
+        "c.ipynb",
+        "chapter",
+    ]
+
+
+def test_sinks_match_converted_tree(tmp_path):
+    _write_book(tmp_path / "in")
+    convert_notebooks(tmp_path / "in", tmp_path / "out")
+
+    assert (
+        write_all(iter_converted(tmp_path / "in"), DirectorySink(tmp_path / "d")) == 3
+    )
+    write_all(iter_converted(tmp_path / "in"), ZipSink(tmp_path / "book.zip"))
+    sink = MappingSink()
+    write_all(iter_converted(tmp_path / "in"), sink)
+
+    with zipfile.ZipFile(tmp_path / "book.zip") as archive:
+        for rel_path in ["c.ipynb", "chapter/a.ipynb", "chapter/b.ipynb"]:
+            expected = (tmp_path / "out" / rel_path).read_bytes()
+            assert (tmp_path / "d" / rel_path).read_bytes() == expected
+            assert archive.read(rel_path) == expected
+            assert sink.mapping[rel_path]["cells"][1]["source"].startswith(":::")
+
+
+def test_sink_requires_add():
+    class Incomplete(Sink):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
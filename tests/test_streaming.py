@@ -0,0 +1,73 @@
+import base64
+import tracemalloc
+
+import nbformat
+import pytest  # noqa
+from eo_datascience.clean_nb import convert_notebooks
+from eo_datascience.streaming import RawJSON, read_notebook_streaming
+
+
+def _large_notebook(size):
+    png = base64.b64encode(bytes(size)).decode()
+    nb = nbformat.v4.new_notebook(
+        metadata={"kernelspec": {"name": "eo-datascience", "display_name": "eo"}}
+    )
+    nb.cells = [
+        nbformat.v4.new_markdown_cell(
+            "---\ntitle: Big\n---\n::: {.callout-note}\nSee [@anon2024].\n:::",
+            attachments={"a.png": {"image/png": png[:64]}},
+        ),
+        nbformat.v4.new_code_cell(
+            "plot()",
+            execution_count=1,
+            outputs=[
+                nbformat.v4.new_output(
+                    "display_data", {"image/png": png, "text/plain": "<Figure>"}
+                ),
+                nbformat.v4.new_output("stream", text='done\n"quoted" \\ ü\n'),
+            ],
+        ),
+        nbformat.v4.new_raw_cell("raw"),
+    ]
+    return nb
+
+
+def test_streaming_matches_regular_conversion(tmp_path):
+    (tmp_path / "in" / "sub").mkdir(parents=True)
+    nbformat.write(_large_notebook(4096), tmp_path / "in" / "sub" / "a.ipynb")
+    nbformat.write(_large_notebook(0), tmp_path / "in" / "b.ipynb")
+
+    convert_notebooks(tmp_path / "in", tmp_path / "full")
+    convert_notebooks(tmp_path / "in", tmp_path / "stream", stream=True)
+    for rel_path in ["sub/a.ipynb", "b.ipynb"]:
+        full = (tmp_path / "full" / rel_path).read_bytes()
+        assert (tmp_path / "stream" / rel_path).read_bytes() == full
+    converted = convert_notebooks(tmp_path / "in", save=False, stream=True)
+    outputs = converted[0]["cells"][1]["outputs"]
+    assert isinstance(outputs, RawJSON)
+    assert outputs.load()[1]["text"] == ["done\n", '"quoted" \\ ü\n']
+
+
+def test_streaming_memory_does_not_grow_with_outputs(tmp_path):
+    (tmp_path / "in").mkdir()
+    nbformat.write(_large_notebook(8 * 2**20), tmp_path / "in" / "big.ipynb")
+
+    tracemalloc.start()
+    try:
+        convert_notebooks(tmp_path / "in", tmp_path / "out", stream=True)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # Roughly one copy buffer, far below the size of the output itself
+    assert peak < 4 * 2**20
+    nb = read_notebook_streaming(tmp_path / "out" / "big.ipynb")
+    assert nb["cells"][0]["source"].startswith("# Big")
+
+
+def test_streaming_rejects_stages_that_need_outputs(tmp_path):
+    (tmp_path / "in").mkdir()
+    nbformat.write(_large_notebook(0), tmp_path / "in" / "a.ipynb")
+    with pytest.raises(ValueError, match="offload"):
+        convert_notebooks(tmp_path / "in", tmp_path / "out", ["offload"], stream=True)
+    with pytest.raises(ValueError, match="Validation"):
+        convert_notebooks(tmp_path / "in", tmp_path / "out", validate=True, stream=True)
@@ -0,0 +1,88 @@
+import queue
+import threading
+import time
+
+import nbformat
+import pytest  # noqa
+import yaml
+from eo_datascience.watch import debounce, watch
+
+QUARTO = {
+    "book": {
+        "chapters": [
+            "index.qmd",
+            {"part": "chapters/courses.qmd", "chapters": ["chapters/courses/a.qmd"]},
+        ],
+        "appendices": [
+            {"part": "chapters/templates/t.qmd", "chapters": ["chapters/b.qmd"]},
+            "chapters/references.qmd",
+        ],
+    }
+}
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_debounce_collects_bursts():
+    events, stop = queue.Queue(), threading.Event()
+    for i in range(5):
+        events.put(i)
+    assert debounce(events, stop, delay=0.05) == {0, 1, 2, 3, 4}
+
+
+def test_watch_reconverts_touched_notebooks(tmp_path):
+    notebooks = tmp_path / "notebooks"
+    notebooks.mkdir()
+    nb = nbformat.v4.new_notebook(
+        metadata={"kernelspec": {"name": "eo", "display_name": "eo"}}
+    )
+    nb.cells = [nbformat.v4.new_markdown_cell("see @anon2024")]
+    nbformat.write(nb, notebooks / "a.ipynb")
+    nbformat.write(nb, notebooks / "b.ipynb")
+    quarto = tmp_path / "_quarto.yml"
+    quarto.write_text(yaml.dump(QUARTO))
+    out = tmp_path / "_preview" / "notebooks"
+
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=watch,
+        args=(notebooks, out),
+        kwargs=dict(
+            quarto=quarto,
+            toc_dir=out.parent,
+            delay=0.05,
+            poll_interval=0.05,
+            use_inotify=False,
+            stop=stop,
+        ),
+    )
+    thread.start()
+    try:
+        assert _wait_for(lambda: (out / "b.ipynb").exists())
+        untouched = (out / "b.ipynb").stat().st_mtime_ns
+
+        nb.cells[0].source = "see @anon2025"
+        nbformat.write(nb, notebooks / "a.ipynb")
+        assert _wait_for(lambda: "anon2025" in (out / "a.ipynb").read_text())
+
+        (notebooks / "a.ipynb").unlink()
+        assert _wait_for(lambda: not (out / "a.ipynb").exists())
+
+        quarto.write_text(yaml.dump(QUARTO) + "\n# comment only\n")
+        time.sleep(0.5)
+        assert not (out.parent / "_toc.yml").exists()
+
+        QUARTO["book"]["chapters"][1]["chapters"].append("chapters/courses/c.qmd")
+        quarto.write_text(yaml.dump(QUARTO))
+        assert _wait_for(lambda: (out.parent / "_toc.yml").exists())
+        assert (out / "b.ipynb").stat().st_mtime_ns == untouched
+    finally:
+        stop.set()
+        thread.join()